@@ -0,0 +1,420 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+レンダリング・エクスポート速度のベンチマーク
+サンプル数式と大きな数式（行列・長い align*・深い分数）について、
+プレビューと保存のコールド／ウォームの所要時間と、一括変換のスループットを測る。
+
+使い方:
+    python bench_render.py -o bench.json
+    python bench_render.py -o bench_new.json --compare bench.json
+
+結果は JSON で書き出すので、バージョン間で比較できる。
+"""
+
+import argparse
+import functools
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from dataclasses import replace
+from datetime import datetime, timezone
+from pathlib import Path
+
+import matplotlib
+
+from latex_batch import render_batch
+from latex_render import (
+    BACKENDS,
+    DEFAULT_PREAMBLE,
+    SAMPLE_EQUATIONS,
+    SAVE_FORMATS,
+    RenderOptions,
+    compile_artifact,
+    configure_matplotlib,
+    current_preamble,
+    render_cached,
+    render_to_bytes,
+    resolve_backend,
+)
+from render_cache import RenderCache
+
+# 結果 JSON の形式のバージョン（キーを変えたら上げる）
+SCHEMA_VERSION = 1
+
+# プレビューの解像度（エディタの Figure と同じ）
+PREVIEW_DPI = 100
+
+PATHS = ["preview", "save", "save_after_preview"]
+
+
+def stress_equations():
+    """大きな数式（名前, 数式）のリスト"""
+    n = 12
+    rows = [
+        " & ".join(f"a_{{{i},{j}}}" for j in range(1, n + 1)) for i in range(1, n + 1)
+    ]
+    pmatrix = r"\begin{pmatrix}" + r"\\".join(rows) + r"\end{pmatrix}"
+
+    lines = [r"f(x) &= \sum_{k=0}^{\infty} \frac{x^k}{k!}"]
+    for k in range(1, 40):
+        lines.append(
+            rf"&= \int_0^{{{k}}} \left( \frac{{x^{{{k}}}}}{{{k}!}} + y_{{{k}}} \right) dy"
+        )
+    align = r"\begin{align*}" + r"\\".join(lines) + r"\end{align*}"
+
+    frac = "x"
+    for k in range(12):
+        frac = rf"\frac{{1}}{{{k + 1} + {frac}}}"
+
+    return [
+        ("pmatrix 12x12", pmatrix),
+        ("align* 40 行", align),
+        ("入れ子の分数 12 段", frac),
+    ]
+
+
+def salted(equation, salt):
+    """出力を変えずに数式を一意にする（キャッシュに当たらないコールド測定用）
+
+    未定義の制御綴を \\csname で作ると \\relax になり、何も出力しない。
+    """
+    return f"{equation} \\csname bench{salt}\\endcsname"
+
+
+def new_salt():
+    return uuid.uuid4().hex[:12]
+
+
+def isolate_tex_cache(directory):
+    """matplotlib の TeX キャッシュ（tex.cache）をベンチマーク用のフォルダに切り替える"""
+    from matplotlib.texmanager import TexManager
+
+    TexManager._cache_dir = Path(directory)
+
+
+def timed(func, *args):
+    """(結果, 所要時間 ms)"""
+    start = time.perf_counter()
+    result = func(*args)
+    return result, (time.perf_counter() - start) * 1000
+
+
+def summarize(samples):
+    """所要時間のリストの要約統計"""
+    ordered = sorted(samples)
+    return {
+        "min": ordered[0],
+        "median": statistics.median(ordered),
+        "p95": ordered[min(len(ordered) - 1, round(0.95 * (len(ordered) - 1)))],
+        "max": ordered[-1],
+        "n": len(ordered),
+    }
+
+
+def render_preview(equation, options, cache):
+    """エディタのプレビューと同じ処理 ((PNG, RenderArtifact または None) を返す)"""
+    if resolve_backend(options) == "dvi":
+        artifact = compile_artifact(equation, options, preview=True)
+        return artifact.export(options), artifact
+    return render_cached(equation, options, cache), None
+
+
+def measure_path(path, equation, options, cache, repeat):
+    """1 つの経路のコールド（初回）とウォーム（2 回目以降）の所要時間を測る"""
+    preview_options = replace(options, save_format="png", dpi=PREVIEW_DPI)
+    if path == "preview":
+        run = functools.partial(render_preview, equation, preview_options, cache)
+    elif path == "save":
+        run = functools.partial(render_cached, equation, options, cache)
+    else:
+        # 直前のプレビューのコンパイル結果を保存に使う（dvi 方式のみ）
+        if resolve_backend(options) != "dvi":
+            return None
+        _, artifact = render_preview(equation, preview_options, cache)
+        run = functools.partial(artifact.export, options)
+
+    _, cold = timed(run)
+    warm = [timed(run)[1] for _ in range(repeat)]
+    return {"cold_ms": cold, "warm_ms": summarize(warm)}
+
+
+def run_latency(cases, backends, formats, options, cache_dir, repeat, log):
+    """全数式・経路・形式・描画方式のレイテンシを測る"""
+    results = []
+    for backend in backends:
+        for fmt in formats:
+            target = replace(options, backend=backend, save_format=fmt)
+            resolved = resolve_backend(target)
+            for name, equation in cases:
+                for path in PATHS:
+                    # 測定ごとに空のキャッシュと一意な数式を使う
+                    cache = RenderCache(Path(cache_dir, new_salt()))
+                    entry = {
+                        "case": name,
+                        "path": path,
+                        "format": fmt,
+                        "backend": backend,
+                        "resolved_backend": resolved,
+                    }
+                    try:
+                        measured = measure_path(
+                            path, salted(equation, new_salt()), target, cache, repeat
+                        )
+                    except Exception as e:
+                        entry["error"] = str(e).splitlines()[0] if str(e) else repr(e)
+                    else:
+                        if measured is None:
+                            continue
+                        entry.update(measured)
+                    finally:
+                        shutil.rmtree(cache.directory, ignore_errors=True)
+                    results.append(entry)
+                    log(format_latency(entry))
+    return results
+
+
+def run_throughput(cases, backends, group_sizes, options, copies, jobs, log):
+    """一括変換のスループット（数式/秒）を測る（キャッシュなし）"""
+    results = []
+    for backend in backends:
+        target = replace(options, backend=backend)
+        for group_size in group_sizes:
+            equations = [
+                salted(equation, new_salt())
+                for _ in range(copies)
+                for _, equation in cases
+            ]
+            with tempfile.TemporaryDirectory() as output_dir:
+                start = time.perf_counter()
+                batch = render_batch(
+                    equations,
+                    output_dir,
+                    target,
+                    jobs,
+                    preamble=current_preamble(),
+                    cache_dir=None,
+                    group_size=group_size,
+                )
+                seconds = time.perf_counter() - start
+            failed = sum(1 for _, ok, _ in batch if not ok)
+            entry = {
+                "backend": backend,
+                "resolved_backend": resolve_backend(target),
+                "format": target.save_format,
+                "group_size": group_size,
+                "jobs": jobs or os.cpu_count(),
+                "equations": len(equations),
+                "failed": failed,
+                "seconds": seconds,
+                "eq_per_sec": len(equations) / seconds,
+            }
+            results.append(entry)
+            log(
+                f"throughput {backend}/{entry['format']} group={group_size}: "
+                f"{entry['eq_per_sec']:.1f} eq/s ({failed} 件失敗)"
+            )
+    return results
+
+
+def tool_versions():
+    """TeX 関連ツールの有無とバージョン（1 行目）"""
+    versions = {}
+    for tool in ["latex", "dvipng", "dvisvgm", "dvipdfmx", "gs", "pdftex"]:
+        exe = shutil.which(tool)
+        if exe is None:
+            versions[tool] = None
+            continue
+        try:
+            out = subprocess.run(
+                [exe, "--version"], capture_output=True, text=True, timeout=10
+            ).stdout
+        except (OSError, subprocess.SubprocessError):
+            out = ""
+        versions[tool] = out.splitlines()[0] if out else exe
+    return versions
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            capture_output=True,
+            text=True,
+            cwd=Path(__file__).parent,
+        ).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def environment():
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "cpu_count": os.cpu_count(),
+        "matplotlib": matplotlib.__version__,
+        "tools": tool_versions(),
+    }
+
+
+def format_latency(entry):
+    label = f"{entry['backend']}/{entry['format']} {entry['path']:<18} {entry['case']}"
+    if "error" in entry:
+        return f"{label}: エラー {entry['error']}"
+    return (
+        f"{label}: cold {entry['cold_ms']:.1f} ms, "
+        f"warm {entry['warm_ms']['median']:.1f} ms"
+    )
+
+
+def compare(old, new, threshold):
+    """前回の結果と比べ、ウォームの中央値が threshold 倍を超えて遅くなった項目を返す"""
+
+    def index(report):
+        return {
+            (e["case"], e["path"], e["format"], e["backend"]): e
+            for e in report["latency"]
+            if "warm_ms" in e
+        }
+
+    old_index = index(old)
+    regressions = []
+    for key, entry in index(new).items():
+        before = old_index.get(key)
+        if before is None:
+            continue
+        ratio = entry["warm_ms"]["median"] / max(before["warm_ms"]["median"], 1e-9)
+        if ratio > threshold:
+            regressions.append(
+                (key, before["warm_ms"]["median"], entry["warm_ms"]["median"], ratio)
+            )
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="レンダリング・エクスポート速度のベンチマーク")
+    parser.add_argument("-o", "--output", default="bench.json", help="結果の JSON ファイル")
+    parser.add_argument(
+        "--formats", default=",".join(SAVE_FORMATS), help="測定する保存形式（カンマ区切り）"
+    )
+    parser.add_argument(
+        "--backends", default=",".join(BACKENDS), help="測定する描画方式（カンマ区切り）"
+    )
+    parser.add_argument("--repeat", type=int, default=5, help="ウォーム測定の回数")
+    parser.add_argument("--fontsize", type=int, default=24, help="フォントサイズ")
+    parser.add_argument(
+        "--no-stress", action="store_true", help="大きな数式を測定しない"
+    )
+    parser.add_argument(
+        "--copies", type=int, default=4, help="スループット測定で各数式を何回変換するか"
+    )
+    parser.add_argument(
+        "--group-sizes", default="1,32", help="スループット測定の --group-size（カンマ区切り）"
+    )
+    parser.add_argument(
+        "--no-throughput", action="store_true", help="スループットを測定しない"
+    )
+    parser.add_argument(
+        "-j", "--jobs", type=int, default=None, help="並列数（既定: CPU コア数）"
+    )
+    parser.add_argument(
+        "--no-precompile", action="store_true", help="プリアンブルのプリコンパイルを使わない"
+    )
+    parser.add_argument("--compare", default=None, help="比較する前回の結果 JSON")
+    parser.add_argument(
+        "--threshold", type=float, default=1.2, help="遅くなったとみなす比率（既定: 1.2）"
+    )
+    args = parser.parse_args(argv)
+
+    formats = [f.strip() for f in args.formats.split(",") if f.strip()]
+    backends = [b.strip() for b in args.backends.split(",") if b.strip()]
+    group_sizes = [int(g) for g in args.group_sizes.split(",") if g.strip()]
+    cases = list(SAMPLE_EQUATIONS)
+    if not args.no_stress:
+        cases += stress_equations()
+
+    def log(message):
+        print(message, file=sys.stderr, flush=True)
+
+    configure_matplotlib(DEFAULT_PREAMBLE, not args.no_precompile)
+    options = RenderOptions(fontsize=args.fontsize)
+
+    with tempfile.TemporaryDirectory() as workdir:
+        # ユーザーの TeX キャッシュを汚さないよう、一時フォルダを使う
+        isolate_tex_cache(Path(workdir, "tex.cache"))
+
+        # プロセスで最初の描画（import 後の初期化・フォーマットファイルの作成を含む）
+        first_render = {}
+        for backend in backends:
+            target = replace(
+                options, backend=backend, save_format="png", dpi=PREVIEW_DPI
+            )
+            try:
+                _, ms = timed(render_to_bytes, salted("x", new_salt()), target)
+            except Exception as e:
+                log(f"{backend}: 描画できません: {e}")
+                ms = None
+            first_render[backend] = ms
+
+        latency = run_latency(
+            cases,
+            backends,
+            formats,
+            options,
+            Path(workdir, "renders"),
+            args.repeat,
+            log,
+        )
+        throughput = []
+        if not args.no_throughput:
+            throughput = run_throughput(
+                cases, backends, group_sizes, options, args.copies, args.jobs, log
+            )
+
+    report = {
+        "schema": SCHEMA_VERSION,
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "commit": git_commit(),
+        "environment": environment(),
+        "settings": {
+            "repeat": args.repeat,
+            "fontsize": args.fontsize,
+            "preview_dpi": PREVIEW_DPI,
+            "precompile": not args.no_precompile,
+            "formats": formats,
+            "backends": backends,
+            "group_sizes": group_sizes,
+            "copies": args.copies,
+        },
+        "first_render_ms": first_render,
+        "latency": latency,
+        "throughput": throughput,
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    log(f"結果を保存しました: {args.output}")
+
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            old = json.load(f)
+        regressions = compare(old, report, args.threshold)
+        for (case, path, fmt, backend), before, after, ratio in regressions:
+            print(
+                f"[遅延] {backend}/{fmt} {path} {case}: "
+                f"{before:.1f} ms → {after:.1f} ms ({ratio:.2f} 倍)"
+            )
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
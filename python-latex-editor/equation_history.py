@@ -0,0 +1,312 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+数式の履歴とライブラリ（SQLite）
+描画した数式をオプションと小さなサムネイル（PNG）と一緒に保存し、前方一致と
+全文検索で探せるようにする。お気に入り（pinned）にした数式はライブラリとして
+履歴の上限で削除されない。
+
+数万件でも一覧が重くならないよう、検索は id のリストだけを返し、数式の内容
+（rows）とサムネイル（thumbnail）は表示する分だけ別に読み込む。全文検索は
+SQLite の FTS5（trigram、なければ unicode61）を使い、FTS5 がなければ LIKE で探す。
+
+接続はスレッドごとに作るので、エディタのバックグラウンドスレッドからも使える
+（WAL モードなので読み込みは書き込みを待たない）。
+"""
+
+import io
+import json
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+DEFAULT_HISTORY_FILE = Path.home() / ".local" / "share" / "latex_editor" / "history.db"
+# 履歴の上限（お気に入りは数えない）
+DEFAULT_MAX_ENTRIES = 50000
+# サムネイルの最大サイズ (px)
+THUMBNAIL_WIDTH = 240
+THUMBNAIL_HEIGHT = 40
+# 検索の方式（prefix: 前方一致, text: 全文検索）
+SEARCH_MODES = ["prefix", "text"]
+# 履歴に保存するオプション（保存形式と解像度は数式の見た目に関係しない）
+HISTORY_OPTIONS = ["fontsize", "bgcolor", "displaystyle", "backend"]
+# 上限を超えた履歴を削除する間隔（記録の回数）
+PRUNE_INTERVAL = 100
+# 他のエディタが書き込み中のときに待つ最大時間（秒）
+BUSY_TIMEOUT = 5
+
+SCHEMA_VERSION = 1
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS equations (
+    id INTEGER PRIMARY KEY,
+    key TEXT NOT NULL UNIQUE,
+    equation TEXT NOT NULL,
+    options TEXT NOT NULL,
+    pinned INTEGER NOT NULL DEFAULT 0,
+    use_count INTEGER NOT NULL DEFAULT 1,
+    created REAL NOT NULL,
+    last_used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS equations_equation ON equations (equation);
+CREATE INDEX IF NOT EXISTS equations_order ON equations (pinned, last_used);
+CREATE TABLE IF NOT EXISTS thumbnails (
+    id INTEGER PRIMARY KEY REFERENCES equations (id) ON DELETE CASCADE,
+    png BLOB NOT NULL
+);
+"""
+# 全文検索の索引（content テーブルの equations とトリガーで同期する）
+_FTS_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS equations_fts USING fts5 (
+    equation, content='equations', content_rowid='id', tokenize='{tokenizer}'
+);
+CREATE TRIGGER IF NOT EXISTS equations_fts_insert AFTER INSERT ON equations BEGIN
+    INSERT INTO equations_fts (rowid, equation) VALUES (new.id, new.equation);
+END;
+CREATE TRIGGER IF NOT EXISTS equations_fts_delete AFTER DELETE ON equations BEGIN
+    INSERT INTO equations_fts (equations_fts, rowid, equation)
+    VALUES ('delete', old.id, old.equation);
+END;
+"""
+_ORDER = "ORDER BY pinned DESC, last_used DESC"
+# trigram で検索できる最短の語（短い語は LIKE で探す）
+_TRIGRAM_MIN = 3
+
+
+def history_options(options):
+    """RenderOptions から履歴に保存するオプションの辞書を作成"""
+    return {name: getattr(options, name) for name in HISTORY_OPTIONS}
+
+
+def entry_key(equation, options):
+    """数式とオプションの組み合わせごとに 1 件にするためのキー"""
+    return json.dumps(
+        [equation, history_options(options)], sort_keys=True, ensure_ascii=False
+    )
+
+
+def make_thumbnail(png, width=THUMBNAIL_WIDTH, height=THUMBNAIL_HEIGHT):
+    """プレビューの PNG を縦横比を保って縮小した PNG（Pillow がなければ None）"""
+    try:
+        from PIL import Image
+    except ImportError:
+        return None
+    with Image.open(io.BytesIO(png)) as image:
+        image.thumbnail((width, height), Image.LANCZOS)
+        output = io.BytesIO()
+        image.save(output, format="PNG", optimize=True)
+    return output.getvalue()
+
+
+def _escape_like(text):
+    return text.replace("!", "!!").replace("%", "!%").replace("_", "!_")
+
+
+def _prefix_upper_bound(prefix):
+    """prefix で始まる文字列がすべてこれより小さくなる文字列"""
+    return prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+
+class HistoryStore:
+    """数式の履歴（SQLite のファイル 1 つ）"""
+
+    def __init__(self, path=DEFAULT_HISTORY_FILE, max_entries=DEFAULT_MAX_ENTRIES):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.max_entries = max_entries
+        self._local = threading.local()
+        self._records = 0
+        # 全文検索のトークナイザ（trigram / unicode61、FTS5 がなければ None）
+        self.tokenizer = self._create_schema()
+
+    def _connect(self):
+        """このスレッドの接続"""
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=BUSY_TIMEOUT)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.execute("PRAGMA foreign_keys=ON")
+            self._local.connection = connection
+        return connection
+
+    def _create_schema(self):
+        connection = self._connect()
+        with connection:
+            connection.executescript(_SCHEMA)
+            connection.execute(f"PRAGMA user_version={SCHEMA_VERSION}")
+        row = connection.execute(
+            "SELECT sql FROM sqlite_master WHERE name = 'equations_fts'"
+        ).fetchone()
+        if row is not None:
+            return "trigram" if "trigram" in row[0] else "unicode61"
+        for tokenizer in ("trigram", "unicode61"):
+            try:
+                with connection:
+                    connection.executescript(_FTS_SCHEMA.format(tokenizer=tokenizer))
+                    # 既存の履歴（FTS5 のない環境で作ったものなど）を索引に入れる
+                    connection.execute(
+                        "INSERT INTO equations_fts (equations_fts) VALUES ('rebuild')"
+                    )
+                return tokenizer
+            except sqlite3.OperationalError:
+                continue  # このトークナイザ（または FTS5）に対応していない
+        return None
+
+    def close(self):
+        """このスレッドの接続を閉じる"""
+        connection = getattr(self._local, "connection", None)
+        if connection is not None:
+            connection.close()
+            self._local.connection = None
+
+    def record(self, equation, options, png=None):
+        """数式を履歴に追加し、id を返す（同じ数式・オプションなら使用回数を増やす）
+
+        png はプレビューの画像で、縮小してサムネイルとして保存する。
+        """
+        now = time.time()
+        thumbnail = make_thumbnail(png) if png is not None else None
+        connection = self._connect()
+        with connection:
+            connection.execute(
+                "INSERT INTO equations"
+                " (key, equation, options, created, last_used)"
+                " VALUES (?, ?, ?, ?, ?)"
+                " ON CONFLICT (key) DO UPDATE SET"
+                " use_count = use_count + 1, last_used = excluded.last_used",
+                (
+                    entry_key(equation, options),
+                    equation,
+                    json.dumps(history_options(options), sort_keys=True),
+                    now,
+                    now,
+                ),
+            )
+            (entry_id,) = connection.execute(
+                "SELECT id FROM equations WHERE key = ?",
+                (entry_key(equation, options),),
+            ).fetchone()
+            if thumbnail is not None:
+                connection.execute(
+                    "INSERT OR REPLACE INTO thumbnails (id, png) VALUES (?, ?)",
+                    (entry_id, thumbnail),
+                )
+        self._records += 1
+        if self._records % PRUNE_INTERVAL == 0:
+            self.prune()
+        return entry_id
+
+    def search(self, query="", mode="prefix", pinned_only=False):
+        """条件に合う id のリスト（お気に入り → 最近使った順）
+
+        prefix は数式の先頭との一致（大文字・小文字を区別）、text は空白で区切った
+        語をすべて含むもの（大文字・小文字を区別しない）。query が空ならすべて。
+        """
+        conditions = []
+        params = []
+        query = query.strip()
+        if query and mode == "prefix":
+            # 索引を使えるよう LIKE ではなく範囲で探す
+            conditions.append("equation >= ? AND equation < ?")
+            params += [query, _prefix_upper_bound(query)]
+        elif query:
+            match, like = self._text_terms(query.split())
+            if match:
+                conditions.append(
+                    "id IN (SELECT rowid FROM equations_fts"
+                    " WHERE equations_fts MATCH ?)"
+                )
+                params.append(match)
+            for term in like:
+                conditions.append("equation LIKE ? ESCAPE '!'")
+                params.append(f"%{_escape_like(term)}%")
+        if pinned_only:
+            conditions.append("pinned = 1")
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        rows = self._connect().execute(
+            f"SELECT id FROM equations {where} {_ORDER}", params
+        )
+        return [entry_id for (entry_id,) in rows]
+
+    def _text_terms(self, terms):
+        """全文検索の語を (FTS5 の MATCH 式, LIKE で探す語のリスト) に分ける"""
+        match = []
+        like = []
+        for term in terms:
+            quoted = '"' + term.replace('"', '""') + '"'
+            if self.tokenizer == "trigram" and len(term) >= _TRIGRAM_MIN:
+                match.append(quoted)
+            elif self.tokenizer == "unicode61" and term.isalnum():
+                match.append(quoted + "*")  # \frac は frac で索引されている
+            else:
+                like.append(term)
+        return " AND ".join(match), like
+
+    def rows(self, ids):
+        """id -> {"id", "equation", "options", "pinned", "use_count", "last_used"}"""
+        result = {}
+        ids = list(ids)
+        connection = self._connect()
+        # SQLite の変数の数の上限より少なく分けて読む
+        for start in range(0, len(ids), 500):
+            chunk = ids[start : start + 500]
+            placeholders = ",".join("?" * len(chunk))
+            for row in connection.execute(
+                "SELECT id, equation, options, pinned, use_count, last_used"
+                f" FROM equations WHERE id IN ({placeholders})",
+                chunk,
+            ):
+                result[row[0]] = {
+                    "id": row[0],
+                    "equation": row[1],
+                    "options": json.loads(row[2]),
+                    "pinned": bool(row[3]),
+                    "use_count": row[4],
+                    "last_used": row[5],
+                }
+        return result
+
+    def thumbnail(self, entry_id):
+        """サムネイルの PNG（なければ None）"""
+        row = (
+            self._connect()
+            .execute("SELECT png FROM thumbnails WHERE id = ?", (entry_id,))
+            .fetchone()
+        )
+        return row[0] if row is not None else None
+
+    def count(self):
+        (n,) = self._connect().execute("SELECT COUNT(*) FROM equations").fetchone()
+        return n
+
+    def set_pinned(self, entry_id, pinned=True):
+        """お気に入り（ライブラリ）に追加・解除"""
+        with self._connect() as connection:
+            connection.execute(
+                "UPDATE equations SET pinned = ? WHERE id = ?", (int(pinned), entry_id)
+            )
+
+    def touch(self, entry_id):
+        """履歴から挿入したときに最近使った順の先頭に移す"""
+        with self._connect() as connection:
+            connection.execute(
+                "UPDATE equations SET use_count = use_count + 1, last_used = ?"
+                " WHERE id = ?",
+                (time.time(), entry_id),
+            )
+
+    def delete(self, entry_id):
+        with self._connect() as connection:
+            connection.execute("DELETE FROM equations WHERE id = ?", (entry_id,))
+
+    def prune(self):
+        """お気に入り以外の履歴を、古いものから上限の件数まで削除し、削除した件数を返す"""
+        with self._connect() as connection:
+            cursor = connection.execute(
+                "DELETE FROM equations WHERE id IN ("
+                " SELECT id FROM equations WHERE pinned = 0"
+                " ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+        return cursor.rowcount
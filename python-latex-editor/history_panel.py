@@ -0,0 +1,326 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+数式の履歴パネル（エディタの横に表示）
+equation_history.HistoryStore の数式を、最近使った順にサムネイル付きで一覧表示する。
+
+数万件あっても重くならないよう、Canvas には見えている行だけを描き、スクロールの
+たびに描き直す（仮想リスト）。検索・サムネイルの読み込み・履歴の記録は
+バックグラウンドスレッドで行い、サムネイルは見えている行の分だけ読み込んで
+PhotoImage を上限付きで保持する。
+"""
+
+import base64
+import queue
+import threading
+import tkinter as tk
+from collections import OrderedDict
+from tkinter import ttk
+
+from equation_history import SEARCH_MODES
+
+# 一覧の幅、1 行の高さとサムネイルの位置 (px)
+LIST_WIDTH = 260
+ROW_HEIGHT = 64
+ROW_PADDING = 4
+# 見えている範囲の前後に余分に描く行数
+OVERSCAN_ROWS = 2
+# 保持するサムネイル（PhotoImage）と行の内容の上限
+THUMBNAIL_CACHE = 256
+ROW_CACHE = 2000
+# 検索語の入力が止まってから検索するまでの待ち時間 (ms)
+SEARCH_DEBOUNCE_MS = 200
+# バックグラウンドの結果を確認する間隔 (ms)
+POLL_MS = 30
+# 一覧に表示する数式の最大文字数
+LABEL_CHARS = 48
+SEARCH_MODE_LABELS = {"prefix": "前方一致", "text": "全文"}
+
+
+class HistoryPanel(ttk.Frame):
+    """履歴の検索欄と仮想リスト
+
+    行をクリックすると on_select(行の辞書) を呼ぶ（行の辞書は HistoryStore.rows と同じ）。
+    """
+
+    def __init__(self, master, store, on_select):
+        super().__init__(master)
+        self.store = store
+        self.on_select = on_select
+        self.ids = []  # 表示中の検索結果
+        self._rows = {}  # id -> 行の内容
+        self._thumbnails = OrderedDict()  # id -> PhotoImage（なければ None）
+        self._requested = set()  # 読み込み中のサムネイル
+        self._visible = frozenset()  # バックグラウンドで読む価値のあるサムネイル
+        self._generation = 0  # 検索のたびに増やし、古い検索結果を捨てる
+        self._search_after_id = None
+        self._poll_id = None
+        self._jobs = queue.Queue()
+        self._results = queue.Queue()
+        self._thread = threading.Thread(
+            target=self._run, name="history-panel", daemon=True
+        )
+        self._thread.start()
+        self._build()
+        self.search()
+
+    def _build(self):
+        search_frame = ttk.Frame(self)
+        search_frame.pack(fill=tk.X, pady=(0, 5))
+        self.query_var = tk.StringVar()
+        ttk.Entry(search_frame, textvariable=self.query_var).pack(
+            side=tk.LEFT, fill=tk.X, expand=True
+        )
+        self.mode_var = tk.StringVar(value=SEARCH_MODE_LABELS["prefix"])
+        ttk.Combobox(
+            search_frame,
+            textvariable=self.mode_var,
+            values=[SEARCH_MODE_LABELS[m] for m in SEARCH_MODES],
+            state="readonly",
+            width=8,
+        ).pack(side=tk.LEFT, padx=(5, 0))
+        self.pinned_only_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(
+            self, text="お気に入りのみ", variable=self.pinned_only_var
+        ).pack(anchor=tk.W)
+        for var in (self.query_var, self.mode_var, self.pinned_only_var):
+            var.trace_add("write", lambda *args: self.schedule_search())
+
+        list_frame = ttk.Frame(self)
+        list_frame.pack(fill=tk.BOTH, expand=True)
+        self.scrollbar = ttk.Scrollbar(list_frame, orient=tk.VERTICAL)
+        self.scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        self.canvas = tk.Canvas(
+            list_frame,
+            width=LIST_WIDTH,
+            background="white",
+            highlightthickness=0,
+            yscrollincrement=ROW_HEIGHT // 4,
+            yscrollcommand=self._on_scroll,
+        )
+        self.canvas.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        self.scrollbar.configure(command=self.canvas.yview)
+        self.count_var = tk.StringVar(value="")
+        ttk.Label(self, textvariable=self.count_var).pack(anchor=tk.W)
+
+        self.canvas.bind("<Configure>", lambda e: self.redraw())
+        self.canvas.bind("<Button-1>", self._on_click)
+        self.canvas.bind("<Button-3>", self._on_menu)
+        # ホイール（Windows / macOS は MouseWheel、X11 は Button-4/5）
+        self.canvas.bind(
+            "<MouseWheel>",
+            lambda e: self.canvas.yview_scroll(-1 if e.delta > 0 else 1, "units"),
+        )
+        self.canvas.bind("<Button-4>", lambda e: self.canvas.yview_scroll(-1, "units"))
+        self.canvas.bind("<Button-5>", lambda e: self.canvas.yview_scroll(1, "units"))
+
+        self.menu = tk.Menu(self, tearoff=0)
+
+    # --- バックグラウンドスレッド ---
+
+    def _submit(self, *job):
+        self._jobs.put(job)
+        if self._poll_id is None:
+            self._poll_id = self.after(POLL_MS, self._poll)
+
+    def _run(self):
+        while True:
+            job = self._jobs.get()
+            try:
+                if job[0] == "close":
+                    self.store.close()
+                    return
+                self._results.put(self._handle(*job))
+            except Exception as e:
+                # 履歴が使えなくてもエディタは動かす
+                self._results.put(("error", str(e)))
+            finally:
+                self._jobs.task_done()
+
+    def _handle(self, kind, *args):
+        if kind == "search":
+            generation, query, mode, pinned_only = args
+            return kind, generation, self.store.search(query, mode, pinned_only)
+        if kind == "thumbnail":
+            (entry_id,) = args
+            if entry_id not in self._visible:
+                return "skipped", entry_id  # 読む前にスクロールで見えなくなった
+            return kind, entry_id, self.store.thumbnail(entry_id)
+        if kind == "record":
+            equation, options, png = args
+            return kind, self.store.record(equation, options, png)
+        # pinned / touch / delete
+        entry_id, *rest = args
+        getattr(self.store, {"pinned": "set_pinned"}.get(kind, kind))(entry_id, *rest)
+        return kind, entry_id
+
+    def _poll(self):
+        self._poll_id = None
+        changed = False
+        while not self._results.empty():
+            result = self._results.get_nowait()
+            kind = result[0]
+            if kind == "search":
+                _, generation, ids = result
+                if generation == self._generation:
+                    self.show_results(ids)
+            elif kind == "thumbnail":
+                _, entry_id, png = result
+                self._requested.discard(entry_id)
+                self._store_thumbnail(entry_id, png)
+                changed = True
+            elif kind == "skipped":
+                self._requested.discard(result[1])
+            elif kind == "error":
+                self.count_var.set(f"履歴のエラー: {result[1]}")
+            elif kind == "touch":
+                pass  # クリックした行が先頭に移って一覧が動かないよう、次の検索まで待つ
+            else:
+                # 記録・お気に入り・削除で順序や内容が変わった
+                self._rows.pop(result[1], None)
+                self.search()
+        if changed:
+            self.redraw()
+        if self._jobs.unfinished_tasks or not self._results.empty():
+            self._poll_id = self.after(POLL_MS, self._poll)
+
+    # --- 検索と表示 ---
+
+    def schedule_search(self):
+        if self._search_after_id is not None:
+            self.after_cancel(self._search_after_id)
+        self._search_after_id = self.after(SEARCH_DEBOUNCE_MS, self.search)
+
+    def search_mode(self):
+        labels = {label: mode for mode, label in SEARCH_MODE_LABELS.items()}
+        return labels.get(self.mode_var.get(), "prefix")
+
+    def search(self):
+        """現在の検索条件で検索し直す（結果は届いたときに表示）"""
+        self._search_after_id = None
+        self._generation += 1
+        self._submit(
+            "search",
+            self._generation,
+            self.query_var.get(),
+            self.search_mode(),
+            self.pinned_only_var.get(),
+        )
+
+    def show_results(self, ids):
+        first = self.ids[0] if self.ids else None
+        self.ids = ids
+        if len(self._rows) > ROW_CACHE:
+            self._rows.clear()
+        self.canvas.configure(scrollregion=(0, 0, 1, len(ids) * ROW_HEIGHT))
+        if not ids or ids[0] != first:
+            self.canvas.yview_moveto(0)
+        self.count_var.set(f"{len(ids)} 件")
+        self.redraw()
+
+    def _on_scroll(self, first, last):
+        self.scrollbar.set(first, last)
+        self.redraw()
+
+    def visible_range(self):
+        """描く行の範囲 (最初, 最後 + 1)"""
+        top = self.canvas.canvasy(0)
+        height = self.canvas.winfo_height()
+        start = max(0, int(top // ROW_HEIGHT) - OVERSCAN_ROWS)
+        stop = min(len(self.ids), int((top + height) // ROW_HEIGHT) + 1 + OVERSCAN_ROWS)
+        return start, stop
+
+    def redraw(self):
+        """見えている行だけを描き直す"""
+        self.canvas.delete("row")
+        start, stop = self.visible_range()
+        visible = self.ids[start:stop]
+        missing = [entry_id for entry_id in visible if entry_id not in self._rows]
+        if missing:
+            # 主キーで読むだけなので、表示する分はその場で読む
+            self._rows.update(self.store.rows(missing))
+        self._visible = frozenset(visible)
+        width = self.canvas.winfo_width()
+        for index, entry_id in enumerate(visible, start):
+            row = self._rows.get(entry_id)
+            if row is not None:
+                self._draw_row(index * ROW_HEIGHT, width, row)
+
+    def _draw_row(self, y, width, row):
+        entry_id = row["id"]
+        self.canvas.create_line(
+            0, y + ROW_HEIGHT - 1, width, y + ROW_HEIGHT - 1, fill="#e0e0e0", tags="row"
+        )
+        if entry_id in self._thumbnails:
+            self._thumbnails.move_to_end(entry_id)
+            image = self._thumbnails[entry_id]
+            if image is not None:
+                self.canvas.create_image(
+                    ROW_PADDING, y + ROW_PADDING, image=image, anchor=tk.NW, tags="row"
+                )
+        elif entry_id not in self._requested:
+            self._requested.add(entry_id)
+            self._submit("thumbnail", entry_id)
+        text = " ".join(row["equation"].split())
+        if len(text) > LABEL_CHARS:
+            text = text[: LABEL_CHARS - 1] + "…"
+        if row["pinned"]:
+            text = "★ " + text
+        self.canvas.create_text(
+            ROW_PADDING,
+            y + ROW_HEIGHT - ROW_PADDING,
+            text=text,
+            anchor=tk.SW,
+            fill="#404040",
+            font=("Courier New", 9),
+            tags="row",
+        )
+
+    def _store_thumbnail(self, entry_id, png):
+        image = None
+        if png is not None:
+            image = tk.PhotoImage(data=base64.b64encode(png).decode("ascii"))
+        self._thumbnails[entry_id] = image
+        while len(self._thumbnails) > THUMBNAIL_CACHE:
+            self._thumbnails.popitem(last=False)
+
+    def row_at(self, y):
+        """Canvas の y 座標にある行の内容（なければ None）"""
+        index = int(self.canvas.canvasy(y) // ROW_HEIGHT)
+        if not 0 <= index < len(self.ids):
+            return None
+        return self._rows.get(self.ids[index])
+
+    def _on_click(self, event):
+        row = self.row_at(event.y)
+        if row is not None:
+            self.on_select(row)
+            self._submit("touch", row["id"])
+
+    def _on_menu(self, event):
+        row = self.row_at(event.y)
+        if row is None:
+            return
+        self.menu.delete(0, tk.END)
+        self.menu.add_command(
+            label="お気に入りから外す" if row["pinned"] else "お気に入りに追加",
+            command=lambda: self._submit("pinned", row["id"], not row["pinned"]),
+        )
+        self.menu.add_command(
+            label="履歴から削除", command=lambda: self._submit("delete", row["id"])
+        )
+        self.menu.tk_popup(event.x_root, event.y_root)
+
+    # --- エディタから呼ぶ ---
+
+    def record(self, equation, options, png=None):
+        """数式を履歴に記録（バックグラウンドで書き込み、一覧を更新する）"""
+        self._submit("record", equation, options, png)
+
+    def close(self, timeout=2):
+        """記録待ちの数式を書き込んでからバックグラウンドスレッドを止める"""
+        if self._poll_id is not None:
+            self.after_cancel(self._poll_id)
+            self._poll_id = None
+        self._jobs.put(("close",))
+        self._thread.join(timeout)
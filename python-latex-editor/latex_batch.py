@@ -0,0 +1,1201 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+LaTeX 数式の一括変換 CLI
+全 CPU コアのプロセスプールで数式をレンダリングする
+
+使い方:
+    python latex_batch.py equations.txt -o output --format png --fontsize 32
+
+入力ファイルは空行区切りで 1 数式ずつ記述する（複数行の数式も可）。
+"-" を指定すると標準入力から読み込む。
+--group-size を 2 以上にすると、その数ずつ数式を 1 つの文書にまとめて
+1 回だけコンパイルする（tex_engine.py）。
+--check を指定すると描画せずに構文チェック（latex_lint.py）だけを行う（マニフェストも
+同じで、結果マニフェストは書き換えない）。
+--svg-mode minify / sprite で SVG を縮小し、sprite ではグリフを出力フォルダの
+glyphs.svg にまとめて各 SVG から参照する（svg_optimize.py）。
+
+入力ファイルが .jsonl / .csv の場合はマニフェストとして 1 行ずつ読み込み、
+id・数式と項目ごとのオプション（fontsize, bgcolor, displaystyle, save_format など）で
+描画する。結果（出力パス・ハッシュ・所要時間・エラー）は入力と同じ順に
+結果マニフェスト（JSONL）へ追記し、--resume で中断したところから再開できる。
+
+--queue で共有フォルダのキュー（work_queue.py）を指定すると、複数のマシンで分担して
+描画する。最初のマシンが入力からキューを作成し、他のマシンは同じコマンド（または
+入力を省略したコマンド）でキューに参加する。すべて終わると結果をまとめた
+結果マニフェストを書き出す。
+    python latex_batch.py equations.jsonl -o /shared/out --queue /shared/queue
+"""
+
+import argparse
+import csv
+import functools
+import hashlib
+import json
+import os
+import re
+import sys
+import time
+from collections import deque
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    ProcessPoolExecutor,
+    as_completed,
+    wait,
+)
+from dataclasses import replace
+from pathlib import Path
+
+import svg_optimize
+import tex_engine
+import tex_process
+from latex_lint import LINT_MODES, lint
+from latex_render import (
+    BACKENDS,
+    DEFAULT_NAME_TEMPLATE,
+    DEFAULT_PREAMBLE,
+    SAVE_FORMATS,
+    RenderError,
+    RenderOptions,
+    build_math_text,
+    configure_matplotlib,
+    export_targets,
+    load_settings,
+    parse_target,
+    resolve_backend,
+    write_atomic,
+)
+from render_cache import (
+    DEFAULT_CACHE_DIR,
+    DEFAULT_MAX_MB,
+    RenderCache,
+    cache_key,
+    file_lock,
+)
+from work_queue import (
+    DEFAULT_CHUNK_SIZE,
+    DEFAULT_LEASE_SECONDS,
+    IDLE_POLL_SECONDS,
+    QUEUE_FILE,
+    WorkQueue,
+)
+
+MANIFEST_FORMATS = ["jsonl", "csv"]
+# マニフェストの各項目で上書きできるオプション
+MANIFEST_OPTIONS = {
+    "fontsize": int,
+    "bgcolor": str,
+    "displaystyle": bool,
+    "save_format": str,
+    "dpi": int,
+    "backend": str,
+}
+# 並列数あたりの処理待ちの項目数（読み込みと結果の並べ替えに使うメモリの上限）
+MANIFEST_QUEUE_PER_JOB = 4
+
+# ワーカープロセスごとの設定とキャッシュ（_init_worker で設定）
+_preamble = DEFAULT_PREAMBLE
+_precompile = True
+_cache = None
+# SVG の縮小: (モード, 桁数, グリフの共有ファイル) または None
+_svg = None
+# 取り出したグリフのうち、まだ親プロセスに渡していないもの
+_glyphs = {}
+_reported_glyphs = set()
+
+
+def read_equations(fp):
+    """空行区切りの数式を読み込み"""
+    equations = []
+    block = []
+    for line in fp:
+        if line.strip():
+            block.append(line.rstrip("\n"))
+        elif block:
+            equations.append("\n".join(block))
+            block = []
+    if block:
+        equations.append("\n".join(block))
+    return equations
+
+
+def _init_worker(
+    preamble,
+    precompile,
+    cache_dir,
+    cache_max_bytes,
+    lint_mode="on",
+    svg=None,
+    limits=None,
+):
+    """ワーカープロセスの初期化"""
+    global _preamble, _precompile, _cache, _svg
+    _preamble = preamble
+    _precompile = precompile
+    _svg = svg
+    if limits is not None:
+        tex_process.configure(limits)
+    configure_matplotlib(preamble, precompile, lint_mode)
+    if cache_dir is not None:
+        _cache = RenderCache(cache_dir, cache_max_bytes)
+
+
+def _svg_settings(svg_mode, svg_precision, output_dir):
+    """_init_worker に渡す SVG の設定（standalone なら None）"""
+    if svg_mode == "standalone":
+        return None
+    sprite_path = Path(output_dir) / svg_optimize.DEFAULT_SPRITE_FILE
+    return svg_mode, svg_precision, str(sprite_path)
+
+
+def _postprocess(path, target, data):
+    """SVG を縮小し、sprite モードではグリフを取り出す（ワーカープロセスで実行）"""
+    if _svg is None or target.save_format != "svg":
+        return data
+    mode, precision, sprite_path = _svg
+    href = None
+    if mode == "sprite":
+        href = Path(os.path.relpath(sprite_path, Path(path).parent)).as_posix()
+    data, glyphs = svg_optimize.optimize(data, precision, href)
+    for key, element in glyphs.items():
+        if key not in _reported_glyphs:
+            _reported_glyphs.add(key)
+            _glyphs[key] = element
+    return data
+
+
+def _collect_glyphs(func, *args):
+    """func(*args) を実行し、(結果, 新しく取り出したグリフ) を返す（ワーカープロセスで実行）"""
+    result = func(*args)
+    glyphs = dict(_glyphs)
+    _glyphs.clear()
+    return result, glyphs
+
+
+def _render_one(index, equation, name, options, export):
+    """1 つの数式をレンダリング（ワーカープロセスで実行）
+
+    export は (出力フォルダ, 書き出し先のリスト, ファイル名テンプレート)。
+    """
+    output_dir, targets, template = export
+    try:
+        paths = export_targets(
+            equation,
+            options,
+            targets,
+            output_dir,
+            name,
+            template,
+            cache=_cache,
+            postprocess=_postprocess,
+        )
+    except Exception as e:
+        return index, False, str(e)
+    return index, True, ", ".join(str(p) for p in paths)
+
+
+def _render_item(equation, name, options, export):
+    """マニフェストの 1 項目をレンダリング（ワーカープロセスで実行）
+
+    {"paths": [...], "sha256": [...], "ms": 所要時間} または {"error": ...} を返す。
+    外部ツールが上限を超えた場合は {"error": ..., "reason": "timeout" など} を返す。
+    """
+    output_dir, targets, template = export
+    start = time.perf_counter()
+    try:
+        paths = export_targets(
+            equation,
+            options,
+            targets,
+            output_dir,
+            name,
+            template,
+            cache=_cache,
+            postprocess=_postprocess,
+        )
+        hashes = [hashlib.sha256(p.read_bytes()).hexdigest() for p in paths]
+    except tex_process.ProcessLimitError as e:
+        return {"error": str(e), "reason": e.reason, "ms": _elapsed_ms(start)}
+    except Exception as e:
+        return {"error": str(e), "ms": _elapsed_ms(start)}
+    return {
+        "paths": [str(p) for p in paths],
+        "sha256": hashes,
+        "ms": _elapsed_ms(start),
+    }
+
+
+def _elapsed_ms(start):
+    return round((time.perf_counter() - start) * 1000, 1)
+
+
+def _render_group(items, options, export):
+    """数式をまとめて 1 回のコンパイルでレンダリング（ワーカープロセスで実行）
+
+    items は (index, 数式, 名前) のリスト。書き出し先がいくつあってもコンパイルは 1 回。
+    """
+    output_dir, specs, template = export
+    targets = []
+    for spec in specs:
+        target, suffix = parse_target(spec, options)
+        target = replace(target, backend="dvi")
+        path_format = template.format(
+            name="{name}", suffix=suffix, format=target.save_format, dpi=target.dpi
+        )
+        targets.append((target, path_format))
+
+    def write_outputs(name, outputs):
+        paths = []
+        for (target, path_format), data in zip(targets, outputs):
+            path = Path(output_dir) / path_format.format(name=name)
+            write_atomic(path, _postprocess(path, target, data))
+            paths.append(str(path))
+        return ", ".join(paths)
+
+    results = []
+    entries = {}  # index -> (数式, 名前, 書き出し先ごとのキャッシュキー)
+    for index, equation, name in items:
+        try:
+            math_text = build_math_text(equation, options.displaystyle)
+        except RenderError as e:
+            results.append((index, False, str(e)))
+            continue
+        keys = [cache_key(math_text, t, _preamble) for t, _ in targets]
+        entries[index] = (equation, name, keys)
+
+    def cached(keys):
+        return _cache is not None and all(
+            _cache.contains(key, t.save_format) for key, (t, _) in zip(keys, targets)
+        )
+
+    # まとめてコンパイルする数式（すべての書き出し先がキャッシュにあるものは除く）
+    group = [index for index, (_, _, keys) in entries.items() if not cached(keys)]
+    compiled = {}  # index -> [書き出し先ごとのバイト列] または RenderError
+
+    def render_target(index, n):
+        if index not in compiled:
+            # 最初にキャッシュになかった時点でまとめてコンパイルする
+            # （確認したあとにキャッシュから削除された数式は単独で）
+            indices = group if index in group else [index]
+            rendered = tex_engine.render_group_targets(
+                [entries[i][0] for i in indices],
+                [t for t, _ in targets],
+                _preamble,
+                _precompile,
+            )
+            compiled.update(zip(indices, rendered))
+        outputs = compiled[index]
+        if isinstance(outputs, Exception):
+            raise outputs
+        return outputs[n]
+
+    pending = list(entries.items())
+    for position, (index, (equation, name, keys)) in enumerate(pending):
+        try:
+            if _cache is None:
+                outputs = [render_target(index, n) for n in range(len(targets))]
+            else:
+                # エントリごとのロックで、他のワーカーが描画中ならその結果を待つ
+                outputs = [
+                    _cache.fetch(
+                        key, t.save_format, functools.partial(render_target, index, n)
+                    )[0]
+                    for n, (key, (t, _)) in enumerate(zip(keys, targets))
+                ]
+            results.append((index, True, write_outputs(name, outputs)))
+        except tex_engine.ToolNotFoundError:
+            # 外部ツールがない場合は matplotlib で 1 つずつ描画
+            results.extend(
+                _render_one(i, entry[0], entry[1], options, export)
+                for i, entry in pending[position:]
+            )
+            break
+        except (RenderError, OSError) as e:
+            results.append((index, False, str(e)))
+    return results
+
+
+def render_batch(
+    equations,
+    output_dir,
+    options,
+    jobs=None,
+    on_result=None,
+    preamble=DEFAULT_PREAMBLE,
+    precompile=True,
+    cache_dir=DEFAULT_CACHE_DIR,
+    cache_max_bytes=DEFAULT_MAX_MB * 1024**2,
+    group_size=1,
+    targets=None,
+    name_template=DEFAULT_NAME_TEMPLATE,
+    lint_mode="on",
+    svg_mode="standalone",
+    svg_precision=svg_optimize.DEFAULT_PRECISION,
+    limits=None,
+):
+    """数式のリストを並列にレンダリングし、(index, 成否, パスまたはエラー) のリストを返す
+
+    cache_dir に None を指定するとキャッシュを使わない。
+    lint_mode は TeX を実行する前の構文チェック（on / strict / off）。
+    group_size が 2 以上の場合は、その数ずつ 1 回のコンパイルにまとめる（dvi 方式のみ）。
+    targets（svg, pdf, png@2x など）を指定すると、1 回のコンパイルから複数の形式を書き出す。
+    svg_mode が minify / sprite の場合は SVG を svg_precision 桁に丸めて縮小し、
+    sprite ではグリフを出力フォルダの glyphs.svg にまとめる（結果を受け取るたびに追加）。
+    limits（tex_process.ProcessLimits）は外部ツールの時間・メモリ・CPU 時間の上限で、
+    超えた数式だけがエラーになる。
+    """
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    width = max(4, len(str(len(equations))))
+    targets = targets or [options.save_format]
+    export = (output_dir, targets, name_template)
+    svg = _svg_settings(svg_mode, svg_precision, output_dir)
+
+    results = []
+    with ProcessPoolExecutor(
+        max_workers=jobs or os.cpu_count(),
+        initializer=_init_worker,
+        initargs=(
+            preamble, precompile, cache_dir, cache_max_bytes, lint_mode, svg, limits
+        ),
+    ) as pool:
+        items = [(i, eq, f"eq_{i + 1:0{width}d}") for i, eq in enumerate(equations)]
+        grouped = group_size > 1 and all(
+            resolve_backend(parse_target(spec, options)[0]) == "dvi" for spec in targets
+        )
+        if grouped:
+            futures = [
+                pool.submit(
+                    _collect_glyphs,
+                    _render_group,
+                    items[start : start + group_size],
+                    options,
+                    export,
+                )
+                for start in range(0, len(items), group_size)
+            ]
+        else:
+            futures = [
+                pool.submit(_collect_glyphs, _render_one, *item, options, export)
+                for item in items
+            ]
+        for future in as_completed(futures):
+            group, glyphs = future.result()
+            if glyphs:
+                # 中断しても書き出し済みの SVG の参照先が残るよう、結果ごとに追加する
+                svg_optimize.write_sprite(svg[2], glyphs)
+            for result in group if grouped else [group]:
+                results.append(result)
+                if on_result:
+                    on_result(result)
+    results.sort()
+    return results
+
+
+def _parse_bool(value):
+    if isinstance(value, str):
+        return value.strip().lower() in ("1", "true", "yes", "on")
+    return bool(value)
+
+
+def record_id(fields, line_number):
+    """マニフェストの項目の id（なければ行番号から作る）"""
+    if isinstance(fields, dict) and fields.get("id") not in (None, ""):
+        return str(fields["id"])
+    return f"line_{line_number}"
+
+
+def output_name(item_id, line_number, used):
+    """項目の id から出力ファイル名を作成し used に追加
+
+    記号を _ に置き換えた結果がほかの項目と重なる場合は行番号を付ける。
+    """
+    name = re.sub(r"[^\w.-]+", "_", item_id)
+    while name in used:
+        name = f"{name}_{line_number}"
+    used.add(name)
+    return name
+
+
+def parse_record(fields, base_options):
+    """マニフェストの 1 行（辞書）から (数式, オプション) を生成
+
+    不正な項目は RenderError。空の値は上書きしない（CSV の空欄など）。
+    """
+    equation = fields.get("equation", fields.get("latex"))
+    if not isinstance(equation, str) or not equation.strip():
+        raise RenderError("equation（または latex）がありません")
+    overrides = {}
+    for name, kind in MANIFEST_OPTIONS.items():
+        value = fields.get(name)
+        if value is None or value == "":
+            continue
+        try:
+            overrides[name] = _parse_bool(value) if kind is bool else kind(value)
+        except (TypeError, ValueError):
+            raise RenderError(f"{name} の値が正しくありません: {value}") from None
+    if overrides.get("save_format", base_options.save_format) not in SAVE_FORMATS:
+        raise RenderError(f"未対応の保存形式です: {overrides['save_format']}")
+    return equation, replace(base_options, **overrides)
+
+
+def read_manifest(fp, manifest_format):
+    """マニフェストを 1 行ずつ読み、(行番号, 辞書または例外) を順に返す"""
+    if manifest_format == "csv":
+        reader = csv.DictReader(fp)
+        for fields in reader:
+            yield reader.line_num, fields
+        return
+    for line_number, line in enumerate(fp, 1):
+        if not line.strip():
+            continue
+        try:
+            fields = json.loads(line)
+        except json.JSONDecodeError as e:
+            yield line_number, RenderError(f"JSON が正しくありません: {e}")
+            continue
+        if not isinstance(fields, dict):
+            fields = RenderError("各行は JSON オブジェクトで指定してください")
+        yield line_number, fields
+
+
+def completed_results(results_path):
+    """結果マニフェストの完了済みの件数と最後の id を返す（書きかけの最終行は切り捨てる）"""
+    done = 0
+    last_id = None
+    good_bytes = 0
+    try:
+        with open(results_path, "rb") as f:
+            for raw in f:
+                try:
+                    record = json.loads(raw)
+                except ValueError:
+                    break
+                if not raw.endswith(b"\n"):
+                    break
+                good_bytes += len(raw)
+                if not isinstance(record, dict):
+                    continue  # 結果ではない行は数えない
+                done += 1
+                last_id = record.get("id")
+    except FileNotFoundError:
+        return 0, None
+    with open(results_path, "r+b") as f:
+        f.truncate(good_bytes)
+    return done, last_id
+
+
+def render_manifest(
+    records,
+    output_dir,
+    options,
+    results_path,
+    jobs=None,
+    on_result=None,
+    preamble=DEFAULT_PREAMBLE,
+    precompile=True,
+    cache_dir=DEFAULT_CACHE_DIR,
+    cache_max_bytes=DEFAULT_MAX_MB * 1024**2,
+    targets=None,
+    name_template=DEFAULT_NAME_TEMPLATE,
+    lint_mode="on",
+    resume=False,
+    svg_mode="standalone",
+    svg_precision=svg_optimize.DEFAULT_PRECISION,
+    limits=None,
+):
+    """マニフェスト（read_manifest の出力）を並列にレンダリングし、(成功数, 失敗数) を返す
+
+    結果は入力と同じ順で results_path に 1 行 1 JSON で追記する。処理待ちの項目は
+    並列数 × MANIFEST_QUEUE_PER_JOB 件までなので、入力の長さによらずメモリはほぼ一定
+    （出力ファイル名の重なりを調べるため、使った名前だけは覚えておく）。
+    resume が True の場合は results_path に記録済みの項目を飛ばして続きから処理する。
+    sprite モードのグリフは、それを参照する項目の結果を書く前に glyphs.svg へ追加する。
+    """
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    svg = _svg_settings(svg_mode, svg_precision, output_dir)
+    skip, last_id = completed_results(results_path) if resume else (0, None)
+    jobs = jobs or os.cpu_count()
+    window = jobs * MANIFEST_QUEUE_PER_JOB
+    succeeded = failed = 0
+    used = set()
+
+    with open(results_path, "a" if resume else "w", encoding="utf-8") as out:
+        # 入力順に (id, 行番号, Future または結果の辞書)
+        pending = deque()
+
+        def write_results(limit):
+            # 終わった先頭から書き出し、limit 件を超える間は先頭の完了を待つ
+            nonlocal succeeded, failed
+            while pending:
+                item_id, line_number, result = pending[0]
+                if len(pending) <= limit and not _is_ready(result):
+                    break
+                pending.popleft()
+                if not isinstance(result, dict):
+                    result, glyphs = result.result()
+                    if glyphs:
+                        svg_optimize.write_sprite(svg[2], glyphs)
+                record = {"id": item_id, "line": line_number}
+                record.update(ok="error" not in result, **result)
+                out.write(json.dumps(record, ensure_ascii=False) + "\n")
+                out.flush()
+                if record["ok"]:
+                    succeeded += 1
+                else:
+                    failed += 1
+                if on_result:
+                    on_result(record)
+
+        with ProcessPoolExecutor(
+            max_workers=jobs,
+            initializer=_init_worker,
+            initargs=(
+                preamble, precompile, cache_dir, cache_max_bytes, lint_mode, svg, limits
+            ),
+        ) as pool:
+            for position, (line_number, fields) in enumerate(records):
+                item_id = record_id(fields, line_number)
+                # 再開したときも同じ名前になるよう、飛ばす項目の名前も登録する
+                name = output_name(item_id, line_number, used)
+                if position < skip:
+                    if position == skip - 1 and item_id != last_id:
+                        raise RenderError(
+                            f"結果マニフェストの {skip} 件目 ({last_id}) が"
+                            f"入力 ({item_id}) と一致しません"
+                        )
+                    continue
+                try:
+                    if isinstance(fields, Exception):
+                        raise fields
+                    equation, item_options = parse_record(fields, options)
+                except RenderError as e:
+                    pending.append((item_id, line_number, {"error": str(e)}))
+                else:
+                    item_targets = targets or [item_options.save_format]
+                    export = (output_dir, item_targets, name_template)
+                    future = pool.submit(
+                        _collect_glyphs,
+                        _render_item,
+                        equation,
+                        name,
+                        item_options,
+                        export,
+                    )
+                    pending.append((item_id, line_number, future))
+                write_results(window - 1)
+            write_results(0)
+    return succeeded, failed
+
+
+def _is_ready(result):
+    return isinstance(result, dict) or result.done()
+
+
+def queue_items(records, options):
+    """マニフェスト（read_manifest の出力）をキューの項目（辞書）に変換
+
+    オプションは項目ごとにすべて記録する（ワーカーの設定ファイルによらず同じ結果にする）。
+    """
+    used = set()
+    for line_number, fields in records:
+        item_id = record_id(fields, line_number)
+        name = output_name(item_id, line_number, used)
+        item = {"id": item_id, "line": line_number}
+        try:
+            if isinstance(fields, Exception):
+                raise fields
+            equation, item_options = parse_record(fields, options)
+        except RenderError as e:
+            item["error"] = str(e)
+        else:
+            item.update(
+                name=name,
+                equation=equation,
+                options=item_options.to_dict(),
+            )
+        yield item
+
+
+def equation_items(equations, options):
+    """空行区切りの数式をキューの項目に変換（名前は render_batch と同じ eq_0001 など）"""
+    width = max(4, len(str(len(equations))))
+    for i, equation in enumerate(equations):
+        name = f"eq_{i + 1:0{width}d}"
+        yield {
+            "id": name,
+            "line": i + 1,
+            "name": name,
+            "equation": equation,
+            "options": options.to_dict(),
+        }
+
+
+def create_queue(
+    queue_dir,
+    items,
+    output_dir,
+    results_path=None,
+    preamble=DEFAULT_PREAMBLE,
+    precompile=True,
+    targets=None,
+    name_template=DEFAULT_NAME_TEMPLATE,
+    lint_mode="on",
+    svg_mode="standalone",
+    svg_precision=svg_optimize.DEFAULT_PRECISION,
+    chunk_size=DEFAULT_CHUNK_SIZE,
+    lease_seconds=DEFAULT_LEASE_SECONDS,
+):
+    """キューの項目から共有フォルダのキューを作成（他のマシンが先に作成したら False）
+
+    描画の設定はキューに記録し、すべてのワーカーがそれに従う。
+    """
+    output_dir = Path(output_dir).resolve()
+    spec = {
+        "output": str(output_dir),
+        "results": str(results_path or output_dir / "results.jsonl"),
+        "preamble": preamble,
+        "precompile": precompile,
+        "targets": targets,
+        "name_template": name_template,
+        "lint": lint_mode,
+        "svg_mode": svg_mode,
+        "svg_precision": svg_precision,
+    }
+    return WorkQueue.create(queue_dir, spec, items, chunk_size, lease_seconds)
+
+
+def _submit_queue_item(pool, item, spec):
+    """キューの項目を描画に回す（項目のエラーはそのまま結果の辞書）"""
+    if "error" in item:
+        return {"error": item["error"]}
+    options = RenderOptions.from_settings(item["options"])
+    targets = spec["targets"] or [options.save_format]
+    export = (spec["output"], targets, spec["name_template"])
+    return pool.submit(
+        _collect_glyphs, _render_item, item["equation"], item["name"], options, export
+    )
+
+
+def render_queue(
+    queue_dir,
+    jobs=None,
+    on_result=None,
+    cache_dir=DEFAULT_CACHE_DIR,
+    cache_max_bytes=DEFAULT_MAX_MB * 1024**2,
+    limits=None,
+    worker=None,
+):
+    """共有フォルダのキューからチャンクを取得して描画し、(成功数, 失敗数) を返す
+
+    他のマシン・プロセスのワーカーと同時に実行でき、すべてのチャンクが終わるまで
+    （落ちたワーカーの期限切れのチャンクも引き取って）続ける。処理中の項目は
+    並列数 × MANIFEST_QUEUE_PER_JOB 件まで。キャッシュと外部ツールの上限は
+    このワーカーの設定を使う。
+    """
+    queue = WorkQueue(queue_dir, worker)
+    spec = queue.spec
+    Path(spec["output"]).mkdir(parents=True, exist_ok=True)
+    svg = _svg_settings(spec["svg_mode"], spec["svg_precision"], spec["output"])
+    jobs = jobs or os.cpu_count()
+    window = jobs * MANIFEST_QUEUE_PER_JOB
+    succeeded = failed = 0
+    # チャンク名 -> (Lease, [(項目, Future または結果の辞書)])
+    running = {}
+
+    def finish(lease, entries):
+        nonlocal succeeded, failed
+        records = []
+        glyphs = {}
+        for item, result in entries:
+            if not isinstance(result, dict):
+                result, new_glyphs = result.result()
+                glyphs.update(new_glyphs)
+            record = {"id": item["id"], "line": item["line"]}
+            record.update(ok="error" not in result, **result, worker=queue.worker)
+            records.append(record)
+        if glyphs:
+            # 他のマシンのワーカーも同じファイルにグリフを追加する
+            with file_lock(f"{svg[2]}.lock"):
+                svg_optimize.write_sprite(svg[2], glyphs)
+        queue.complete(lease, records)
+        for record in records:
+            if record["ok"]:
+                succeeded += 1
+            else:
+                failed += 1
+            if on_result:
+                on_result(record)
+
+    with ProcessPoolExecutor(
+        max_workers=jobs,
+        initializer=_init_worker,
+        initargs=(
+            spec["preamble"],
+            spec["precompile"],
+            cache_dir,
+            cache_max_bytes,
+            spec["lint"],
+            svg,
+            limits,
+        ),
+    ) as pool:
+        renewed = time.monotonic()
+        while True:
+            # チャンクの残りを待つ間もプールが空かないよう、終わっていない項目だけを数える
+            in_flight = sum(
+                not _is_ready(result)
+                for _, entries in running.values()
+                for _, result in entries
+            )
+            while in_flight < window:
+                lease = queue.claim()
+                if lease is None:
+                    break
+                entries = [
+                    (item, _submit_queue_item(pool, item, spec))
+                    for item in queue.load(lease)
+                ]
+                running[lease.chunk] = (lease, entries)
+                in_flight += len(entries)
+            if not running:
+                if queue.finished():
+                    break
+                # 他のワーカーが処理中（落ちていれば期限切れで取得できるようになる）
+                time.sleep(IDLE_POLL_SECONDS)
+                continue
+
+            futures = [
+                result
+                for _, entries in running.values()
+                for _, result in entries
+                if not _is_ready(result)
+            ]
+            if futures:
+                wait(futures, timeout=queue.renew_interval, return_when=FIRST_COMPLETED)
+            if time.monotonic() - renewed >= queue.renew_interval:
+                queue.renew([lease for lease, _ in running.values()])
+                renewed = time.monotonic()
+            for chunk, (lease, entries) in list(running.items()):
+                if all(_is_ready(result) for _, result in entries):
+                    del running[chunk]
+                    finish(lease, entries)
+    queue.heartbeat(finished=time.time())
+    return succeeded, failed
+
+
+def check_equations(equations, preamble=DEFAULT_PREAMBLE, lint_mode="on"):
+    """構文チェックだけを行い、(index, 成否, 問題の一覧) のリストを返す"""
+    results = []
+    for i, equation in enumerate(equations):
+        issues = lint(equation, preamble)
+        failed = any(
+            issue.severity == "error" or lint_mode == "strict" for issue in issues
+        )
+        detail = "; ".join(str(issue) for issue in issues) or "問題なし"
+        results.append((i, not failed, detail))
+    return results
+
+
+def run_queue(args, settings, manifest_format):
+    """キューモード（--queue）の main"""
+    queue_dir = Path(args.queue)
+    if args.input is not None and not (queue_dir / QUEUE_FILE).exists():
+        options = RenderOptions(
+            fontsize=args.fontsize,
+            bgcolor=args.bgcolor,
+            displaystyle=args.displaystyle,
+            save_format=args.format,
+            dpi=args.dpi,
+            backend=args.backend,
+        )
+        fp = sys.stdin if args.input == "-" else None
+        try:
+            if fp is None:
+                fp = open(args.input, "r", encoding="utf-8", newline="")
+            if manifest_format is not None:
+                items = queue_items(read_manifest(fp, manifest_format), options)
+            else:
+                items = equation_items(read_equations(fp), options)
+            created = create_queue(
+                queue_dir,
+                items,
+                args.output,
+                args.results,
+                preamble=settings.get("preamble", DEFAULT_PREAMBLE),
+                precompile=settings.get("precompiled_preamble", True),
+                targets=args.targets.split(",") if args.targets else None,
+                name_template=args.name_template,
+                lint_mode=args.lint,
+                svg_mode=args.svg_mode,
+                svg_precision=args.svg_precision,
+                chunk_size=args.chunk_size,
+                lease_seconds=args.lease_seconds,
+            )
+        finally:
+            if fp is not None and fp is not sys.stdin:
+                fp.close()
+        if created:
+            print(f"キューを作成しました: {queue_dir}")
+
+    def report(record):
+        status = "OK" if record["ok"] else "NG"
+        detail = ", ".join(record["paths"]) if record["ok"] else record["error"]
+        print(f"[{status}] {record['id']}: {detail}", flush=True)
+
+    try:
+        succeeded, failed = render_queue(
+            queue_dir,
+            args.jobs,
+            report,
+            cache_dir=None if args.no_cache else args.cache_dir,
+            cache_max_bytes=args.cache_max_mb * 1024**2,
+            limits=process_limits(args),
+        )
+        queue = WorkQueue(queue_dir)
+        summary = queue.write_report(queue.spec["results"])
+    except RenderError as e:
+        print(f"エラー: {e}")
+        return 1
+    print(f"このワーカー: {succeeded} 件成功, {failed} 件失敗")
+    print(
+        f"完了: {summary['succeeded']} 件成功, {summary['failed']} 件失敗"
+        f"（ワーカー {len(summary['workers'])} 個, 結果: {queue.spec['results']}）"
+    )
+    return 1 if summary["failed"] else 0
+
+
+def check_manifest(records, options, preamble=DEFAULT_PREAMBLE, lint_mode="on"):
+    """マニフェストの項目を描画せずに読み込みと構文チェックだけ行い、(id, 成否, 問題の一覧) を順に返す"""
+    for line_number, fields in records:
+        item_id = record_id(fields, line_number)
+        try:
+            if isinstance(fields, Exception):
+                raise fields
+            equation, _ = parse_record(fields, options)
+        except RenderError as e:
+            yield item_id, False, str(e)
+            continue
+        [(_, ok, detail)] = check_equations([equation], preamble, lint_mode)
+        yield item_id, ok, detail
+
+
+def run_check(args, settings, manifest_format):
+    """--check の main（出力フォルダと結果マニフェストには何も書かない）"""
+    preamble = settings.get("preamble", DEFAULT_PREAMBLE)
+    if args.input == "-":
+        fp = sys.stdin
+    else:
+        fp = open(args.input, "r", encoding="utf-8", newline="")
+    try:
+        if manifest_format is not None:
+            options = RenderOptions(save_format=args.format)
+            results = check_manifest(
+                read_manifest(fp, manifest_format), options, preamble, args.lint
+            )
+        else:
+            results = (
+                (index + 1, ok, detail)
+                for index, ok, detail in check_equations(
+                    read_equations(fp), preamble, args.lint
+                )
+            )
+        passed = failed = 0
+        for item_id, ok, detail in results:
+            print(f"[{'OK' if ok else 'NG'}] {item_id}: {detail}", flush=True)
+            if ok:
+                passed += 1
+            else:
+                failed += 1
+    finally:
+        if fp is not sys.stdin:
+            fp.close()
+    print(f"完了: {passed} 件問題なし, {failed} 件エラー")
+    return 1 if failed else 0
+
+
+def process_limits(args):
+    """--timeout / --memory-limit / --cpu-limit から外部ツールの上限を作成"""
+    return tex_process.ProcessLimits(
+        timeout=args.timeout, memory_mb=args.memory_limit, cpu_seconds=args.cpu_limit
+    )
+
+
+def run_manifest(args, settings, manifest_format):
+    """マニフェストモードの main"""
+    options = RenderOptions(
+        fontsize=args.fontsize,
+        bgcolor=args.bgcolor,
+        displaystyle=args.displaystyle,
+        save_format=args.format,
+        dpi=args.dpi,
+        backend=args.backend,
+    )
+    results_path = args.results or Path(args.output) / "results.jsonl"
+    Path(results_path).parent.mkdir(parents=True, exist_ok=True)
+
+    def report(record):
+        status = "OK" if record["ok"] else "NG"
+        detail = ", ".join(record["paths"]) if record["ok"] else record["error"]
+        print(f"[{status}] {record['id']}: {detail}", flush=True)
+
+    if args.input == "-":
+        fp = sys.stdin
+    else:
+        # CSV の改行はモジュールに任せる
+        fp = open(args.input, "r", encoding="utf-8", newline="")
+    try:
+        succeeded, failed = render_manifest(
+            read_manifest(fp, manifest_format),
+            args.output,
+            options,
+            results_path,
+            args.jobs,
+            report,
+            preamble=settings.get("preamble", DEFAULT_PREAMBLE),
+            precompile=settings.get("precompiled_preamble", True),
+            cache_dir=None if args.no_cache else args.cache_dir,
+            cache_max_bytes=args.cache_max_mb * 1024**2,
+            targets=args.targets.split(",") if args.targets else None,
+            name_template=args.name_template,
+            lint_mode=args.lint,
+            resume=args.resume,
+            svg_mode=args.svg_mode,
+            svg_precision=args.svg_precision,
+            limits=process_limits(args),
+        )
+    except RenderError as e:
+        print(f"エラー: {e}")
+        return 1
+    finally:
+        if fp is not sys.stdin:
+            fp.close()
+    print(f"完了: {succeeded} 件成功, {failed} 件失敗（結果: {results_path}）")
+    return 1 if failed else 0
+
+
+def main(argv=None):
+    # --config を先に読んで、その設定を既定値として使う
+    pre_parser = argparse.ArgumentParser(add_help=False)
+    pre_parser.add_argument("--config", default=None)
+    pre_args, _ = pre_parser.parse_known_args(argv)
+    settings = load_settings(pre_args.config) if pre_args.config else load_settings()
+
+    parser = argparse.ArgumentParser(description="LaTeX 数式の一括変換")
+    parser.add_argument(
+        "input",
+        nargs="?",
+        help="数式ファイル（空行区切り、- で標準入力）または .jsonl / .csv のマニフェスト"
+        "（--queue で作成済みのキューに参加する場合は省略可）",
+    )
+    parser.add_argument("-o", "--output", default="output", help="出力フォルダ")
+    parser.add_argument("--config", default=None, help="設定ファイル")
+    parser.add_argument(
+        "--fontsize", type=int, default=settings.get("fontsize", 24), help="フォントサイズ"
+    )
+    parser.add_argument(
+        "--bgcolor", default=settings.get("bgcolor", "transparent"), help="背景色"
+    )
+    parser.add_argument(
+        "--displaystyle",
+        action=argparse.BooleanOptionalAction,
+        default=settings.get("displaystyle", False),
+        help="\\displaystyle を使用",
+    )
+    parser.add_argument(
+        "--format",
+        choices=SAVE_FORMATS,
+        default=settings.get("save_format", "svg"),
+        help="保存形式",
+    )
+    parser.add_argument("--dpi", type=int, default=300, help="PNG の解像度")
+    parser.add_argument(
+        "--backend",
+        choices=BACKENDS,
+        default=settings.get("backend", "dvi"),
+        help="描画方式（dvi: dvisvgm などで直接変換、matplotlib: savefig）",
+    )
+    parser.add_argument(
+        "--cache-dir",
+        default=settings.get("cache_dir", str(DEFAULT_CACHE_DIR)),
+        help="キャッシュフォルダ",
+    )
+    parser.add_argument(
+        "--cache-max-mb",
+        type=int,
+        default=settings.get("cache_max_mb", DEFAULT_MAX_MB),
+        help="キャッシュの上限サイズ (MB)",
+    )
+    parser.add_argument(
+        "--no-cache", action="store_true", help="キャッシュを使わない"
+    )
+    parser.add_argument(
+        "--targets",
+        default=None,
+        help="書き出し先（カンマ区切り、例: svg,pdf,png@1x,png@2x,png@3x）。1 回のコンパイルからまとめて書き出す",
+    )
+    parser.add_argument(
+        "--name-template",
+        default=settings.get("export_name_template", DEFAULT_NAME_TEMPLATE),
+        help="出力ファイル名のテンプレート（{name}, {suffix}, {format}, {dpi}）",
+    )
+    parser.add_argument(
+        "--group-size",
+        type=int,
+        default=1,
+        help="1 回のコンパイルにまとめる数式の数（例: 32、既定: 1 = まとめない）",
+    )
+    parser.add_argument(
+        "--lint",
+        choices=LINT_MODES,
+        default=settings.get("lint", "on"),
+        help="TeX を実行する前の構文チェック（strict: 警告でも描画しない）",
+    )
+    parser.add_argument(
+        "--check", action="store_true", help="描画せずに構文チェックだけを行う"
+    )
+    parser.add_argument(
+        "--svg-mode",
+        choices=svg_optimize.SVG_MODES,
+        default=settings.get("svg_mode", "standalone"),
+        help="SVG の出力（minify: 縮小、sprite: グリフを glyphs.svg にまとめて参照）",
+    )
+    parser.add_argument(
+        "--svg-precision",
+        type=int,
+        default=settings.get("svg_precision", svg_optimize.DEFAULT_PRECISION),
+        help="縮小した SVG の座標の小数点以下の桁数",
+    )
+    limits = tex_process.ProcessLimits.from_settings(settings)
+    parser.add_argument(
+        "--timeout",
+        type=float,
+        default=limits.timeout,
+        help="外部ツール（latex など）1 回の実行時間の上限（秒、0 で無制限）",
+    )
+    parser.add_argument(
+        "--memory-limit",
+        type=int,
+        default=limits.memory_mb,
+        help="外部ツールのメモリの上限（MB、0 で無制限、Linux のみ）",
+    )
+    parser.add_argument(
+        "--cpu-limit",
+        type=int,
+        default=limits.cpu_seconds,
+        help="外部ツールの CPU 時間の上限（秒、0 で無制限、Linux のみ）",
+    )
+    parser.add_argument(
+        "--manifest",
+        choices=MANIFEST_FORMATS,
+        default=None,
+        help="マニフェストの形式（既定: 拡張子 .jsonl / .csv から判定）",
+    )
+    parser.add_argument(
+        "--results",
+        default=None,
+        help="結果マニフェストの出力先（既定: 出力フォルダの results.jsonl）",
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="結果マニフェストに記録済みの項目を飛ばして続きから処理する",
+    )
+    parser.add_argument(
+        "--queue",
+        default=None,
+        help="共有フォルダのキュー。複数のマシンで分担して描画する（なければ入力から作成）",
+    )
+    parser.add_argument(
+        "--chunk-size",
+        type=int,
+        default=DEFAULT_CHUNK_SIZE,
+        help="キューのワーカーが 1 回に取得する数式の数（キューの作成時のみ）",
+    )
+    parser.add_argument(
+        "--lease-seconds",
+        type=float,
+        default=DEFAULT_LEASE_SECONDS,
+        help="この秒数応答のないワーカーのチャンクを他のワーカーが引き取る（キューの作成時のみ）",
+    )
+    parser.add_argument(
+        "-j", "--jobs", type=int, default=None, help="並列数（既定: CPU コア数）"
+    )
+    args = parser.parse_args(argv)
+    if args.input is None and args.queue is None:
+        parser.error("入力ファイルを指定してください")
+    # 書き出し先の指定はワーカーに渡す前にまとめて確認する
+    for spec in args.targets.split(",") if args.targets else []:
+        try:
+            parse_target(spec, RenderOptions())
+        except RenderError as e:
+            parser.error(f"--targets: {e}")
+
+    manifest_format = args.manifest
+    if (
+        manifest_format is None
+        and args.input is not None
+        and Path(args.input).suffix[1:] in MANIFEST_FORMATS
+    ):
+        manifest_format = Path(args.input).suffix[1:]
+    if args.check:
+        # 描画も結果マニフェストの書き込みもしない（キューにも参加しない）
+        if args.input is None:
+            parser.error("--check には入力ファイルを指定してください")
+        return run_check(args, settings, manifest_format)
+    if args.queue is not None:
+        if args.group_size > 1:
+            parser.error("--group-size は --queue と一緒には使えません")
+        return run_queue(args, settings, manifest_format)
+    if manifest_format is not None:
+        if args.group_size > 1:
+            parser.error("--group-size はマニフェストと一緒には使えません")
+        return run_manifest(args, settings, manifest_format)
+
+    if args.input == "-":
+        equations = read_equations(sys.stdin)
+    else:
+        with open(args.input, "r", encoding="utf-8") as f:
+            equations = read_equations(f)
+
+    options = RenderOptions(
+        fontsize=args.fontsize,
+        bgcolor=args.bgcolor,
+        displaystyle=args.displaystyle,
+        save_format=args.format,
+        dpi=args.dpi,
+        backend=args.backend,
+    )
+
+    def report(result):
+        index, ok, detail = result
+        status = "OK" if ok else "NG"
+        print(f"[{status}] {index + 1}: {detail}", flush=True)
+
+    results = render_batch(
+        equations,
+        args.output,
+        options,
+        args.jobs,
+        report,
+        preamble=settings.get("preamble", DEFAULT_PREAMBLE),
+        precompile=settings.get("precompiled_preamble", True),
+        cache_dir=None if args.no_cache else args.cache_dir,
+        cache_max_bytes=args.cache_max_mb * 1024**2,
+        group_size=args.group_size,
+        targets=args.targets.split(",") if args.targets else None,
+        name_template=args.name_template,
+        lint_mode=args.lint,
+        svg_mode=args.svg_mode,
+        svg_precision=args.svg_precision,
+        limits=process_limits(args),
+    )
+    failed = sum(1 for _, ok, _ in results if not ok)
+    print(f"完了: {len(results) - failed} 件成功, {failed} 件失敗")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+レンダリングキャッシュの管理 CLI
+キャッシュフォルダ（複数のエディタ・一括変換で共有しているものを含む）のサイズと
+ヒット率を表示し、古いエントリを削除する。
+
+使い方:
+    python latex_cache.py stats
+    python latex_cache.py --max-mb 512 prune --max-age-days 30
+    python latex_cache.py clear
+
+キャッシュフォルダと上限サイズの既定値は latex_editor_config.json の
+cache_dir / cache_max_mb。
+"""
+
+import argparse
+import json
+import sys
+import time
+from collections import defaultdict
+
+from latex_render import load_settings
+from render_cache import DEFAULT_CACHE_DIR, DEFAULT_MAX_MB, RenderCache
+
+
+def cache_report(cache):
+    """エントリ数・サイズ（形式ごと）・最終使用日時・ヒット率の辞書"""
+    formats = defaultdict(lambda: {"entries": 0, "bytes": 0})
+    mtimes = []
+    for mtime, size, path in cache.entries():
+        formats[path.suffix[1:]]["entries"] += 1
+        formats[path.suffix[1:]]["bytes"] += size
+        mtimes.append(mtime)
+    counts = cache.read_stats()
+    hits = counts["hit"] + counts["wait"]
+    lookups = hits + counts["miss"]
+    return {
+        "directory": str(cache.directory),
+        "entries": sum(f["entries"] for f in formats.values()),
+        "bytes": sum(f["bytes"] for f in formats.values()),
+        "max_bytes": cache.max_bytes,
+        "formats": dict(sorted(formats.items())),
+        "oldest_use": min(mtimes, default=None),
+        "newest_use": max(mtimes, default=None),
+        **counts,
+        "hit_rate": hits / lookups if lookups else None,
+    }
+
+
+def _format_time(timestamp):
+    if timestamp is None:
+        return "-"
+    return time.strftime("%Y-%m-%d %H:%M", time.localtime(timestamp))
+
+
+def print_report(report):
+    mb = 1024**2
+    print(f"フォルダ: {report['directory']}")
+    print(
+        f"エントリ: {report['entries']} 件, "
+        f"{report['bytes'] / mb:.1f} MB / 上限 {report['max_bytes'] / mb:.0f} MB"
+    )
+    for fmt, info in report["formats"].items():
+        print(f"  {fmt:<4} {info['entries']:>8} 件 {info['bytes'] / mb:>10.1f} MB")
+    print(
+        f"最終使用: {_format_time(report['oldest_use'])} ～ "
+        f"{_format_time(report['newest_use'])}"
+    )
+    rate = "-" if report["hit_rate"] is None else f"{report['hit_rate']:.1%}"
+    print(
+        f"ヒット率: {rate}（ヒット {report['hit']}, 他のプロセスの描画を待って使用 "
+        f"{report['wait']}, ミス {report['miss']}）"
+    )
+
+
+def main(argv=None):
+    # --config を先に読んで、その設定を既定値として使う
+    pre_parser = argparse.ArgumentParser(add_help=False)
+    pre_parser.add_argument("--config", default=None)
+    pre_args, _ = pre_parser.parse_known_args(argv)
+    settings = load_settings(pre_args.config) if pre_args.config else load_settings()
+
+    parser = argparse.ArgumentParser(description="レンダリングキャッシュの管理")
+    parser.add_argument("--config", default=None, help="設定ファイル")
+    parser.add_argument(
+        "--cache-dir",
+        default=settings.get("cache_dir", str(DEFAULT_CACHE_DIR)),
+        help="キャッシュフォルダ",
+    )
+    parser.add_argument(
+        "--max-mb",
+        type=int,
+        default=settings.get("cache_max_mb", DEFAULT_MAX_MB),
+        help="キャッシュの上限サイズ (MB)",
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+    stats_parser = commands.add_parser("stats", help="サイズとヒット率を表示")
+    stats_parser.add_argument("--json", action="store_true", help="JSON で出力")
+    stats_parser.add_argument(
+        "--reset", action="store_true", help="表示したあとヒット数などを 0 に戻す"
+    )
+    prune_parser = commands.add_parser(
+        "prune", help="古いエントリを削除して上限サイズまで減らす"
+    )
+    prune_parser.add_argument(
+        "--max-age-days",
+        type=float,
+        default=None,
+        help="この日数より長く使われていないエントリを削除",
+    )
+    commands.add_parser("clear", help="すべてのエントリを削除")
+    args = parser.parse_args(argv)
+
+    cache = RenderCache(args.cache_dir, args.max_mb * 1024**2)
+    if args.command == "stats":
+        report = cache_report(cache)
+        if args.json:
+            print(json.dumps(report, ensure_ascii=False, indent=2))
+        else:
+            print_report(report)
+        if args.reset:
+            cache.reset_stats()
+    elif args.command == "prune":
+        max_age = None if args.max_age_days is None else args.max_age_days * 86400
+        removed, removed_bytes = cache.prune(max_age)
+        print(f"{removed} 件（{removed_bytes / 1024**2:.1f} MB）削除しました")
+    else:
+        cache.clear()
+        print("キャッシュを削除しました")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
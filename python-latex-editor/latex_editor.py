@@ -3,48 +3,193 @@
 """
 LaTeX 数式エディタ（Computer Modern フォント）
 matplotlib + LaTeX を使用して完全な LaTeX デフォルトフォント対応
+
+高速起動モード（既定）では、ウィンドウを先に表示し、matplotlib と TeX 周りは
+バックグラウンドで読み込んでから最初のプレビューを描画する。
 """
 
+import time
+
+# 起動時間の計測の基準（重いモジュールを読み込む前）
+_START_TIME = time.perf_counter()
+
+import argparse
+import base64
+import functools
+import importlib
 import tkinter as tk
 from tkinter import ttk, filedialog, messagebox
-import matplotlib
 import json
+import sqlite3
 from pathlib import Path
-
-matplotlib.use("TkAgg")
-import matplotlib.pyplot as plt
-from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
-from matplotlib.figure import Figure
-import matplotlib.patches as mpatches
+import io
 import os
+import sys
+import threading
+from dataclasses import replace
 from datetime import datetime
 
+from latex_render import (
+    BACKENDS,
+    DEFAULT_EXPORT_TARGETS,
+    DEFAULT_NAME_TEMPLATE,
+    DEFAULT_PREAMBLE,
+    SAMPLE_EQUATIONS,
+    SAVE_FORMATS,
+    RenderOptions,
+    apply_background,
+    artifact_matches,
+    build_math_text,
+    compile_artifact,
+    configure_matplotlib,
+    export_targets,
+    prepare_format,
+    render_cached,
+    render_to_bytes,
+    resolve_backend,
+)
+from equation_history import (
+    DEFAULT_HISTORY_FILE,
+    DEFAULT_MAX_ENTRIES,
+    HistoryStore,
+    entry_key,
+)
+from history_panel import HistoryPanel
+from latex_lint import LINT_MODES, lint
+from render_cache import DEFAULT_CACHE_DIR, DEFAULT_MAX_MB, RenderCache
+from render_stats import stats
+from tex_format import FormatError
+from preview_worker import PreviewWorker
+from speculative_renderer import DEFAULT_BUDGET_MB, SpeculativeRenderer
+from svg_optimize import DEFAULT_PRECISION, SVG_MODES, optimize as optimize_svg
+import tex_process
+from tex_process import ProcessLimits
+from tex_worker import TeXWorker
+
+# フォントサイズの範囲と背景色の選択肢
+FONTSIZE_MIN = 12
+FONTSIZE_MAX = 72
+BGCOLORS = ["transparent", "white", "lightgray"]
+# ライブプレビュー: 最後のキー入力から描画開始までの待ち時間 (ms)
+PREVIEW_DEBOUNCE_MS = 300
+# バックグラウンド描画の結果を確認する間隔 (ms)
+PREVIEW_POLL_MS = 30
+# レンダリング統計の表示を更新する間隔 (ms)
+STATS_REFRESH_MS = 1000
+# 統計パネルで先頭に表示する段階（全体の所要時間）
+STATS_TOTAL_STAGES = ["preview", "save", "export"]
+# 表示したプレビューを履歴に記録するまでの待ち時間 (ms)
+# （ライブプレビューで入力途中の数式を記録しないよう、表示が変わらなくなってから）
+HISTORY_RECORD_DELAY_MS = 1500
+# バックグラウンドでの読み込みの完了を確認する間隔 (ms)
+LOADER_POLL_MS = 50
+# プレビューの解像度（figure モード）
+PREVIEW_DPI = 100
+# プレビューの表示方法
+#   raster: 画面解像度の PNG を Tk の Canvas に表示（背景色は Canvas の色で合成）
+#   figure: matplotlib の Figure に描画
+PREVIEW_MODES = ["raster", "figure"]
+# 読み込みに時間がかかるので、高速起動ではバックグラウンドで先に読み込むモジュール
+PRELOAD_MODULES = [
+    "matplotlib.figure",
+    "matplotlib.image",
+    "matplotlib.backends.backend_tkagg",
+]
+
 
 class LaTeXEditor:
-    def __init__(self, root):
+    def __init__(self, root, fast_start=None, on_startup_complete=None):
         self.root = root
         self.root.title("LaTeX 数式エディタ - Computer Modern")
-        self.root.geometry("1000x700")
+        self.root.geometry("1300x700")
 
         # 設定ファイルのパス（アプリと同じフォルダ）
         app_dir = Path(__file__).parent
         self.config_file = app_dir / "latex_editor_config.json"
 
-        # matplotlib の LaTeX 設定
-        plt.rcParams.update(
-            {
-                "text.usetex": True,
-                "font.family": "serif",
-                # Computer Modern (TeXデフォルト) を使用
-                "text.latex.preamble": r"\usepackage{amsmath}\usepackage{amssymb}\usepackage{bm}",
-            }
-        )
+        # LaTeX のプリアンブル（load_settings で上書き）
+        self.preamble = DEFAULT_PREAMBLE
+        self.precompiled_preamble = True
+
+        # レンダリングキャッシュの設定（load_settings で上書き）
+        self.cache_dir = str(DEFAULT_CACHE_DIR)
+        self.cache_max_mb = DEFAULT_MAX_MB
+        self.use_tex_worker = False
+        self.export_name_template = DEFAULT_NAME_TEMPLATE
+        # 計測ログ（1 行 1 JSON、None なら書き出さない）
+        self.stats_log_file = None
+        # 高速起動（matplotlib と TeX 周りをバックグラウンドで読み込む）
+        self.fast_start = True
+        self.preview_mode = "raster"
+        # TeX を実行する前の構文チェック（on / strict / off）
+        self.lint_mode = "on"
+        # 先読みしたプレビューに使うメモリの上限（MB、0 で先読みしない）
+        self.speculative_budget_mb = DEFAULT_BUDGET_MB
+        # 保存する SVG（standalone / minify、sprite は一括変換でのみ使う）
+        self.svg_mode = "standalone"
+        self.svg_precision = DEFAULT_PRECISION
+        # latex などの外部ツールの時間・メモリ・CPU 時間の上限
+        self.process_limits = ProcessLimits()
+        # 数式の履歴（SQLite）
+        self.history_file = str(DEFAULT_HISTORY_FILE)
+        self.history_max_entries = DEFAULT_MAX_ENTRIES
 
         self.setup_ui()
         self.load_settings()  # 設定を読み込み
+        stats.set_log_file(self.stats_log_file)
+        tex_process.configure(self.process_limits)
+        # 引数で指定した場合は設定より優先（設定ファイルには保存しない）
+        self.started_fast = self.fast_start if fast_start is None else fast_start
+
+        self.render_cache = self.create_render_cache()
+        # 別プロセスの TeX ワーカー（use_tex_worker が true のとき、キャッシュにない保存で使用）
+        self.tex_worker = (
+            TeXWorker(
+                self.preamble,
+                self.precompiled_preamble,
+                lint=self.lint_mode,
+                limits=self.process_limits,
+            )
+            if self.use_tex_worker
+            else None
+        )
         self.setup_shortcuts()  # ショートカットキーを設定
+        self.setup_live_preview()  # ライブプレビューを設定
+        self.setup_stats_panel()  # レンダリング統計を設定
+        self.setup_history_panel()  # 数式の履歴を設定
         self.current_equation = r"E = mc^2"
-        self.render_equation()
+        # 直前のプレビューのコンパイル結果（保存時に再利用）
+        self.last_artifact = None
+        # 表示中または描画中のプレビューの (数式, オプション)（同じなら描画し直さない）
+        self._preview_request = None
+        # 構文チェックの警告（描画後に状態表示に出す）
+        self._lint_message = ""
+
+        # 起動時間 (ms): window（ウィンドウ表示）, renderer_ready（読み込み完了）,
+        # first_preview（最初のプレビュー）
+        self.startup_times = {}
+        # 最初のプレビューが終わったら（描画しなかった・失敗した場合も）startup_times と
+        # 結果を渡して呼ぶ（読み込みに失敗してもダイアログは出さない）
+        self.on_startup_complete = on_startup_complete
+        self.root.after_idle(self.record_startup, "window")
+
+        # matplotlib の読み込みと LaTeX 設定（最初のプレビューは読み込み後に描画）
+        self.renderer_ready = False
+        self._loader_error = None
+        # Tk の変数はバックグラウンドスレッドから読めないので先に取得
+        options = self.get_preview_options()
+        if self.started_fast:
+            self._loader = threading.Thread(
+                target=self.load_renderer_in_background,
+                args=(options,),
+                name="renderer-loader",
+                daemon=True,
+            )
+            self._loader.start()
+            self.root.after(LOADER_POLL_MS, self.poll_renderer_loaded)
+        else:
+            self.load_renderer(options)
+            self.on_renderer_loaded()
 
         # 終了時に設定を保存
         self.root.protocol("WM_DELETE_WINDOW", self.on_closing)
@@ -71,6 +216,11 @@ class LaTeXEditor:
         )
         self.equation_text.insert("1.0", r"E = mc^2")
         self.equation_text.grid(row=0, column=0, sticky=(tk.W, tk.E))
+        # 構文チェックで見つかった問題の位置
+        self.equation_text.tag_configure("lint_error", underline=True, foreground="red")
+        self.equation_text.tag_configure(
+            "lint_warning", underline=True, foreground="darkorange"
+        )
 
         # ボタンフレーム
         button_frame = ttk.Frame(input_frame)
@@ -79,7 +229,7 @@ class LaTeXEditor:
         ttk.Button(
             button_frame,
             text="プレビュー更新 (Ctrl+Enter)",
-            command=self.render_equation,
+            command=self.refresh_preview,
         ).pack(side=tk.LEFT, padx=5)
         ttk.Button(
             button_frame, text="クリア (Ctrl+L)", command=self.clear_equation
@@ -87,6 +237,9 @@ class LaTeXEditor:
         ttk.Button(button_frame, text="📥 保存 (Ctrl+S)", command=self.save_image).pack(
             side=tk.LEFT, padx=5
         )
+        ttk.Button(
+            button_frame, text="📦 一括エクスポート", command=self.export_all
+        ).pack(side=tk.LEFT, padx=5)
         ttk.Button(button_frame, text="↶ 元に戻す (Ctrl+Z)", command=self.undo).pack(
             side=tk.LEFT, padx=5
         )
@@ -106,7 +259,11 @@ class LaTeXEditor:
         )
         self.fontsize_var = tk.IntVar(value=24)
         ttk.Spinbox(
-            options_frame, from_=12, to=72, textvariable=self.fontsize_var, width=10
+            options_frame,
+            from_=FONTSIZE_MIN,
+            to=FONTSIZE_MAX,
+            textvariable=self.fontsize_var,
+            width=10,
         ).grid(row=0, column=1, padx=5)
 
         # 背景色
@@ -117,7 +274,7 @@ class LaTeXEditor:
         bgcolor_combo = ttk.Combobox(
             options_frame,
             textvariable=self.bgcolor_var,
-            values=["transparent", "white", "lightgray"],
+            values=BGCOLORS,
             width=12,
         )
         bgcolor_combo.grid(row=0, column=3, padx=5)
@@ -150,16 +307,69 @@ class LaTeXEditor:
         )
         format_combo.grid(row=1, column=3, padx=5, pady=(5, 0))
 
-        # プレビューフレーム
-        preview_frame = ttk.LabelFrame(main_frame, text="プレビュー", padding="10")
-        preview_frame.grid(
-            row=2, column=0, columnspan=2, sticky=(tk.W, tk.E, tk.N, tk.S), pady=(0, 10)
+        # 一括エクスポートの書き出し先（png@2x は 2 倍解像度の PNG）
+        ttk.Label(options_frame, text="一括エクスポート:").grid(
+            row=2, column=0, sticky=tk.W, pady=(5, 0)
         )
+        self.export_targets_var = tk.StringVar(value=",".join(DEFAULT_EXPORT_TARGETS))
+        ttk.Entry(options_frame, textvariable=self.export_targets_var, width=30).grid(
+            row=2, column=1, padx=5, pady=(5, 0)
+        )
+
+        # 描画方式（dvi: dvisvgm などで直接変換、ツールがなければ matplotlib）
+        ttk.Label(options_frame, text="描画方式:").grid(
+            row=2, column=2, sticky=tk.W, padx=(10, 0), pady=(5, 0)
+        )
+        self.backend_var = tk.StringVar(value="dvi")
+        ttk.Combobox(
+            options_frame,
+            textvariable=self.backend_var,
+            values=BACKENDS,
+            state="readonly",
+            width=12,
+        ).grid(row=2, column=3, padx=5, pady=(5, 0))
 
-        # matplotlib Figure
-        self.figure = Figure(figsize=(8, 3), dpi=100)
-        self.canvas = FigureCanvasTkAgg(self.figure, master=preview_frame)
-        self.canvas.get_tk_widget().pack(fill=tk.BOTH, expand=True)
+        # ライブプレビュー（入力中にバックグラウンドで描画）
+        self.live_preview_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(
+            options_frame,
+            text="ライブプレビュー",
+            variable=self.live_preview_var,
+        ).grid(row=1, column=4, padx=10, pady=(5, 0))
+
+        # レンダリング統計（段階ごとの p50/p95）
+        self.show_stats_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(
+            options_frame,
+            text="統計を表示",
+            variable=self.show_stats_var,
+        ).grid(row=2, column=4, padx=10, pady=(5, 0))
+
+        # 数式の履歴（横のパネル）
+        self.show_history_var = tk.BooleanVar(value=True)
+        ttk.Checkbutton(
+            options_frame,
+            text="履歴を表示",
+            variable=self.show_history_var,
+        ).grid(row=0, column=5, padx=10)
+
+        # プレビューフレーム（matplotlib の Figure は読み込み後に作成）
+        self.preview_frame = ttk.LabelFrame(
+            main_frame, text="プレビュー", padding="10"
+        )
+        self.preview_frame.grid(
+            row=2, column=0, columnspan=2, sticky=(tk.W, tk.E, tk.N, tk.S), pady=(0, 10)
+        )
+        self.figure = None
+        self.canvas = None
+        self.preview_canvas = None
+
+        # プレビューの状態表示（ライブプレビューのエラーなど）
+        self.preview_status_var = tk.StringVar(value="読み込み中...")
+        self.preview_status_label = ttk.Label(
+            self.preview_frame, textvariable=self.preview_status_var
+        )
+        self.preview_status_label.pack(anchor=tk.W)
 
         # サンプル数式
         samples_frame = ttk.LabelFrame(
@@ -167,30 +377,166 @@ class LaTeXEditor:
         )
         samples_frame.grid(row=3, column=0, columnspan=2, sticky=(tk.W, tk.E))
 
-        samples = [
-            ("アインシュタインの質量エネルギー等価式", r"E = mc^2"),
-            ("ガウス積分", r"\int_0^\infty e^{-x^2} dx = \frac{\sqrt{\pi}}{2}"),
-            ("バーゼル問題", r"\sum_{n=1}^{\infty} \frac{1}{n^2} = \frac{\pi^2}{6}"),
-            (
-                "マクスウェル方程式",
-                r"\nabla \times \bm{E} = -\frac{\partial \bm{B}}{\partial t}",
-            ),
-            ("二次方程式の解の公式", r"x = \frac{-b \pm \sqrt{b^2 - 4ac}}{2a}"),
-            ("オイラーの等式", r"e^{i\pi} + 1 = 0"),
-        ]
-
-        for i, (name, eq) in enumerate(samples):
+        for i, (name, eq) in enumerate(SAMPLE_EQUATIONS):
             btn = ttk.Button(
                 samples_frame, text=name, command=lambda e=eq: self.insert_sample(e)
             )
             btn.grid(row=i // 2, column=i % 2, sticky=(tk.W, tk.E), padx=5, pady=2)
 
+        # レンダリング統計（「統計を表示」で表示）
+        self.stats_frame = ttk.LabelFrame(
+            main_frame, text="レンダリング統計（直近）", padding="10"
+        )
+        self.stats_frame.grid(
+            row=4, column=0, columnspan=2, sticky=(tk.W, tk.E), pady=(10, 0)
+        )
+        self.stats_var = tk.StringVar(value="")
+        ttk.Label(
+            self.stats_frame,
+            textvariable=self.stats_var,
+            font=("Courier New", 9),
+            justify=tk.LEFT,
+        ).pack(anchor=tk.W)
+
+        # 数式の履歴（クリックで挿入、右クリックでお気に入り・削除）
+        self.history_frame = ttk.LabelFrame(
+            main_frame, text="履歴（クリックで挿入）", padding="10"
+        )
+        self.history_frame.grid(
+            row=0, column=2, rowspan=5, sticky=(tk.W, tk.E, tk.N, tk.S), padx=(10, 0)
+        )
+
         # グリッド設定
         self.root.columnconfigure(0, weight=1)
         self.root.rowconfigure(0, weight=1)
         main_frame.columnconfigure(0, weight=1)
         main_frame.rowconfigure(2, weight=1)
 
+    def load_renderer(self, options):
+        """matplotlib と TeX 周りを読み込み、LaTeX を設定する
+
+        高速起動ではバックグラウンドスレッドで実行するので、Tk には触れないこと。
+        """
+        with stats.stage("startup.load_renderer"):
+            for name in PRELOAD_MODULES:
+                importlib.import_module(name)
+            configure_matplotlib(
+                self.preamble, self.precompiled_preamble, self.lint_mode
+            )
+            # 外部ツールの検索結果はキャッシュされるので、ここで済ませておく
+            for fmt in SAVE_FORMATS:
+                resolve_backend(RenderOptions(save_format=fmt))
+            if self.precompiled_preamble:
+                try:
+                    prepare_format(options)
+                except FormatError:
+                    pass  # TeX がない場合など（描画時に通常のコンパイルへフォールバック）
+
+    def load_renderer_in_background(self, options):
+        """load_renderer をバックグラウンドスレッドで実行（例外は後でメインスレッドに報告）"""
+        try:
+            self.load_renderer(options)
+        except Exception as e:
+            self._loader_error = e
+
+    def poll_renderer_loaded(self):
+        """バックグラウンドでの読み込みが終わるまで待つ"""
+        if self._loader.is_alive():
+            self.root.after(LOADER_POLL_MS, self.poll_renderer_loaded)
+            return
+        self.on_renderer_loaded()
+
+    def on_renderer_loaded(self):
+        """プレビューの表示先を作成し、最初のプレビューを描画"""
+        if self._loader_error is not None:
+            self.preview_status_var.set("")
+            if self.on_startup_complete is not None:
+                error = f"load_error: {self._loader_error}"
+                self.record_startup("first_preview", error)
+                return
+            messagebox.showerror(
+                "起動エラー",
+                f"matplotlib を読み込めませんでした:\n{self._loader_error}",
+            )
+            return
+        self.create_preview_widget()
+        self.renderer_ready = True
+        self.record_startup("renderer_ready")
+        self.preview_status_var.set("")
+        # 最初のプレビューもバックグラウンドで描画（TeX の実行中も入力できる）
+        self.render_equation_async()
+
+    def create_preview_widget(self):
+        """プレビューの表示先を作成（raster: Tk の Canvas、figure: matplotlib の Figure）"""
+        if self.preview_mode == "figure":
+            from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+            from matplotlib.figure import Figure
+
+            self.figure = Figure(figsize=(8, 3), dpi=PREVIEW_DPI)
+            self.canvas = FigureCanvasTkAgg(self.figure, master=self.preview_frame)
+            widget = self.canvas.get_tk_widget()
+        else:
+            self.preview_canvas = tk.Canvas(
+                self.preview_frame, height=300, highlightthickness=0
+            )
+            self.preview_canvas_bg = self.preview_canvas.cget("background")
+            # 画像は 1 つの PhotoImage に読み込み直して使い回す（何度描画してもメモリが増えない）
+            self.preview_photo = tk.PhotoImage(master=self.root)
+            self.preview_item = self.preview_canvas.create_image(
+                0, 0, image=self.preview_photo
+            )
+            self.preview_canvas.bind(
+                "<Configure>", lambda e: self.center_preview_image()
+            )
+            widget = self.preview_canvas
+        widget.pack(fill=tk.BOTH, expand=True, before=self.preview_status_label)
+        self.apply_preview_background()
+
+    def center_preview_image(self):
+        """プレビューの画像を Canvas の中央に移動"""
+        self.preview_canvas.coords(
+            self.preview_item,
+            self.preview_canvas.winfo_width() // 2,
+            self.preview_canvas.winfo_height() // 2,
+        )
+
+    def apply_preview_background(self):
+        """プレビューの背景色を設定（raster では TeX を実行せず合成し直すだけ）"""
+        if self.preview_canvas is None:
+            return
+        bgcolor = self.bgcolor_var.get()
+        try:
+            self.preview_canvas.configure(
+                background=(
+                    self.preview_canvas_bg if bgcolor == "transparent" else bgcolor
+                )
+            )
+        except tk.TclError:
+            pass  # 入力途中の色名など
+
+    def renderer_loading(self):
+        """読み込み中なら状態表示で知らせて True を返す"""
+        if self.renderer_ready:
+            return False
+        self.preview_status_var.set("読み込み中です。しばらくお待ちください...")
+        return True
+
+    def record_startup(self, name, result="ok"):
+        """起動からの経過時間を記録（最初の 1 回だけ）
+
+        first_preview は最初のプレビューの結果にかかわらず記録し、result に
+        ok / empty（数式が空）/ lint（構文エラー）/ error: ... / load_error: ... を渡す。
+        """
+        if name in self.startup_times:
+            return
+        ms = (time.perf_counter() - _START_TIME) * 1000
+        self.startup_times[name] = ms
+        stats.record(f"startup.{name}", ms, fast_start=self.started_fast)
+        if name == "first_preview" and self.on_startup_complete:
+            self.on_startup_complete(
+                dict(self.startup_times, fast_start=self.started_fast, result=result)
+            )
+
     def render_equation(self):
         """数式をレンダリング"""
         equation = self.equation_text.get("1.0", tk.END).strip()
@@ -205,111 +551,437 @@ class LaTeXEditor:
         fontsize = self.fontsize_var.get()
         bgcolor = self.bgcolor_var.get()
 
+        # 明らかに壊れた入力は TeX を実行せずに知らせる
+        blocking = self.blocking_issues(self.lint_input())
+        if blocking:
+            messagebox.showerror(
+                "構文エラー", "\n".join(str(issue) for issue in blocking)
+            )
+            return
+        self.preview_status_var.set(self._lint_message)
+
+        # dvi 方式ではコンパイル結果を保存時に再利用できるよう残しておく
+        options = self.get_preview_options()
+        backend = resolve_backend(options)
+        if backend == "dvi" or self.preview_mode == "raster":
+            request = (self.equation_text.get("1.0", tk.END).strip(), options)
+            if request == self._preview_request:
+                return  # 表示中（または描画中）の画像と同じ
+            self._preview_request = request
+            try:
+                result = self.speculated(*request) or self.render_preview(*request)
+                data, self.last_artifact = result
+                self.show_preview_image(data)
+                self.schedule_speculation(*request)
+                self.schedule_history()
+            except Exception as e:
+                self._preview_request = None
+                messagebox.showerror(
+                    "レンダリングエラー",
+                    f"数式のレンダリングに失敗しました。\n\nエラー: {str(e)}\n\n入力: {equation}",
+                )
+            return
+
         # Figure をクリア
         self.figure.clear()
         ax = self.figure.add_subplot(111)
 
         # 背景色設定
-        if bgcolor == "transparent":
-            self.figure.patch.set_alpha(0)
-            ax.patch.set_alpha(0)
-        elif bgcolor == "white":
-            self.figure.patch.set_facecolor("white")
-            ax.patch.set_facecolor("white")
-        else:
-            self.figure.patch.set_facecolor(bgcolor)
-            ax.patch.set_facecolor(bgcolor)
+        apply_background(self.figure, ax, bgcolor)
 
         try:
-            # 改行を含む数式の場合は、align環境などを使用
-            # 通常の数式はそのまま、改行がある場合は適切に処理
-            equation_formatted = equation
-            needs_math_mode = True  # 数式モード($...$)が必要かどうか
-
-            # デバッグ出力（プレビュー）
-            print("PREVIEW DEBUG: Original equation:")
-            print(repr(equation))
-            print(
-                "PREVIEW DEBUG: Starts with \\begin?",
-                equation.strip().startswith(r"\begin"),
+            with stats.stage("preview", backend=backend):
+                # 改行を含む数式は aligned 環境などに変換（latex_render と共通）
+                math_text_clean = build_math_text(equation)
+
+                ax.text(
+                    0.5,
+                    0.5,
+                    math_text_clean,
+                    fontsize=fontsize,
+                    ha="center",
+                    va="center",
+                    transform=ax.transAxes,
+                )
+
+                ax.axis("off")
+                # TeX のコンパイルは tight_layout（文字の大きさの計算）の中で行われる
+                with stats.stage("tight_layout"):
+                    self.figure.tight_layout(pad=0.1)  # パディングを最小化
+                with stats.stage("canvas.draw"):
+                    self.canvas.draw()
+            self.schedule_history()
+
+        except Exception as e:
+            messagebox.showerror(
+                "レンダリングエラー",
+                f"数式のレンダリングに失敗しました。\n\nエラー: {str(e)}\n\n入力: {equation}",
             )
 
-            # \begin{...} 環境がある場合はチェック
-            if equation.strip().startswith(r"\begin"):
-                # align, align*, equation, equation*などの環境は数式モード不要
-                math_environments = [
-                    "align",
-                    "align*",
-                    "equation",
-                    "equation*",
-                    "gather",
-                    "gather*",
-                    "multline",
-                    "multline*",
-                ]
-                for env in math_environments:
-                    if equation.strip().startswith(f"\\begin{{{env}}}"):
-                        needs_math_mode = False
-                        print(
-                            f"PREVIEW DEBUG: Detected {env} environment, needs_math_mode = False"
-                        )
-                        break
-            elif "\n" in equation:
-                # 改行があるが\begin環境がない場合、aligned環境を使用
-                lines = equation.strip().split("\n")
-                lines = [line.strip() for line in lines if line.strip()]
-                if len(lines) > 1:
-                    equation_formatted = (
-                        r"\begin{aligned}" + r"\\".join(lines) + r"\end{aligned}"
-                    )
-                    print("PREVIEW DEBUG: Created aligned environment")
+    def refresh_preview(self):
+        """プレビューを更新（ライブプレビュー時はバックグラウンドで描画）"""
+        if self.renderer_loading():
+            return  # 読み込み後に最新の入力で描画される
+        if self.live_preview_var.get():
+            self.render_equation_async()
+        else:
+            self.render_equation()
+
+    def setup_live_preview(self):
+        """ライブプレビューを設定"""
+        self.preview_worker = PreviewWorker(self.render_preview)
+        self._preview_after_id = None
+        self._preview_poll_id = None
+        # プレビューが空いている間に次の候補を先に描画しておく
+        self.speculative = None
+        if self.speculative_budget_mb > 0:
+            self.speculative = SpeculativeRenderer(
+                functools.partial(self.render_preview, stage="speculative"),
+                self.preview_worker.idle,
+                self.speculative_budget_mb * 1024**2,
+            )
+        self._speculated_equation = None
+
+        def on_change(*args):
+            if self.live_preview_var.get():
+                self.schedule_preview()
 
-            print("PREVIEW DEBUG: needs_math_mode =", needs_math_mode)
-            print("PREVIEW DEBUG: equation_formatted =", repr(equation_formatted))
+        def on_bgcolor_change(*args):
+            if self.preview_mode == "raster":
+                self.apply_preview_background()  # 描画し直さない
+            else:
+                on_change()
 
-            # 数式をレンダリング
-            if needs_math_mode:
-                math_text = f"${equation_formatted}$"
+        # 構文チェックの印は入力のたびに更新（ライブプレビューでなくても）
+        self.equation_text.bind("<KeyRelease>", lambda e: self.lint_input(), add="+")
+        # 入力が変わったら先読みを止めて結果を捨てる
+        self.equation_text.bind(
+            "<KeyRelease>", lambda e: self.discard_speculation(), add="+"
+        )
+        self.equation_text.bind("<KeyRelease>", on_change, add="+")
+        for var in (self.fontsize_var, self.displaystyle_var):
+            var.trace_add("write", on_change)
+        self.bgcolor_var.trace_add("write", on_bgcolor_change)
+
+    def lint_input(self):
+        """入力を構文チェックし、問題の位置に印を付けて LintIssue のリストを返す"""
+        for tag in ("lint_error", "lint_warning"):
+            self.equation_text.tag_remove(tag, "1.0", tk.END)
+        self._lint_message = ""
+        if self.lint_mode == "off":
+            return []
+        issues = lint(self.equation_text.get("1.0", "end-1c"), self.preamble)
+        for issue in issues:
+            index = f"{issue.line}.{issue.column - 1}"
+            # コマンドはコマンド名の終わりまで、それ以外は 1 文字に印を付ける
+            if self.equation_text.get(index) == "\\":
+                end = f"{index} + 1c wordend"
             else:
-                math_text = equation_formatted
-
-            print("PREVIEW DEBUG: Final math_text =", repr(math_text))
-
-            # matplotlibに渡す前に、Pythonの改行(\n)を除去
-            # LaTeXの\\は保持する必要があるため、\n のみを削除
-            math_text_clean = math_text.replace("\n", " ")
-            print("PREVIEW DEBUG: Cleaned math_text =", repr(math_text_clean))
-
-            ax.text(
-                0.5,
-                0.5,
-                math_text_clean,
-                fontsize=fontsize,
-                ha="center",
-                va="center",
-                transform=ax.transAxes,
+                end = f"{index} + 1c"
+            self.equation_text.tag_add(f"lint_{issue.severity}", index, end)
+        warnings = [issue for issue in issues if issue.severity == "warning"]
+        if warnings:
+            self._lint_message = f"構文{warnings[0]}"
+        return issues
+
+    def blocking_issues(self, issues):
+        """描画を止める問題（strict では警告も含む）"""
+        return [
+            issue
+            for issue in issues
+            if issue.severity == "error" or self.lint_mode == "strict"
+        ]
+
+    def schedule_preview(self):
+        """キー入力をまとめて、入力が止まったらバックグラウンドで描画"""
+        if self._preview_after_id is not None:
+            self.root.after_cancel(self._preview_after_id)
+        self._preview_after_id = self.root.after(
+            PREVIEW_DEBOUNCE_MS, self.render_equation_async
+        )
+
+    def render_equation_async(self):
+        """数式をバックグラウンドスレッドでレンダリング"""
+        self._preview_after_id = None
+        if self.renderer_loading():
+            return
+        equation = self.equation_text.get("1.0", tk.END).strip()
+        if not equation:
+            self.record_startup("first_preview", "empty")
+            return
+        try:
+            options = self.get_preview_options()
+        except tk.TclError as e:
+            self.record_startup("first_preview", f"error: {e}")
+            return  # フォントサイズの入力途中など
+
+        blocking = self.blocking_issues(self.lint_input())
+        if blocking:
+            # TeX を実行せずに状態表示で知らせる
+            self.preview_status_var.set(f"構文{blocking[0]}")
+            self.record_startup("first_preview", "lint")
+            return
+        if (equation, options) == self._preview_request:
+            self.preview_status_var.set(self._lint_message)
+            return  # 表示中（または描画中）の画像と同じ
+        self._preview_request = (equation, options)
+
+        self.current_equation = equation
+        result = self.speculated(equation, options)
+        if result is not None:
+            # 描画中の古い依頼の結果は表示しない
+            self.preview_worker.cancel()
+            data, self.last_artifact = result
+            self.show_preview_image(data)
+            self.preview_status_var.set(self._lint_message)
+            self.schedule_speculation(equation, options)
+            self.schedule_history()
+            self.record_startup("first_preview")
+            return
+        self.preview_worker.submit(equation, options)
+        self.preview_status_var.set("レンダリング中...")
+        if self._preview_poll_id is None:
+            self._preview_poll_id = self.root.after(
+                PREVIEW_POLL_MS, self.poll_preview_results
+            )
+
+    def poll_preview_results(self):
+        """バックグラウンド描画の結果を受け取り、最新のものだけ表示"""
+        self._preview_poll_id = None
+        latest = None
+        while not self.preview_worker.results.empty():
+            result = self.preview_worker.results.get_nowait()
+            if self.preview_worker.is_current(result[0]):
+                latest = result
+
+        if latest is None:
+            # 最新の結果がまだ届いていない
+            self._preview_poll_id = self.root.after(
+                PREVIEW_POLL_MS, self.poll_preview_results
             )
+            return
+
+        _, result, error = latest
+        if error is not None:
+            # 入力途中の数式でダイアログを出さないよう、状態表示に留める
+            self.preview_status_var.set(f"レンダリングエラー: {error}")
+            self._preview_request = None
+            self.record_startup("first_preview", f"error: {error}")
+        else:
+            data, self.last_artifact = result
+            self.show_preview_image(data)
+            self.preview_status_var.set(self._lint_message)
+            self.schedule_speculation(*self._preview_request)
+            self.schedule_history()
+            self.record_startup("first_preview")
+
+    def speculated(self, equation, options):
+        """先読み済みのプレビュー (PNG, RenderArtifact または None)（なければ None）"""
+        if self.speculative is None:
+            return None
+        return self.speculative.get(equation, options)
+
+    def speculation_candidates(self, equation, options):
+        """次に表示しそうな (数式, オプション) を優先順に返す"""
+        candidates = []
+
+        def variant(**changes):
+            candidates.append((equation, replace(options, **changes)))
+
+        # フォントサイズの Spinbox の隣の値と displaystyle の切り替え
+        for step in (1, -1):
+            if FONTSIZE_MIN <= options.fontsize + step <= FONTSIZE_MAX:
+                variant(fontsize=options.fontsize + step)
+        variant(displaystyle=not options.displaystyle)
+        # サンプル数式のボタン
+        candidates += [(eq, options) for _, eq in SAMPLE_EQUATIONS if eq != equation]
+        for step in (2, -2):
+            if FONTSIZE_MIN <= options.fontsize + step <= FONTSIZE_MAX:
+                variant(fontsize=options.fontsize + step)
+        # raster モードでは背景色を Canvas で合成するので描画し直さない
+        if self.preview_mode != "raster":
+            for color in BGCOLORS:
+                if color != options.bgcolor:
+                    variant(bgcolor=color)
+        return candidates
+
+    def schedule_speculation(self, equation, options):
+        """表示中の数式とオプションを基準に先読みを始める"""
+        if self.speculative is None:
+            return
+        if equation != self._speculated_equation:
+            self.speculative.clear()
+            self._speculated_equation = equation
+        self.speculative.set_candidates(self.speculation_candidates(equation, options))
+
+    def discard_speculation(self):
+        """入力が先読みの基準から変わっていれば、先読みを止めて結果を捨てる"""
+        if self.speculative is None or self._speculated_equation is None:
+            return
+        if self.equation_text.get("1.0", tk.END).strip() != self._speculated_equation:
+            self.speculative.clear()
+            self._speculated_equation = None
+
+    def show_preview_image(self, data):
+        """描画済みの PNG をプレビューの中央に表示"""
+        # 履歴のサムネイルに使う
+        self._preview_png = (self._preview_request, data)
+        if self.preview_canvas is not None:
+            # PNG を PhotoImage に読み込み直す（背景は Canvas の背景色で合成される）
+            with stats.stage("blit"):
+                self.preview_photo.configure(
+                    data=base64.b64encode(data).decode("ascii"), format="png"
+                )
+                self.center_preview_image()
+            return
 
-            ax.axis("off")
-            self.figure.tight_layout(pad=0.1)  # パディングを最小化
+        import matplotlib.image as mimage
+
+        image = mimage.imread(io.BytesIO(data), format="png")
+        width, height = self.canvas.get_width_height()
+        self.figure.clear()
+        if self.bgcolor_var.get() == "transparent":
+            self.figure.patch.set_alpha(0)
+        else:
+            self.figure.patch.set_facecolor(self.bgcolor_var.get())
+            self.figure.patch.set_alpha(None)
+        self.figure.figimage(
+            image,
+            xo=max(0, (width - image.shape[1]) // 2),
+            yo=max(0, (height - image.shape[0]) // 2),
+        )
+        with stats.stage("canvas.draw"):
             self.canvas.draw()
 
-        except Exception as e:
-            messagebox.showerror(
-                "レンダリングエラー",
-                f"数式のレンダリングに失敗しました。\n\nエラー: {str(e)}\n\n入力: {equation}",
-            )
+    def setup_stats_panel(self):
+        """レンダリング統計の表示を設定（「統計を表示」で切り替え）"""
+        self._stats_after_id = None
+
+        def on_toggle(*args):
+            if self.show_stats_var.get():
+                self.stats_frame.grid()
+                self.update_stats_panel()
+            else:
+                self.stats_frame.grid_remove()
+                if self._stats_after_id is not None:
+                    self.root.after_cancel(self._stats_after_id)
+                    self._stats_after_id = None
+
+        self.show_stats_var.trace_add("write", on_toggle)
+        on_toggle()
+
+    def update_stats_panel(self):
+        """段階ごとの p50/p95 とキャッシュのヒット率を表示"""
+        summary = stats.summary()
+        stages = summary["stages"]
+        counters = summary["counters"]
+
+        names = [s for s in STATS_TOTAL_STAGES if s in stages]
+        names += sorted(s for s in stages if s not in STATS_TOTAL_STAGES)
+        lines = [
+            f"{name:<14} p50 {stages[name]['p50']:8.1f} ms   "
+            f"p95 {stages[name]['p95']:8.1f} ms   n={stages[name]['n']}"
+            for name in names
+        ]
+        # 他のプロセスの描画を待って使った分（cache_wait）もヒットに数える
+        waits = counters.get("cache_wait", 0)
+        hits = counters.get("cache_hit", 0) + waits
+        misses = counters.get("cache_miss", 0)
+        rate = f" ({hits / (hits + misses):.0%})" if hits + misses else ""
+        lines.append(
+            f"キャッシュ: ヒット {hits}（待機 {waits}） / ミス {misses}{rate}   "
+            f"コンパイル結果の再利用: {counters.get('artifact_reuse', 0)}   "
+            f"先読みのヒット: {counters.get('speculative_hit', 0)}"
+        )
+        self.stats_var.set("\n".join(lines))
+        self._stats_after_id = self.root.after(
+            STATS_REFRESH_MS, self.update_stats_panel
+        )
+
+    def setup_history_panel(self):
+        """数式の履歴を開いてパネルを作成（「履歴を表示」で切り替え）"""
+        self.history_panel = None
+        self._history_after_id = None
+        self._preview_png = None
+        self._last_recorded = None
+        try:
+            store = HistoryStore(self.history_file, self.history_max_entries)
+        except (OSError, sqlite3.Error) as e:
+            print(f"履歴を開けませんでした: {e}")
+            self.history_frame.grid_remove()
+            return
+        self.history_panel = HistoryPanel(
+            self.history_frame, store, self.insert_history
+        )
+        self.history_panel.pack(fill=tk.BOTH, expand=True)
+
+        def on_toggle(*args):
+            if self.show_history_var.get():
+                self.history_frame.grid()
+            else:
+                self.history_frame.grid_remove()
+
+        self.show_history_var.trace_add("write", on_toggle)
+        on_toggle()
+
+    def schedule_history(self):
+        """表示したプレビューを、しばらく表示が変わらなければ履歴に記録"""
+        if self.history_panel is None:
+            return
+        if self._history_after_id is not None:
+            self.root.after_cancel(self._history_after_id)
+        self._history_after_id = self.root.after(
+            HISTORY_RECORD_DELAY_MS, self.record_history
+        )
+
+    def record_history(self):
+        """入力中の数式と現在のオプションを履歴に記録（サムネイルはプレビューから）"""
+        if self.history_panel is None:
+            return
+        if self._history_after_id is not None:
+            self.root.after_cancel(self._history_after_id)
+            self._history_after_id = None
+        equation = self.equation_text.get("1.0", tk.END).strip()
+        try:
+            options = self.get_render_options()
+        except tk.TclError:
+            return  # フォントサイズの入力途中など
+        key = entry_key(equation, options)
+        if not equation or key == self._last_recorded:
+            return
+        self._last_recorded = key
+        png = None
+        if self._preview_png is not None:
+            request, data = self._preview_png
+            # raster モードのプレビューは背景が透明なので、背景色は比べない
+            if request is not None and key == entry_key(
+                request[0], replace(request[1], bgcolor=options.bgcolor)
+            ):
+                png = data
+        self.history_panel.record(equation, options, png)
+
+    def insert_history(self, row):
+        """履歴の数式を挿入し、記録したときのオプションに戻す"""
+        options = row["options"]
+        self.fontsize_var.set(options.get("fontsize", self.fontsize_var.get()))
+        self.bgcolor_var.set(options.get("bgcolor", self.bgcolor_var.get()))
+        self.displaystyle_var.set(
+            options.get("displaystyle", self.displaystyle_var.get())
+        )
+        if options.get("backend") in BACKENDS:
+            self.backend_var.set(options["backend"])
+        self.insert_sample(row["equation"])
 
     def clear_equation(self):
         """入力をクリア"""
         self.equation_text.delete("1.0", tk.END)
-        self.render_equation()
+        self.refresh_preview()
 
     def insert_sample(self, equation):
         """サンプル数式を挿入"""
         self.equation_text.delete("1.0", tk.END)
         self.equation_text.insert("1.0", equation)
-        self.render_equation()
+        self.refresh_preview()
 
     def undo(self):
         """元に戻す"""
@@ -330,7 +1002,7 @@ class LaTeXEditor:
 
         # Ctrl+Enter: プレビュー更新（改行を防ぐ）
         def on_ctrl_enter(e):
-            self.render_equation()
+            self.refresh_preview()
             return "break"  # イベントの伝播を停止
 
         # Ctrl+S: 保存（デフォルト動作を防ぐ）
@@ -369,10 +1041,89 @@ class LaTeXEditor:
 
     def save_image(self):
         """画像を保存"""
+        if self.renderer_loading():
+            return
         # 選択された形式を取得
         format = self.save_format_var.get()
 
         # ファイル名を生成
+        default_name = f"{self.default_basename()}.{format}"
+
+        filetypes = {
+            "png": [("PNG files", "*.png")],
+            "pdf": [("PDF files", "*.pdf")],
+            "svg": [("SVG files", "*.svg")],
+        }
+
+        filename = filedialog.asksaveasfilename(
+            defaultextension=f".{format}",
+            filetypes=filetypes[format],
+            initialfile=default_name,
+        )
+
+        if filename:
+            try:
+                # 元のテキストから数式を取得
+                equation = self.equation_text.get("1.0", tk.END).strip()
+                options = self.get_render_options()
+
+                with stats.stage("save", format=options.save_format):
+                    if artifact_matches(self.last_artifact, equation, options):
+                        # プレビューと同じ数式なら、コンパイル結果を変換するだけ
+                        stats.count("artifact_reuse", format=options.save_format)
+                        data = self.last_artifact.export(options)
+                    else:
+                        # 余白なしで描画して保存（変更がなければキャッシュから）
+                        data = self.render_bytes(equation, options)
+                    data = self.finish_svg(filename, options, data)
+                    with open(filename, "wb") as f:
+                        f.write(data)
+                self.record_history()
+
+                # 保存完了（通知なし）
+
+            except Exception as e:
+                messagebox.showerror("保存エラー", f"保存に失敗しました:\n{str(e)}")
+
+    def export_all(self):
+        """選択した形式・解像度を 1 回のコンパイルからまとめて書き出し"""
+        if self.renderer_loading():
+            return
+        output_dir = filedialog.askdirectory(title="書き出し先のフォルダを選択")
+        if not output_dir:
+            return
+        try:
+            equation = self.equation_text.get("1.0", tk.END).strip()
+            targets = [
+                t.strip() for t in self.export_targets_var.get().split(",") if t.strip()
+            ]
+            with stats.stage("export", targets=len(targets)):
+                export_targets(
+                    equation,
+                    self.get_render_options(),
+                    targets,
+                    output_dir,
+                    self.default_basename(),
+                    self.export_name_template,
+                    artifact=self.last_artifact,
+                    cache=self.render_cache,
+                    render=(
+                        self.tex_worker.render if self.tex_worker else render_to_bytes
+                    ),
+                    postprocess=self.finish_svg,
+                )
+            self.record_history()
+        except Exception as e:
+            messagebox.showerror("保存エラー", f"保存に失敗しました:\n{str(e)}")
+
+    def finish_svg(self, path, options, data):
+        """設定に応じて保存する SVG を縮小（1 ファイルずつなので sprite も minify と同じ）"""
+        if self.svg_mode == "standalone" or options.save_format != "svg":
+            return data
+        return optimize_svg(data, self.svg_precision)[0]
+
+    def default_basename(self):
+        """保存ファイル名の既定値（拡張子なし）"""
         if self.use_equation_filename_var.get():
             import re  # reモジュールをここでインポート
 
@@ -421,143 +1172,58 @@ class LaTeXEditor:
             # 長すぎる場合は切り詰める
             if len(safe_name) > 80:
                 safe_name = safe_name[:80]
-            default_name = (
-                f"{safe_name}.{format}" if safe_name else f"equation.{format}"
-            )
+            return safe_name if safe_name else "equation"
         else:
             # タイムスタンプを使用
             timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            default_name = f"equation_{timestamp}.{format}"
-
-        filetypes = {
-            "png": [("PNG files", "*.png")],
-            "pdf": [("PDF files", "*.pdf")],
-            "svg": [("SVG files", "*.svg")],
-        }
-
-        filename = filedialog.asksaveasfilename(
-            defaultextension=f".{format}",
-            filetypes=filetypes[format],
-            initialfile=default_name,
+            return f"equation_{timestamp}"
+
+    def get_render_options(self):
+        """現在の UI 設定からレンダリングオプションを生成"""
+        return RenderOptions(
+            fontsize=self.fontsize_var.get(),
+            bgcolor=self.bgcolor_var.get(),
+            displaystyle=self.displaystyle_var.get(),
+            save_format=self.save_format_var.get(),
+            backend=self.backend_var.get(),
         )
 
-        if filename:
-            try:
-                # 極小サイズでFigureを作成
-                save_fig = Figure(
-                    figsize=(0.1, 0.1), dpi=300 if format == "png" else 100
-                )
-                save_ax = save_fig.add_subplot(111)
-
-                bgcolor = self.bgcolor_var.get()
-                if bgcolor == "transparent":
-                    save_fig.patch.set_alpha(0)
-                    save_ax.patch.set_alpha(0)
-                elif bgcolor == "white":
-                    save_fig.patch.set_facecolor("white")
-                    save_ax.patch.set_facecolor("white")
-                else:
-                    save_fig.patch.set_facecolor(bgcolor)
-                    save_ax.patch.set_facecolor(bgcolor)
-
-                # 元のテキストから数式を取得
-                equation = self.equation_text.get("1.0", tk.END).strip()
-                if self.displaystyle_var.get():
-                    equation = r"\displaystyle " + equation
-                fontsize = self.fontsize_var.get()
-
-                # デバッグ出力
-                print("DEBUG: Original equation:")
-                print(repr(equation))
-                print("DEBUG: First 50 chars:", equation[:50])
-                print(
-                    "DEBUG: Starts with \\begin?",
-                    equation.strip().startswith(r"\begin"),
-                )
-
-                # 数式モードの判定（プレビューと同じロジック）
-                equation_formatted = equation
-                needs_math_mode = True
-
-                if equation.strip().startswith(r"\begin"):
-                    math_environments = [
-                        "align",
-                        "align*",
-                        "equation",
-                        "equation*",
-                        "gather",
-                        "gather*",
-                        "multline",
-                        "multline*",
-                    ]
-                    for env in math_environments:
-                        if equation.strip().startswith(f"\\begin{{{env}}}"):
-                            needs_math_mode = False
-                            print(f"DEBUG: Detected {env} environment")
-                            break
-                elif "\n" in equation:
-                    lines = equation.strip().split("\n")
-                    lines = [line.strip() for line in lines if line.strip()]
-                    if len(lines) > 1:
-                        equation_formatted = (
-                            r"\begin{aligned}" + r"\\".join(lines) + r"\end{aligned}"
-                        )
-                        print("DEBUG: Created aligned environment")
-
-                print("DEBUG: needs_math_mode =", needs_math_mode)
-                print("DEBUG: equation_formatted:")
-                print(repr(equation_formatted))
-
-                # 数式テキストを生成
-                if needs_math_mode:
-                    math_text = f"${equation_formatted}$"
-                else:
-                    math_text = equation_formatted
-
-                print("DEBUG: Final math_text:")
-                print(repr(math_text))
-
-                # matplotlibに渡す前に、Pythonの改行(\n)を除去
-                math_text_clean = math_text.replace("\n", " ")
-                print("DEBUG: Cleaned math_text:")
-                print(repr(math_text_clean))
-
-                # テキストをデータ座標で配置（中央配置だとより密着）
-                text_obj = save_ax.text(
-                    0.5,
-                    0.5,
-                    math_text_clean,
-                    fontsize=fontsize,
-                    ha="center",
-                    va="center",
-                    transform=save_ax.transAxes,
-                )
-
-                save_ax.axis("off")
-
-                # 軸の範囲を設定
-                save_ax.set_xlim(0, 1)
-                save_ax.set_ylim(0, 1)
-
-                # マージンを完全にゼロに
-                save_fig.subplots_adjust(
-                    left=0, right=1, top=1, bottom=0, wspace=0, hspace=0
-                )
-
-                # 保存（pad_inchesを極限まで小さく）
-                save_fig.savefig(
-                    filename,
-                    format=format,
-                    bbox_inches="tight",
-                    pad_inches=0,  # 完全にゼロ
-                    transparent=(bgcolor == "transparent"),
-                    dpi=300 if format == "png" else None,
-                )
-
-                # 保存完了（通知なし）
-
-            except Exception as e:
-                messagebox.showerror("保存エラー", f"保存に失敗しました:\n{str(e)}")
+    def get_preview_options(self):
+        """プレビュー用のレンダリングオプション（画面解像度の PNG）"""
+        options = self.get_render_options()
+        options.save_format = "png"
+        if self.preview_mode == "raster":
+            # 背景は Canvas で合成するので、背景色を変えても同じ画像を使える
+            options.dpi = round(self.root.winfo_fpixels("1i"))
+            options.bgcolor = "transparent"
+        else:
+            options.dpi = PREVIEW_DPI
+        return options
+
+    def render_preview(self, equation, options, stage="preview"):
+        """プレビュー用の PNG を描画し、(PNG, RenderArtifact または None) を返す
+
+        stage は計測に使う段階名（先読みでは speculative）。
+        """
+        backend = resolve_backend(options)
+        with stats.stage(stage, backend=backend):
+            if backend == "dvi":
+                artifact = compile_artifact(equation, options, preview=True)
+                return artifact.export(options), artifact
+            return self.render_bytes(equation, options), None
+
+    def render_bytes(self, equation, options):
+        """数式を描画してバイト列を返す（キャッシュ → TeX ワーカーまたはアプリ内の順に使用）"""
+        render = self.tex_worker.render if self.tex_worker else render_to_bytes
+        return render_cached(equation, options, self.render_cache, render)
+
+    def create_render_cache(self):
+        """レンダリングキャッシュを作成（作成できない場合はキャッシュなし）"""
+        try:
+            return RenderCache(self.cache_dir, self.cache_max_mb * 1024**2)
+        except OSError as e:
+            print(f"キャッシュフォルダを作成できませんでした: {e}")
+            return None
 
     def save_settings(self):
         """設定をファイルに保存"""
@@ -568,6 +1234,33 @@ class LaTeXEditor:
                 "displaystyle": self.displaystyle_var.get(),
                 "use_equation_filename": self.use_equation_filename_var.get(),
                 "save_format": self.save_format_var.get(),
+                "live_preview": self.live_preview_var.get(),
+                "backend": self.backend_var.get(),
+                "show_stats": self.show_stats_var.get(),
+                "export_targets": [
+                    t.strip()
+                    for t in self.export_targets_var.get().split(",")
+                    if t.strip()
+                ],
+                "export_name_template": self.export_name_template,
+                "cache_dir": self.cache_dir,
+                "cache_max_mb": self.cache_max_mb,
+                "use_tex_worker": self.use_tex_worker,
+                "preamble": self.preamble,
+                "precompiled_preamble": self.precompiled_preamble,
+                "fast_start": self.fast_start,
+                "preview_mode": self.preview_mode,
+                "lint": self.lint_mode,
+                "speculative_budget_mb": self.speculative_budget_mb,
+                "svg_mode": self.svg_mode,
+                "svg_precision": self.svg_precision,
+                "tex_timeout": self.process_limits.timeout,
+                "tex_memory_mb": self.process_limits.memory_mb,
+                "tex_cpu_seconds": self.process_limits.cpu_seconds,
+                "show_history": self.show_history_var.get(),
+                "history_file": self.history_file,
+                "history_max_entries": self.history_max_entries,
+                "stats_log_file": self.stats_log_file,
             }
             with open(self.config_file, "w", encoding="utf-8") as f:
                 json.dump(settings, f, indent=2)
@@ -587,19 +1280,100 @@ class LaTeXEditor:
                         settings.get("use_equation_filename", False)
                     )
                     self.save_format_var.set(settings.get("save_format", "svg"))
+                    self.live_preview_var.set(settings.get("live_preview", False))
+                    self.backend_var.set(settings.get("backend", "dvi"))
+                    self.show_stats_var.set(settings.get("show_stats", False))
+                    self.show_history_var.set(settings.get("show_history", True))
+                    self.history_file = settings.get("history_file", self.history_file)
+                    self.history_max_entries = settings.get(
+                        "history_max_entries", self.history_max_entries
+                    )
+                    self.export_targets_var.set(
+                        ",".join(
+                            settings.get("export_targets", DEFAULT_EXPORT_TARGETS)
+                        )
+                    )
+                    self.export_name_template = settings.get(
+                        "export_name_template", self.export_name_template
+                    )
+                    self.cache_dir = settings.get("cache_dir", self.cache_dir)
+                    self.cache_max_mb = settings.get("cache_max_mb", self.cache_max_mb)
+                    self.use_tex_worker = settings.get(
+                        "use_tex_worker", self.use_tex_worker
+                    )
+                    self.preamble = settings.get("preamble", self.preamble)
+                    self.precompiled_preamble = settings.get(
+                        "precompiled_preamble", self.precompiled_preamble
+                    )
+                    self.fast_start = settings.get("fast_start", self.fast_start)
+                    self.speculative_budget_mb = settings.get(
+                        "speculative_budget_mb", self.speculative_budget_mb
+                    )
+                    self.process_limits = ProcessLimits.from_settings(settings)
+                    if settings.get("svg_mode") in SVG_MODES:
+                        self.svg_mode = settings["svg_mode"]
+                    self.svg_precision = settings.get(
+                        "svg_precision", self.svg_precision
+                    )
+                    if settings.get("lint") in LINT_MODES:
+                        self.lint_mode = settings["lint"]
+                    if settings.get("preview_mode") in PREVIEW_MODES:
+                        self.preview_mode = settings["preview_mode"]
+                    self.stats_log_file = settings.get(
+                        "stats_log_file", self.stats_log_file
+                    )
         except Exception as e:
             print(f"設定の読み込みに失敗しました: {e}")
 
     def on_closing(self):
         """ウィンドウを閉じる際の処理"""
         self.save_settings()
+        self.shutdown()
+
+    def shutdown(self):
+        """ワーカーを止めてウィンドウを閉じる（設定は保存しない）"""
+        self.preview_worker.close()
+        if self.speculative is not None:
+            self.speculative.close()
+        if self.tex_worker:
+            self.tex_worker.close()
+        if self.history_panel is not None:
+            self.history_panel.close()
         self.root.destroy()
 
 
-def main():
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="LaTeX 数式エディタ")
+    parser.add_argument(
+        "--fast-start",
+        action=argparse.BooleanOptionalAction,
+        default=None,
+        help="matplotlib をバックグラウンドで読み込んでウィンドウを先に表示（既定: 設定ファイルの fast_start）",
+    )
+    parser.add_argument(
+        "--measure-startup",
+        action="store_true",
+        help="最初のプレビューまでの起動時間 (ms) を JSON で出力して終了",
+    )
+    args = parser.parse_args(argv)
+
     root = tk.Tk()
-    app = LaTeXEditor(root)
+    results = []
+
+    def report(times):
+        print(json.dumps(times), flush=True)
+        results.append(times["result"])
+        # --no-fast-start では __init__ の中から呼ばれるので、mainloop で閉じる
+        root.after_idle(lambda: app.shutdown())
+
+    app = LaTeXEditor(
+        root,
+        fast_start=args.fast_start,
+        on_startup_complete=report if args.measure_startup else None,
+    )
     root.mainloop()
+    if results and results[0] != "ok":
+        sys.exit(1)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,652 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+LaTeX 数式の簡易構文チェック（TeX を実行しない）
+波括弧・\\left/\\right・環境の対応と、プリアンブルのパッケージで定義されていない
+コマンドを調べ、行・列の位置付きで報告する。TeX のコンパイルより前に実行し、
+明らかに壊れた入力を数ミリ秒で弾く。
+
+    error: TeX でも必ずエラーになるもの（描画しない）
+    warning: エラーになる可能性があるもの（未知のコマンドなど、strict のときだけ描画しない）
+"""
+
+import functools
+import re
+from dataclasses import dataclass
+
+from latex_render import RenderError
+
+# 構文チェックのモード
+#   on: error があれば描画しない
+#   strict: warning があっても描画しない
+#   off: チェックしない
+LINT_MODES = ["on", "strict", "off"]
+
+# LaTeX 本体（と matplotlib が読み込む type1cm など）で使える数式用のコマンド
+LATEX_COMMANDS = set(
+    """
+    alpha beta gamma delta epsilon varepsilon zeta eta theta vartheta iota kappa
+    lambda mu nu xi pi varpi rho varrho sigma varsigma tau upsilon phi varphi chi
+    psi omega Gamma Delta Theta Lambda Xi Pi Sigma Upsilon Phi Psi Omega
+    pm mp times div cdot ast star circ bullet cap cup uplus sqcap sqcup vee wedge
+    setminus wr diamond bigtriangleup bigtriangledown triangleleft triangleright
+    oplus ominus otimes oslash odot bigcirc dagger ddagger amalg
+    le leq ge geq equiv models prec preceq succ succeq sim perp simeq mid ll gg
+    asymp parallel subset subseteq supset supseteq approx bowtie cong sqsubseteq
+    sqsupseteq neq ne smile frown in ni notin propto vdash dashv doteq
+    leftarrow rightarrow gets to uparrow downarrow updownarrow Leftarrow Rightarrow
+    Uparrow Downarrow Updownarrow leftrightarrow Leftrightarrow longleftarrow
+    longrightarrow longleftrightarrow Longleftarrow Longrightarrow
+    Longleftrightarrow mapsto longmapsto hookleftarrow hookrightarrow
+    leftharpoonup leftharpoondown rightharpoonup rightharpoondown
+    rightleftharpoons nearrow searrow swarrow nwarrow iff implies
+    sum prod coprod int oint bigcap bigcup bigsqcup bigvee bigwedge bigodot
+    bigotimes bigoplus biguplus
+    arccos arcsin arctan arg cos cosh cot coth csc deg det dim exp gcd hom inf
+    ker lg lim liminf limsup ln log max min Pr sec sin sinh sup tan tanh
+    bmod pmod
+    hat check breve acute grave tilde bar vec dot ddot widehat widetilde
+    overline underline overbrace underbrace overrightarrow overleftarrow
+    frac sqrt over atop choose stackrel
+    left right middle big Big bigg Bigg bigl bigr Bigl Bigr biggl biggr Biggl
+    Biggr bigm Bigm biggm Biggm
+    langle rangle lfloor rfloor lceil rceil vert Vert backslash lbrace rbrace
+    lbrack rbrack
+    ldots cdots vdots ddots dots infty partial nabla forall exists emptyset
+    neg lnot aleph hbar imath jmath ell wp Re Im prime surd top bot angle
+    triangle clubsuit diamondsuit heartsuit spadesuit flat natural sharp
+    quad qquad hspace vspace hfill enspace thinspace negthinspace hskip kern
+    mskip mkern
+    mathrm mathbf mathit mathsf mathtt mathcal mathnormal rm bf it sf tt cal
+    textrm textbf textit textsf texttt textnormal mbox hbox vbox
+    displaystyle textstyle scriptstyle scriptscriptstyle limits nolimits
+    mathop mathbin mathrel mathord mathopen mathclose mathpunct mathinner
+    phantom vphantom hphantom smash not relax csname endcsname
+    begin end label nonumber
+    newcommand renewcommand providecommand def let
+    tiny scriptsize footnotesize small normalsize large Large LARGE huge Huge
+    """.split()
+)
+
+# パッケージごとに追加されるコマンド
+PACKAGE_COMMANDS = {
+    "amsmath": set(
+        """
+        dfrac tfrac cfrac binom dbinom tbinom genfrac text operatorname
+        DeclareMathOperator boldsymbol pmb overset underset substack sideset
+        xleftarrow xrightarrow overleftrightarrow underleftarrow underrightarrow
+        underleftrightarrow tag notag lvert rvert lVert rVert dotsc dotsb dotsm
+        dotsi dotso iint iiint iiiint idotsint intertext shortintertext
+        boxed mod pod varGamma varDelta varTheta varLambda varXi varPi varSigma
+        varUpsilon varPhi varPsi varOmega injlim projlim varinjlim varprojlim
+        varliminf varlimsup impliedby colon
+        """.split()
+    ),
+    "amsfonts": set("mathbb mathfrak".split()),
+    "amssymb": set(
+        """
+        mathbb mathfrak
+        ulcorner urcorner llcorner lrcorner digamma varkappa beth gimel daleth
+        backprime varnothing vartriangle blacktriangle triangledown
+        blacktriangledown square blacksquare lozenge blacklozenge circledS
+        bigstar sphericalangle measuredangle nexists complement mho eth Finv
+        diagup Game diagdown hslash Bbbk dotplus smallsetminus Cap Cup barwedge
+        veebar doublebarwedge boxminus boxtimes boxdot boxplus divideontimes
+        ltimes rtimes leftthreetimes rightthreetimes curlywedge curlyvee
+        circleddash circledast circledcirc centerdot intercal leqq leqslant
+        eqslantless lesssim lessapprox approxeq lessdot lll lessgtr lesseqgtr
+        lesseqqgtr doteqdot risingdotseq fallingdotseq backsim backsimeq
+        subseteqq Subset sqsubset preccurlyeq curlyeqprec precsim precapprox
+        vartriangleleft trianglelefteq vDash Vvdash smallsmile smallfrown
+        bumpeq Bumpeq geqq geqslant eqslantgtr gtrsim gtrapprox gtrdot ggg
+        gtrless gtreqless gtreqqless eqcirc circeq triangleq thicksim
+        thickapprox supseteqq Supset sqsupset succcurlyeq curlyeqsucc succsim
+        succapprox vartriangleright trianglerighteq Vdash shortmid
+        shortparallel between pitchfork varpropto blacktriangleleft therefore
+        backepsilon blacktriangleright because nless nleq nleqslant nleqq
+        lneq lneqq lvertneqq lnsim lnapprox nprec npreceq precneqq precnsim
+        precnapprox nsim nshortmid nmid nvdash nvDash ntriangleleft
+        ntrianglelefteq nsubseteq subsetneq varsubsetneq subsetneqq
+        varsubsetneqq ngtr ngeq ngeqslant ngeqq gneq gneqq gvertneqq gnsim
+        gnapprox nsucc nsucceq succneqq succnsim succnapprox ncong
+        nshortparallel nparallel nVDash ntriangleright ntrianglerighteq
+        nsupseteq nsupseteqq supsetneq varsupsetneq supsetneqq varsupsetneqq
+        dashrightarrow dashleftarrow leftleftarrows leftrightarrows Lleftarrow
+        twoheadleftarrow leftarrowtail looparrowleft leftrightharpoons
+        curvearrowleft circlearrowleft Lsh upuparrows upharpoonleft
+        downharpoonleft multimap leftrightsquigarrow rightrightarrows
+        rightleftarrows twoheadrightarrow rightarrowtail looparrowright
+        curvearrowright circlearrowright Rsh downdownarrows upharpoonright
+        downharpoonright rightsquigarrow nleftarrow nrightarrow nLeftarrow
+        nRightarrow nleftrightarrow nLeftrightarrow leadsto
+        checkmark maltese yen circledR
+        """.split()
+    ),
+    "bm": set("bm hm boldsymbol".split()),
+    "mathtools": set(
+        """
+        coloneqq eqqcolon coloneq Coloneqq vcentcolon mathclap mathllap
+        mathrlap prescript DeclarePairedDelimiter xmapsto xhookrightarrow
+        xhookleftarrow xLeftarrow xRightarrow xLeftrightarrow overbracket
+        underbracket adjustlimits smashoperator
+        """.split()
+    ),
+    "physics": set(
+        """
+        quantity qty pqty bqty Bqty vqty abs norm eval evaluated order
+        comm commutator acomm anticommutator pb poissonbracket vectorbold vb
+        vectorarrow va vectorunit vu dotproduct vdot crossproduct cross cp
+        gradient grad divergence divisionsymbol curl laplacian Tr trace Res
+        principalvalue pv PV real imaginary Real Imaginary
+        differential dd derivative dv partialderivative pderivative pdv
+        variation var functionalderivative fdv ket bra braket ip outerproduct
+        dyad op ketbra expectationvalue expval ev matrixelement matrixel mel
+        identitymatrix imat xmatrix xmat zeromatrix zmat paulimatrix pmat
+        diagonalmatrix dmat antidiagonalmatrix admat
+        sine sin cosine cos tangent tan secant sec cosecant csc cotangent cot
+        arcsine asin arccosine acos arctangent atan arcsecant asec
+        arccosecant acsc arccotangent acot hypsine sinh hypcosine cosh
+        hyptangent tanh hypsecant sech hypcosecant csch hypcotangent coth
+        arcsinh asinh arccosh acosh arctanh atanh exponential exp logarithm
+        log naturallogarithm ln determinant det Probability Pr rank erf
+        """.split()
+    ),
+    "xcolor": set("color textcolor colorbox fcolorbox definecolor".split()),
+    "color": set("color textcolor colorbox fcolorbox definecolor".split()),
+    "cancel": set("cancel bcancel xcancel cancelto".split()),
+    "mathrsfs": set("mathscr".split()),
+    "upgreek": set(
+        """
+        upalpha upbeta upgamma updelta upepsilon upvarepsilon upzeta upeta
+        uptheta upvartheta upiota upkappa uplambda upmu upnu upxi uppi upvarpi
+        uprho upvarrho upsigma upvarsigma uptau upupsilon upphi upvarphi upchi
+        uppsi upomega Upgamma Updelta Uptheta Uplambda Upxi Uppi Upsigma
+        Upupsilon Upphi Uppsi Upomega
+        """.split()
+    ),
+    "siunitx": set("SI si num ang unit qty".split()),
+    "braket": set("bra ket braket Bra Ket Braket set Set".split()),
+    "esint": set("oiint oiiint ointctrclockwise ointclockwise varoint".split()),
+    "bbm": set("mathbbm".split()),
+    "dsfont": set("mathds".split()),
+    "textcomp": set(),
+}
+
+# LaTeX 本体の環境とパッケージごとに追加される環境
+LATEX_ENVIRONMENTS = {"array", "eqnarray", "eqnarray*", "equation", "tabular"}
+PACKAGE_ENVIRONMENTS = {
+    "amsmath": {
+        "align",
+        "align*",
+        "aligned",
+        "alignat",
+        "alignat*",
+        "alignedat",
+        "equation*",
+        "flalign",
+        "flalign*",
+        "gather",
+        "gather*",
+        "gathered",
+        "multline",
+        "multline*",
+        "split",
+        "cases",
+        "matrix",
+        "pmatrix",
+        "bmatrix",
+        "Bmatrix",
+        "vmatrix",
+        "Vmatrix",
+        "smallmatrix",
+        "subarray",
+    },
+    "mathtools": {
+        "dcases",
+        "dcases*",
+        "rcases",
+        "matrix*",
+        "pmatrix*",
+        "bmatrix*",
+        "Bmatrix*",
+        "vmatrix*",
+        "Vmatrix*",
+        "multlined",
+    },
+}
+# & で列を区切れる環境
+ALIGNMENT_ENVIRONMENTS = {
+    "array",
+    "tabular",
+    "eqnarray",
+    "eqnarray*",
+    "align",
+    "align*",
+    "aligned",
+    "alignat",
+    "alignat*",
+    "alignedat",
+    "flalign",
+    "flalign*",
+    "split",
+    "cases",
+    "matrix",
+    "pmatrix",
+    "bmatrix",
+    "Bmatrix",
+    "vmatrix",
+    "Vmatrix",
+    "smallmatrix",
+    "dcases",
+    "dcases*",
+    "rcases",
+    "matrix*",
+    "pmatrix*",
+    "bmatrix*",
+    "Bmatrix*",
+    "vmatrix*",
+    "Vmatrix*",
+}
+# & で列を区切れないことが分かっている環境（それ以外の環境の中の & は警告にとどめる）
+NON_ALIGNMENT_ENVIRONMENTS = (
+    LATEX_ENVIRONMENTS.union(*PACKAGE_ENVIRONMENTS.values()) - ALIGNMENT_ENVIRONMENTS
+)
+# 数式モードの中には書けない（数式全体を囲む）環境
+DISPLAY_ENVIRONMENTS = {
+    "align",
+    "align*",
+    "alignat",
+    "alignat*",
+    "eqnarray",
+    "eqnarray*",
+    "equation",
+    "equation*",
+    "flalign",
+    "flalign*",
+    "gather",
+    "gather*",
+    "multline",
+    "multline*",
+}
+
+# \left / \right / \middle の後に書ける区切り記号
+DELIMITER_CHARS = set("()[]<>|/.")
+DELIMITER_COMMANDS = {
+    "{",
+    "}",
+    "|",
+    "langle",
+    "rangle",
+    "lfloor",
+    "rfloor",
+    "lceil",
+    "rceil",
+    "vert",
+    "Vert",
+    "lvert",
+    "rvert",
+    "lVert",
+    "rVert",
+    "backslash",
+    "lbrace",
+    "rbrace",
+    "lbrack",
+    "rbrack",
+    "uparrow",
+    "downarrow",
+    "updownarrow",
+    "Uparrow",
+    "Downarrow",
+    "Updownarrow",
+    "ulcorner",
+    "urcorner",
+    "llcorner",
+    "lrcorner",
+    "lgroup",
+    "rgroup",
+    "lmoustache",
+    "rmoustache",
+    "arrowvert",
+    "Arrowvert",
+    "bracevert",
+    "lparen",
+    "rparen",
+    "llbracket",
+    "rrbracket",
+}
+
+# 新しいコマンドを定義するコマンド（直後のコマンド名を既知として扱う）
+DEFINING_COMMANDS = {
+    "newcommand",
+    "renewcommand",
+    "providecommand",
+    "DeclareMathOperator",
+    "DeclarePairedDelimiter",
+    "def",
+    "let",
+}
+
+_USEPACKAGE = re.compile(
+    r"\\(?:usepackage|RequirePackage)\s*(?:\[[^\]]*\])?\s*\{([^}]*)\}"
+)
+_DEFINITION = re.compile(
+    r"\\(?:" + "|".join(sorted(DEFINING_COMMANDS)) + r")\*?\s*\{?\s*\\([A-Za-z]+)"
+)
+_NEW_ENVIRONMENT = re.compile(r"\\(?:re)?newenvironment\s*\{([^}]*)\}")
+
+
+class LintError(RenderError):
+    """構文チェックで描画しないと判断した場合の例外（issues に問題のリスト）"""
+
+    def __init__(self, issues):
+        self.issues = issues
+        super().__init__("構文エラー:\n" + "\n".join(str(i) for i in issues))
+
+
+@dataclass
+class LintIssue:
+    """構文チェックで見つかった問題（行・列は 1 始まり）"""
+
+    line: int
+    column: int
+    message: str
+    severity: str = "error"
+
+    def __str__(self):
+        label = "エラー" if self.severity == "error" else "警告"
+        return f"{self.line}:{self.column}: {label}: {self.message}"
+
+
+def preamble_vocabulary(preamble):
+    """プリアンブルから (使えるコマンド, 使える環境) を求める
+
+    内容のわからないパッケージを読み込んでいる場合、コマンドは None（チェックしない）。
+    """
+    commands = set(LATEX_COMMANDS)
+    environments = set(LATEX_ENVIRONMENTS)
+    known = True
+    for match in _USEPACKAGE.finditer(preamble):
+        for package in match.group(1).split(","):
+            package = package.strip()
+            if not package:
+                continue
+            if package not in PACKAGE_COMMANDS:
+                known = False
+                continue
+            commands |= PACKAGE_COMMANDS[package]
+            environments |= PACKAGE_ENVIRONMENTS.get(package, set())
+    commands |= set(_DEFINITION.findall(preamble))
+    environments |= {name.strip() for name in _NEW_ENVIRONMENT.findall(preamble)}
+    return (commands if known else None), environments
+
+
+class _Scanner:
+    """数式を 1 文字ずつ読み、行・列を数える"""
+
+    def __init__(self, text):
+        self.text = text
+        self.pos = 0
+        self.line = 1
+        self.column = 1
+
+    def peek(self, offset=0):
+        index = self.pos + offset
+        return self.text[index] if index < len(self.text) else ""
+
+    def advance(self, count=1):
+        for _ in range(count):
+            if self.pos >= len(self.text):
+                return
+            if self.text[self.pos] == "\n":
+                self.line += 1
+                self.column = 1
+            else:
+                self.column += 1
+            self.pos += 1
+
+    def skip_spaces(self):
+        while self.peek() and self.peek().isspace():
+            self.advance()
+
+    def read_command(self):
+        """\\ の直後から、コマンド名（英字の列または 1 文字）を読む"""
+        self.advance()  # "\"
+        if not self.peek():
+            return ""
+        if not self.peek().isalpha():
+            name = self.peek()
+            self.advance()
+            return name
+        start = self.pos
+        while self.peek().isalpha():
+            self.advance()
+        return self.text[start : self.pos]
+
+    def read_group(self):
+        """{...} の中身を読む（閉じていなければ None）"""
+        self.skip_spaces()
+        if self.peek() != "{":
+            return None
+        end = self.text.find("}", self.pos)
+        if end < 0:
+            return None
+        name = self.text[self.pos + 1 : end]
+        self.advance(end + 1 - self.pos)
+        return name.strip()
+
+
+def lint(equation, preamble=""):
+    """数式を調べて LintIssue のリストを返す（位置は入力した数式の行・列）"""
+    return list(_lint(equation, preamble))
+
+
+@functools.lru_cache(maxsize=256)
+def _lint(equation, preamble):
+    # 1 回の描画で何度も呼ばれる（キャッシュキーの計算など）ので結果を覚えておく
+    from latex_render import MATH_ENVIRONMENTS
+
+    commands, environments = preamble_vocabulary(preamble)
+    # プリアンブルと数式の中で定義したコマンド
+    defined = set(_DEFINITION.findall(preamble)) | set(_DEFINITION.findall(equation))
+    if commands is not None:
+        commands |= defined
+    environments |= {name.strip() for name in _NEW_ENVIRONMENT.findall(equation)}
+
+    issues = []
+
+    def report(line, column, message, severity="error"):
+        issues.append(LintIssue(line, column, message, severity))
+
+    # 改行があり \begin で始まらない数式は aligned で囲まれる（latex_render.build_math_text）
+    stripped = equation.strip()
+    lines = [line for line in stripped.split("\n") if line.strip()]
+    wrapped_in_aligned = not stripped.startswith(r"\begin") and len(lines) > 1
+
+    # 開いている {、\left、\begin を 1 つのスタックで管理（交差した入れ子も検出できる）
+    # 要素は (種類, 名前, 行, 列)
+    stack = []
+    scanner = _Scanner(equation)
+    leading = len(equation) - len(equation.lstrip())
+
+    def describe(item):
+        kind, name, line, column = item
+        if kind == "{":
+            return f"{line}:{column} の {{"
+        if kind == "left":
+            return f"{line}:{column} の \\left"
+        return f"{line}:{column} の \\begin{{{name}}}"
+
+    def check_delimiter(command):
+        scanner.skip_spaces()
+        line, column = scanner.line, scanner.column
+        if scanner.peek() == "\\":
+            delimiter = scanner.read_command()
+            if delimiter in DELIMITER_COMMANDS:
+                return
+            if commands is None or delimiter in defined:
+                return  # 内容のわからないパッケージやプリアンブルで定義した区切り記号
+            report(
+                line,
+                column,
+                f"\\{delimiter} を \\{command} の区切り記号として使えるか確認できません",
+                "warning",
+            )
+            return
+        elif scanner.peek() in DELIMITER_CHARS and scanner.peek():
+            scanner.advance()
+            return
+        report(
+            line,
+            column,
+            f"\\{command} の後に区切り記号（( [ \\{{ | . など）がありません",
+        )
+
+    while scanner.peek():
+        char = scanner.peek()
+        start = scanner.pos
+        line, column = scanner.line, scanner.column
+
+        if char == "%":
+            # 改行は空白に置き換えられるので、以降がすべてコメントになる
+            report(line, column, "% 以降がコメントになります（記号は \\% と書きます）")
+            scanner.advance()
+        elif char == "{":
+            stack.append(("{", None, line, column))
+            scanner.advance()
+        elif char == "}":
+            scanner.advance()
+            if not stack:
+                report(line, column, "対応する { がない } があります")
+            elif stack[-1][0] == "{":
+                stack.pop()
+            else:
+                report(line, column, f"{describe(stack[-1])} が閉じる前に }} があります")
+                # { が開いていればそこまで戻して続ける
+                while stack and stack[-1][0] != "{":
+                    stack.pop()
+                if stack:
+                    stack.pop()
+        elif char == "&":
+            scanner.advance()
+            names = [name for kind, name, _, _ in stack if kind == "env"]
+            # CD やプリアンブルで定義した環境は & を使えるか分からない
+            unknown = [n for n in names if n not in NON_ALIGNMENT_ENVIRONMENTS]
+            if wrapped_in_aligned or any(n in ALIGNMENT_ENVIRONMENTS for n in names):
+                pass
+            elif unknown:
+                report(
+                    line,
+                    column,
+                    f"環境 {unknown[-1]} の中で & を使えるか確認できません",
+                    "warning",
+                )
+            else:
+                report(
+                    line,
+                    column,
+                    "& は align・aligned・matrix などの環境の中でだけ使えます",
+                )
+        elif char == "\\":
+            command = scanner.read_command()
+            if command == "":
+                report(line, column, "\\ の後にコマンド名がありません")
+            elif command == "begin":
+                name = scanner.read_group()
+                if name is None:
+                    report(line, column, "\\begin の後に {環境名} がありません")
+                    continue
+                if name not in environments:
+                    report(
+                        line,
+                        column,
+                        f"環境 {name} はプリアンブルのパッケージで定義されていません",
+                        "warning",
+                    )
+                if name in DISPLAY_ENVIRONMENTS:
+                    at_start = start == leading and not stack
+                    if name not in MATH_ENVIRONMENTS or not at_start:
+                        report(
+                            line,
+                            column,
+                            f"{name} 環境は数式の先頭に 1 つだけ書けます"
+                            "（途中に書く場合は aligned・gathered などを使います）",
+                        )
+                stack.append(("env", name, line, column))
+            elif command == "end":
+                name = scanner.read_group()
+                if name is None:
+                    report(line, column, "\\end の後に {環境名} がありません")
+                    continue
+                if not stack:
+                    report(line, column, f"\\end{{{name}}} に対応する \\begin がありません")
+                elif stack[-1][0] == "env" and stack[-1][1] == name:
+                    stack.pop()
+                else:
+                    report(
+                        line,
+                        column,
+                        f"{describe(stack[-1])} が閉じる前に \\end{{{name}}} があります",
+                    )
+                    # 同じ名前の環境まで戻して続ける
+                    names = [item[1] for item in stack if item[0] == "env"]
+                    if name in names:
+                        while stack and not (
+                            stack[-1][0] == "env" and stack[-1][1] == name
+                        ):
+                            stack.pop()
+                        stack.pop()
+            elif command == "left":
+                check_delimiter(command)
+                stack.append(("left", None, line, column))
+            elif command == "right":
+                if stack and stack[-1][0] == "left":
+                    stack.pop()
+                elif any(kind == "left" for kind, _, _, _ in stack):
+                    report(
+                        line,
+                        column,
+                        f"{describe(stack[-1])} が閉じる前に \\right があります",
+                    )
+                else:
+                    report(line, column, "対応する \\left がない \\right があります")
+                check_delimiter(command)
+            elif command == "middle":
+                if not (stack and stack[-1][0] == "left"):
+                    report(line, column, "\\middle は \\left と \\right の間に書きます")
+                check_delimiter(command)
+            elif (
+                commands is not None
+                and command.isalpha()
+                and command not in commands
+            ):
+                report(
+                    line,
+                    column,
+                    f"\\{command} はプリアンブルのパッケージで定義されていません",
+                    "warning",
+                )
+        else:
+            scanner.advance()
+
+    for item in stack:
+        kind, name, line, column = item
+        if kind == "{":
+            report(line, column, "{ が閉じていません")
+        elif kind == "left":
+            report(line, column, "\\left に対応する \\right がありません")
+        else:
+            report(line, column, f"\\begin{{{name}}} に対応する \\end{{{name}}} がありません")
+
+    issues.sort(key=lambda i: (i.line, i.column))
+    return tuple(issues)
+
+
+def check(equation, preamble="", mode="on"):
+    """描画してよいか調べ、だめなら LintError（warning のリストを返す）"""
+    if mode == "off":
+        return []
+    issues = lint(equation, preamble)
+    blocking = [i for i in issues if i.severity == "error" or mode == "strict"]
+    if blocking:
+        raise LintError(blocking)
+    return issues
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+複数のマシンで分担する一括変換（latex_batch.py --queue）のキューの管理 CLI
+進み具合とワーカーの状態を表示し、途中までの結果をまとめた結果マニフェストを
+書き出す。
+
+使い方:
+    python latex_queue.py status /shared/queue
+    python latex_queue.py report /shared/queue -o partial.jsonl
+"""
+
+import argparse
+import json
+import sys
+
+from work_queue import QueueError, WorkQueue
+
+
+def print_status(status):
+    print(f"キュー: {status['directory']}")
+    done, chunks = status["done"], status["chunks"]
+    rate = f"{done / chunks:.1%}" if chunks else "-"
+    expired = sum(1 for lease in status["leased"].values() if lease["expired"])
+    print(
+        f"チャンク: {chunks} 個（{status['items']} 件）  完了 {done} ({rate})  "
+        f"処理中 {len(status['leased'])}（期限切れ {expired}）  "
+        f"未着手 {status['pending']}"
+    )
+    for name, worker in sorted(status["workers"].items()):
+        state = "終了" if "finished" in worker else f"{worker['age']:.0f} 秒前に応答"
+        print(
+            f"  {name:<32} {worker['items']:>8} 件 {worker['chunks']:>6} チャンク  "
+            f"引き取り {worker['reclaimed']:>3}  {state}"
+        )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="分担して描画するキューの管理")
+    commands = parser.add_subparsers(dest="command", required=True)
+    status_parser = commands.add_parser("status", help="進み具合とワーカーを表示")
+    status_parser.add_argument("queue", help="キューのフォルダ")
+    status_parser.add_argument("--json", action="store_true", help="JSON で出力")
+    report_parser = commands.add_parser(
+        "report", help="完了した分の結果を 1 つの結果マニフェストにまとめる"
+    )
+    report_parser.add_argument("queue", help="キューのフォルダ")
+    report_parser.add_argument(
+        "-o",
+        "--output",
+        default=None,
+        help="書き出し先（既定: キューの作成時に指定した結果マニフェスト）",
+    )
+    args = parser.parse_args(argv)
+
+    try:
+        queue = WorkQueue(args.queue)
+        if args.command == "status":
+            status = queue.status()
+            if args.json:
+                print(json.dumps(status, ensure_ascii=False, indent=2))
+            else:
+                print_status(status)
+            return 0
+        output = args.output or queue.spec["results"]
+        summary = queue.write_report(output)
+    except QueueError as e:
+        print(f"エラー: {e}")
+        return 1
+    print(
+        f"{summary['succeeded']} 件成功, {summary['failed']} 件失敗"
+        f"（{queue.spec['items']} 件中、結果: {output}）"
+    )
+    for worker, count in sorted(summary["workers"].items()):
+        print(f"  {worker:<32} {count:>8} 件")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,459 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+LaTeX 数式レンダリングエンジン（GUI 非依存）
+latex_editor.py と一括変換 CLI (latex_batch.py) の共通処理
+matplotlib は読み込みに時間がかかるため、使う関数の中で import する
+"""
+
+import io
+import json
+import os
+import re
+import tempfile
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, asdict, replace
+from pathlib import Path
+
+import tex_format
+from render_cache import cache_key
+from render_stats import stats
+
+# LaTeX のプリアンブル（amsmath / amssymb / bm を使用）
+DEFAULT_PREAMBLE = r"\usepackage{amsmath}\usepackage{amssymb}\usepackage{bm}"
+
+# 数式モード($...$)が不要な環境
+MATH_ENVIRONMENTS = [
+    "align",
+    "align*",
+    "equation",
+    "equation*",
+    "gather",
+    "gather*",
+    "multline",
+    "multline*",
+]
+
+SAVE_FORMATS = ["svg", "png", "pdf"]
+
+# サンプル数式（エディタのボタンとベンチマークで使用）
+SAMPLE_EQUATIONS = [
+    ("アインシュタインの質量エネルギー等価式", r"E = mc^2"),
+    ("ガウス積分", r"\int_0^\infty e^{-x^2} dx = \frac{\sqrt{\pi}}{2}"),
+    ("バーゼル問題", r"\sum_{n=1}^{\infty} \frac{1}{n^2} = \frac{\pi^2}{6}"),
+    (
+        "マクスウェル方程式",
+        r"\nabla \times \bm{E} = -\frac{\partial \bm{B}}{\partial t}",
+    ),
+    ("二次方程式の解の公式", r"x = \frac{-b \pm \sqrt{b^2 - 4ac}}{2a}"),
+    ("オイラーの等式", r"e^{i\pi} + 1 = 0"),
+]
+
+# 描画方式
+#   dvi: TeX の出力 (DVI) を dvisvgm / dvipng / dvipdfmx で直接変換（tex_engine.py）
+#   matplotlib: matplotlib の Figure に描画して savefig
+# dvi に必要なツールがない場合は matplotlib にフォールバックする
+BACKENDS = ["dvi", "matplotlib"]
+
+# 一括エクスポート: 書き出し先の指定（png@2x は 2 倍解像度の PNG）
+DEFAULT_EXPORT_TARGETS = ["svg", "pdf", "png@1x", "png@2x", "png@3x"]
+# png@1x の解像度（CSS の 1px = 1/96 インチ）
+PNG_BASE_DPI = 96
+# 出力ファイル名のテンプレート
+#   {name}: 数式の名前, {suffix}: PNG の倍率 (@2x など), {format}: 拡張子, {dpi}: 解像度
+DEFAULT_NAME_TEMPLATE = "{name}{suffix}.{format}"
+
+# configure_matplotlib で設定（dvi 方式でもプリコンパイル済みのプリアンブルを使うか）
+_precompile = True
+# configure_matplotlib で設定（構文チェックのモード、latex_lint.LINT_MODES）
+_lint = "on"
+
+# 最近コンパイルした RenderArtifact の数（compile_artifact で再利用）
+ARTIFACT_CACHE_SIZE = 32
+_artifacts = OrderedDict()
+_artifacts_lock = threading.Lock()
+
+# 設定ファイル（アプリと同じフォルダ）
+CONFIG_FILE = Path(__file__).parent / "latex_editor_config.json"
+
+
+class RenderError(Exception):
+    """数式のレンダリングに失敗した場合の例外"""
+
+
+@dataclass
+class RenderOptions:
+    """レンダリングオプション（latex_editor_config.json と同じキー）"""
+
+    fontsize: int = 24
+    bgcolor: str = "transparent"
+    displaystyle: bool = False
+    save_format: str = "svg"
+    dpi: int = 300
+    backend: str = "dvi"
+
+    @classmethod
+    def from_settings(cls, settings):
+        """設定辞書からオプションを生成（未知のキーは無視）"""
+        known = {k: v for k, v in settings.items() if k in cls.__dataclass_fields__}
+        return cls(**known)
+
+    def to_dict(self):
+        return asdict(self)
+
+
+def load_settings(config_file=CONFIG_FILE):
+    """設定ファイルを読み込み（存在しない場合は空の辞書）"""
+    config_file = Path(config_file)
+    if not config_file.exists():
+        return {}
+    with open(config_file, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def configure_matplotlib(preamble=DEFAULT_PREAMBLE, precompile=True, lint="on"):
+    """matplotlib の LaTeX 設定
+
+    precompile が True の場合、プリアンブルをフォーマットファイル (.fmt) に
+    プリコンパイルして使う（tex_format.py）。
+    lint は TeX を実行する前の構文チェックのモード（on / strict / off、latex_lint.py）。
+    matplotlib が実行する latex / dvipng にも tex_process の上限を付ける。
+    """
+    import matplotlib
+
+    import tex_process
+
+    global _precompile, _lint
+    _precompile = precompile
+    _lint = lint
+    matplotlib.rcParams.update(
+        {
+            "text.usetex": True,
+            "font.family": "serif",
+            # Computer Modern (TeXデフォルト) を使用
+            "text.latex.preamble": preamble,
+        }
+    )
+    if precompile:
+        tex_format.install()
+    else:
+        tex_format.uninstall()
+    tex_process.install_matplotlib()
+
+
+def current_preamble():
+    """configure_matplotlib で設定したプリアンブル"""
+    import matplotlib
+
+    return matplotlib.rcParams["text.latex.preamble"]
+
+
+def prepare_format(options):
+    """描画方式に合わせてプリアンブルのフォーマットファイル (.fmt) を作成しておく
+
+    起動直後の先読み用。作成できない場合は tex_format.FormatError。
+    """
+    if resolve_backend(options) == "dvi":
+        import tex_engine
+
+        source = tex_engine.build_document([], options.fontsize, current_preamble())
+    else:
+        from matplotlib.texmanager import TexManager
+
+        source = TexManager._get_tex_source("", options.fontsize)
+    return tex_format.ensure_format(tex_format.split_source(source)[0])
+
+
+@stats.timed("normalize")
+def build_math_text(equation, displaystyle=False):
+    """入力された数式を matplotlib に渡す LaTeX 文字列に変換"""
+    equation = equation.strip()
+    if not equation:
+        raise RenderError("数式が空です")
+
+    if _lint != "off":
+        # 明らかに壊れた入力は TeX を実行する前に弾く
+        import latex_lint
+
+        with stats.stage("lint"):
+            latex_lint.check(equation, current_preamble(), _lint)
+
+    # displaystyle の適用
+    if displaystyle:
+        equation = r"\displaystyle " + equation
+
+    equation_formatted = equation
+    needs_math_mode = True  # 数式モード($...$)が必要かどうか
+
+    # \begin{...} 環境がある場合はチェック
+    if equation.strip().startswith(r"\begin"):
+        # align, align*, equation, equation*などの環境は数式モード不要
+        for env in MATH_ENVIRONMENTS:
+            if equation.strip().startswith(f"\\begin{{{env}}}"):
+                needs_math_mode = False
+                break
+    elif "\n" in equation:
+        # 改行があるが\begin環境がない場合、aligned環境を使用
+        lines = equation.strip().split("\n")
+        lines = [line.strip() for line in lines if line.strip()]
+        if len(lines) > 1:
+            equation_formatted = (
+                r"\begin{aligned}" + r"\\".join(lines) + r"\end{aligned}"
+            )
+
+    if needs_math_mode:
+        math_text = f"${equation_formatted}$"
+    else:
+        math_text = equation_formatted
+
+    # matplotlibに渡す前に、Pythonの改行(\n)を除去
+    # LaTeXの\\は保持する必要があるため、\n のみを削除
+    return math_text.replace("\n", " ")
+
+
+def apply_background(fig, ax, bgcolor):
+    """Figure と Axes に背景色を設定"""
+    if bgcolor == "transparent":
+        fig.patch.set_alpha(0)
+        ax.patch.set_alpha(0)
+    else:
+        fig.patch.set_facecolor(bgcolor)
+        ax.patch.set_facecolor(bgcolor)
+
+
+def resolve_backend(options):
+    """実際に使う描画方式（dvi に必要なツールがなければ matplotlib）"""
+    if options.backend == "matplotlib":
+        return "matplotlib"
+    import tex_engine
+
+    if tex_engine.tools_available(options.save_format):
+        return "dvi"
+    return "matplotlib"
+
+
+def render_to_file(equation, fp, options):
+    """数式を余白なしで描画し、ファイル（パスまたはファイルオブジェクト）に保存"""
+    if options.save_format not in SAVE_FORMATS:
+        raise RenderError(f"未対応の保存形式です: {options.save_format}")
+
+    if resolve_backend(options) == "dvi":
+        data = _render_dvi(equation, options)
+        if hasattr(fp, "write"):
+            fp.write(data)
+        else:
+            with open(fp, "wb") as f:
+                f.write(data)
+    else:
+        _render_matplotlib(equation, fp, options)
+
+
+def _render_dvi(equation, options):
+    """TeX の出力を直接 SVG/PNG/PDF に変換（tex_engine.py）"""
+    return compile_artifact(equation, options).export(options)
+
+
+def compile_artifact(equation, options, preview=False):
+    """dvi 方式で数式をコンパイルし、形式に依存しない RenderArtifact を返す
+
+    同じ数式を別の形式で保存するときは artifact.export() で変換だけ行える。
+    最近コンパイルした数式は TeX を実行せずにその結果を返す。preview が真なら、
+    フォントサイズが違っても光学サイズ（tex_engine.optical_sizes）が同じ結果を
+    拡大縮小して使う（長さの一部が比例しないので、保存には使わない）。
+    """
+    import tex_engine
+
+    preamble = current_preamble()
+    math_text = build_math_text(equation, options.displaystyle)
+    key = (math_text, options.fontsize, preamble)
+    with _artifacts_lock:
+        artifact = _artifacts.get(key)
+        if artifact is None and preview:
+            artifact = next(
+                (
+                    a
+                    for a in reversed(_artifacts.values())
+                    if a.matches(math_text, options, preamble, scaled=True)
+                ),
+                None,
+            )
+        if artifact is not None:
+            _artifacts.move_to_end((math_text, artifact.fontsize, preamble))
+    if artifact is not None:
+        stats.count("artifact_reuse", format=options.save_format)
+        return artifact
+
+    artifact = tex_engine.compile_artifact(equation, options, preamble, _precompile)
+    with _artifacts_lock:
+        _artifacts[key] = artifact
+        while len(_artifacts) > ARTIFACT_CACHE_SIZE:
+            _artifacts.popitem(last=False)
+    return artifact
+
+
+def artifact_matches(artifact, equation, options):
+    """RenderArtifact が数式とオプションのコンパイル結果として使えるか"""
+    if artifact is None or resolve_backend(options) != "dvi":
+        return False
+    try:
+        math_text = build_math_text(equation, options.displaystyle)
+    except RenderError:
+        return False
+    return artifact.matches(math_text, options, current_preamble())
+
+
+def _render_matplotlib(equation, fp, options):
+    """matplotlib の Figure に描画して savefig で保存"""
+    from matplotlib.figure import Figure
+
+    fmt = options.save_format
+    math_text = build_math_text(equation, options.displaystyle)
+
+    # 極小サイズでFigureを作成
+    fig = Figure(figsize=(0.1, 0.1), dpi=options.dpi if fmt == "png" else 100)
+    ax = fig.add_subplot(111)
+    apply_background(fig, ax, options.bgcolor)
+
+    # テキストをデータ座標で配置（中央配置だとより密着）
+    ax.text(
+        0.5,
+        0.5,
+        math_text,
+        fontsize=options.fontsize,
+        ha="center",
+        va="center",
+        transform=ax.transAxes,
+    )
+    ax.axis("off")
+    ax.set_xlim(0, 1)
+    ax.set_ylim(0, 1)
+
+    # マージンを完全にゼロに
+    fig.subplots_adjust(left=0, right=1, top=1, bottom=0, wspace=0, hspace=0)
+
+    try:
+        # TeX のコンパイルとラスタライズも savefig の中で行われる
+        with stats.stage("savefig", format=fmt):
+            fig.savefig(
+                fp,
+                format=fmt,
+                bbox_inches="tight",
+                pad_inches=0,
+                transparent=(options.bgcolor == "transparent"),
+                dpi=options.dpi if fmt == "png" else None,
+            )
+    except RenderError:
+        raise  # 上限を超えた場合の ProcessLimitError など
+    except Exception as e:
+        raise RenderError(str(e)) from e
+
+
+def render_to_bytes(equation, options):
+    """数式を描画し、保存形式のバイト列を返す"""
+    buf = io.BytesIO()
+    render_to_file(equation, buf, options)
+    return buf.getvalue()
+
+
+def render_cached(equation, options, cache=None, render=render_to_bytes):
+    """キャッシュを使って数式を描画し、バイト列を返す（cache が None なら毎回描画）
+
+    render にはキャッシュがない場合に使う描画関数（TeXWorker.render など）を指定する。
+    同じキャッシュフォルダを使う他のプロセスが同じ数式を描画中なら、その結果を待つ。
+    """
+    if cache is None:
+        return render(equation, options)
+
+    math_text = build_math_text(equation, options.displaystyle)
+    # 実際に使う描画方式でキーを作る（ツールの有無で出力が変わるため）
+    resolved = replace(options, backend=resolve_backend(options))
+    key = cache_key(math_text, resolved, current_preamble())
+    data, status = cache.fetch(
+        key, options.save_format, lambda: render(equation, options)
+    )
+    stats.count(f"cache_{status}", format=options.save_format)
+    return data
+
+
+def parse_target(spec, options):
+    """書き出し先の指定（svg, pdf, png, png@2x, png@300dpi）からオプションを生成
+
+    (オプション, ファイル名の接尾辞) を返す。
+    """
+    match = re.fullmatch(r"(svg|pdf|png)(?:@(\d+(?:\.\d+)?)(x|dpi))?", spec.strip())
+    if not match:
+        raise RenderError(f"書き出し先の指定が正しくありません: {spec}")
+    fmt, value, unit = match.groups()
+    if value is None:
+        return replace(options, save_format=fmt), ""
+    if fmt != "png":
+        raise RenderError(f"解像度を指定できるのは PNG だけです: {spec}")
+    if unit == "x":
+        dpi = round(PNG_BASE_DPI * float(value))
+        suffix = "" if float(value) == 1 else f"@{value}x"
+    else:
+        dpi = round(float(value))
+        suffix = f"@{value}dpi"
+    return replace(options, save_format=fmt, dpi=dpi), suffix
+
+
+def write_atomic(path, data):
+    """一時ファイル経由でバイト列を書き込む（読み手が書きかけのファイルを見ない）"""
+    path = Path(path)
+    fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+        raise
+
+
+def export_targets(
+    equation,
+    options,
+    targets,
+    output_dir,
+    name,
+    template=DEFAULT_NAME_TEMPLATE,
+    artifact=None,
+    cache=None,
+    render=render_to_bytes,
+    postprocess=None,
+):
+    """1 回のコンパイル結果から複数の形式・解像度を書き出し、保存したパスのリストを返す
+
+    dvi 方式では TeX を 1 回だけ実行し、PNG は DVI から直接ラスタライズする。
+    artifact に直前のコンパイル結果を渡すと、数式が同じならコンパイルも省略する。
+    render は matplotlib 方式で使う描画関数（TeXWorker.render など）。
+    postprocess(保存先, オプション, データ) を指定すると、書き出す前にデータを変換する
+    （SVG の縮小など。キャッシュには変換前のデータを保存する）。
+    """
+    compiled = [artifact]
+
+    def render_target(equation, target):
+        if resolve_backend(target) != "dvi":
+            return render(equation, target)
+        if not artifact_matches(compiled[0], equation, target):
+            compiled[0] = compile_artifact(equation, target)
+        return compiled[0].export(target)
+
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    paths = []
+    for spec in targets:
+        target, suffix = parse_target(spec, options)
+        data = render_cached(equation, target, cache, render_target)
+        path = output_dir / template.format(
+            name=name, suffix=suffix, format=target.save_format, dpi=target.dpi
+        )
+        if postprocess is not None:
+            data = postprocess(path, target, data)
+        write_atomic(path, data)
+        paths.append(path)
+    return paths
@@ -0,0 +1,491 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+ローカルのレンダリングサーバー
+asyncio の HTTP サーバーで数式を受け取り、プロセスプールで SVG/PNG/PDF に描画して返す。
+同じ数式・オプションの描画が処理中なら新しく TeX を実行せず、その結果を共有する。
+
+使い方:
+    python latex_server.py --port 8765 -j 4
+
+    POST /render  {"equation": "E = mc^2", "format": "svg", "fontsize": 32}
+    GET  /render?equation=E%20%3D%20mc%5E2&format=png&dpi=192
+    GET  /health  処理中の件数と統計（JSON）
+
+オプションのキーは latex_editor_config.json と同じ（保存形式は format でも指定可）。
+失敗した場合は {"error": "..."} を返す（400: 不正な要求, 403: 許可していない Host,
+422: 描画の失敗, 503: 処理待ちが多すぎる）。latex などが時間・メモリの上限（tex_process.py）を超えた
+場合は 422 で {"error": "...", "reason": "timeout" / "cpu" / "memory"} を返す。
+
+閲覧中の Web ページから勝手に使われないよう、Host が localhost / 127.0.0.1 以外の要求
+（DNS リバインディング）は拒否し、CORS のヘッダーは --allow-origin で指定した
+オリジンにだけ返す。
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import replace
+from urllib.parse import parse_qsl, urlsplit
+
+import tex_process
+from latex_lint import LINT_MODES
+from latex_render import (
+    DEFAULT_PREAMBLE,
+    SAVE_FORMATS,
+    RenderError,
+    RenderOptions,
+    build_math_text,
+    configure_matplotlib,
+    load_settings,
+    render_cached,
+)
+from render_cache import DEFAULT_CACHE_DIR, DEFAULT_MAX_MB, RenderCache, cache_key
+from render_stats import stats
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+# 受け付ける Host ヘッダーのホスト名（--allow-host で追加できる）
+DEFAULT_ALLOWED_HOSTS = ("localhost", "127.0.0.1", "[::1]")
+# 処理中（描画待ちを含む）の異なる数式の上限。超えたら 503 を返す
+DEFAULT_MAX_PENDING = 64
+# 要求ヘッダー・本文と数式の長さの上限
+MAX_HEADER_BYTES = 16 * 1024
+MAX_BODY_BYTES = 64 * 1024
+MAX_EQUATION_CHARS = 10000
+# 受け付けるフォントサイズと解像度の範囲
+FONTSIZE_RANGE = (1, 200)
+DPI_RANGE = (10, 1200)
+# 接続を維持したまま次の要求を待つ時間（秒）
+KEEPALIVE_TIMEOUT = 15
+
+CONTENT_TYPES = {
+    "svg": "image/svg+xml",
+    "png": "image/png",
+    "pdf": "application/pdf",
+}
+REASONS = {
+    200: "OK",
+    204: "No Content",
+    400: "Bad Request",
+    403: "Forbidden",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    413: "Payload Too Large",
+    422: "Unprocessable Entity",
+    500: "Internal Server Error",
+    503: "Service Unavailable",
+}
+
+# ワーカープロセスのキャッシュ（_init_worker で設定）
+_cache = None
+
+
+class HTTPError(Exception):
+    """HTTP のエラー応答（status と JSON の error メッセージ）"""
+
+    def __init__(self, status, message, reason=None):
+        super().__init__(message)
+        self.status = status
+        self.reason = reason
+
+
+def _init_worker(
+    preamble, precompile, cache_dir, cache_max_bytes, lint_mode, limits=None
+):
+    """ワーカープロセスの初期化"""
+    global _cache
+    configure_matplotlib(preamble, precompile, lint_mode)
+    if limits is not None:
+        tex_process.configure(limits)
+    if cache_dir is not None:
+        _cache = RenderCache(cache_dir, cache_max_bytes)
+
+
+def _render(equation, options):
+    """数式を描画してバイト列を返す（ワーカープロセスで実行）"""
+    return render_cached(equation, options, _cache)
+
+
+def parse_options(params, defaults):
+    """要求のパラメータ（JSON または クエリ文字列）から (数式, オプション) を生成"""
+    equation = params.get("equation")
+    if not isinstance(equation, str) or not equation.strip():
+        raise HTTPError(400, "equation を指定してください")
+    if len(equation) > MAX_EQUATION_CHARS:
+        raise HTTPError(413, f"数式が長すぎます（{MAX_EQUATION_CHARS} 文字まで）")
+
+    options = defaults
+    fmt = params.get("format", params.get("save_format", options.save_format))
+    if fmt not in SAVE_FORMATS:
+        raise HTTPError(400, f"未対応の保存形式です: {fmt}")
+    options = replace(options, save_format=fmt)
+
+    for name, (low, high) in (("fontsize", FONTSIZE_RANGE), ("dpi", DPI_RANGE)):
+        if name not in params:
+            continue
+        try:
+            value = int(params[name])
+        except (TypeError, ValueError):
+            raise HTTPError(400, f"{name} は整数で指定してください") from None
+        if not low <= value <= high:
+            raise HTTPError(400, f"{name} は {low} ～ {high} で指定してください")
+        options = replace(options, **{name: value})
+
+    if "bgcolor" in params:
+        from matplotlib.colors import is_color_like
+
+        bgcolor = params["bgcolor"]
+        if bgcolor != "transparent" and not is_color_like(bgcolor):
+            raise HTTPError(400, f"背景色が正しくありません: {bgcolor}")
+        options = replace(options, bgcolor=bgcolor)
+
+    if "displaystyle" in params:
+        value = params["displaystyle"]
+        if isinstance(value, str):
+            value = value.lower() in ("1", "true", "yes", "on")
+        options = replace(options, displaystyle=bool(value))
+    return equation, options
+
+
+class RenderServer:
+    """プロセスプールで描画し、処理中の同じ要求をまとめる HTTP サーバー"""
+
+    def __init__(
+        self,
+        options=None,
+        preamble=DEFAULT_PREAMBLE,
+        precompile=True,
+        cache_dir=DEFAULT_CACHE_DIR,
+        cache_max_bytes=DEFAULT_MAX_MB * 1024**2,
+        lint_mode="on",
+        jobs=None,
+        max_pending=DEFAULT_MAX_PENDING,
+        allow_origins=(),
+        allowed_hosts=DEFAULT_ALLOWED_HOSTS,
+        limits=None,
+    ):
+        self.options = options or RenderOptions()
+        self.preamble = preamble
+        self.jobs = jobs or os.cpu_count()
+        self.max_pending = max_pending
+        # CORS で許可するオリジン（"*" ならすべて）
+        self.allow_origins = set(allow_origins)
+        self.allowed_hosts = {host.lower() for host in allowed_hosts}
+        self._pool_args = (
+            preamble, precompile, cache_dir, cache_max_bytes, lint_mode, limits
+        )
+        self._pool = None
+        # キャッシュキー -> 描画中の Future
+        self._inflight = {}
+        self._server = None
+
+    def start_pool(self):
+        """ワーカープロセスのプールを作成"""
+        self._pool = ProcessPoolExecutor(
+            max_workers=self.jobs, initializer=_init_worker, initargs=self._pool_args
+        )
+
+    async def render(self, equation, options):
+        """数式を描画してバイト列を返す（処理中の同じ要求があればその結果を待つ）"""
+        # 構文チェックと正規化はここで行い、壊れた入力はワーカーに送らない
+        try:
+            math_text = build_math_text(equation, options.displaystyle)
+        except RenderError as e:
+            raise HTTPError(422, str(e)) from None
+        key = cache_key(math_text, options, self.preamble)
+        future = self._inflight.get(key)
+        if future is None:
+            if len(self._inflight) >= self.max_pending:
+                raise HTTPError(503, "処理待ちの要求が多すぎます")
+            loop = asyncio.get_running_loop()
+            future = loop.run_in_executor(self._pool, _render, equation, options)
+            future.pool = self._pool
+            self._inflight[key] = future
+            future.add_done_callback(lambda _: self._inflight.pop(key, None))
+            stats.count("server_render", format=options.save_format)
+        else:
+            stats.count("server_coalesced", format=options.save_format)
+        try:
+            # 要求元が切断されても、同じ結果を待つ他の要求のために描画は続ける
+            return await asyncio.shield(future)
+        except tex_process.ProcessLimitError as e:
+            raise HTTPError(422, str(e), e.reason) from None
+        except RenderError as e:
+            raise HTTPError(422, str(e)) from None
+        except BrokenProcessPool:
+            # 同じプールを待っていた要求のうち最初の 1 つだけが作り直す
+            if future.pool is self._pool:
+                self.start_pool()
+            raise HTTPError(500, "ワーカープロセスが異常終了しました") from None
+
+    def health(self):
+        """処理中の件数と統計"""
+        return {
+            "status": "ok",
+            "jobs": self.jobs,
+            "inflight": len(self._inflight),
+            "max_pending": self.max_pending,
+            "stats": stats.summary(),
+        }
+
+    def check_host(self, headers):
+        """Host ヘッダーが許可したホスト名でなければ HTTPError(403)"""
+        host = headers.get("host", "").lower()
+        # ポート番号を除く（[::1]:8765 のような IPv6 も）
+        name = host.rsplit(":", 1)[0] if host.rfind(":") > host.rfind("]") else host
+        if name not in self.allowed_hosts:
+            raise HTTPError(403, f"許可していない Host です: {host or '(なし)'}")
+
+    async def handle_request(self, method, target, headers, body):
+        """1 つの要求を処理し、(status, Content-Type, 本文) を返す"""
+        url = urlsplit(target)
+        if url.path == "/health":
+            if method != "GET":
+                raise HTTPError(405, "GET のみ対応しています")
+            return 200, "application/json", json.dumps(self.health()).encode("utf-8")
+        if url.path != "/render":
+            raise HTTPError(404, f"見つかりません: {url.path}")
+
+        if method == "GET":
+            params = dict(parse_qsl(url.query))
+        elif method == "POST":
+            try:
+                params = json.loads(body.decode("utf-8"))
+            except (UnicodeDecodeError, json.JSONDecodeError) as e:
+                raise HTTPError(400, f"JSON が正しくありません: {e}") from None
+            if not isinstance(params, dict):
+                raise HTTPError(400, "JSON はオブジェクトで指定してください")
+        else:
+            raise HTTPError(405, "GET または POST のみ対応しています")
+
+        equation, options = parse_options(params, self.options)
+        with stats.stage("server_request", format=options.save_format):
+            data = await self.render(equation, options)
+        return 200, CONTENT_TYPES[options.save_format], data
+
+    def _response(self, status, content_type, body, keep_alive, origin=None):
+        lines = [
+            f"HTTP/1.1 {status} {REASONS.get(status, '')}",
+            f"Content-Length: {len(body)}",
+            f"Connection: {'keep-alive' if keep_alive else 'close'}",
+        ]
+        if content_type:
+            lines.append(f"Content-Type: {content_type}")
+        if "*" in self.allow_origins:
+            allowed = "*"
+        elif origin in self.allow_origins:
+            allowed = origin
+        else:
+            allowed = None
+        if allowed is not None:
+            lines += [
+                f"Access-Control-Allow-Origin: {allowed}",
+                "Access-Control-Allow-Methods: GET, POST, OPTIONS",
+                "Access-Control-Allow-Headers: Content-Type",
+            ]
+        if self.allow_origins and allowed != "*":
+            lines.append("Vary: Origin")
+        return ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1") + body
+
+    async def _read_request(self, reader):
+        """要求を読み込み (method, target, headers, body) を返す（接続が閉じたら None）"""
+        try:
+            head = await asyncio.wait_for(
+                reader.readuntil(b"\r\n\r\n"), KEEPALIVE_TIMEOUT
+            )
+        except (asyncio.IncompleteReadError, asyncio.TimeoutError):
+            return None
+        except asyncio.LimitOverrunError:
+            raise HTTPError(413, "ヘッダーが大きすぎます") from None
+        request_line, *header_lines = head.decode("latin-1").split("\r\n")
+        try:
+            method, target, version = request_line.split(" ")
+        except ValueError:
+            raise HTTPError(400, "要求行が正しくありません") from None
+        headers = {}
+        for line in header_lines:
+            if ":" in line:
+                name, value = line.split(":", 1)
+                headers[name.strip().lower()] = value.strip()
+        headers[":version"] = version
+
+        try:
+            length = int(headers.get("content-length", 0))
+        except ValueError:
+            raise HTTPError(400, "Content-Length が正しくありません") from None
+        if length > MAX_BODY_BYTES:
+            raise HTTPError(413, f"本文が大きすぎます（{MAX_BODY_BYTES} バイトまで）")
+        body = await reader.readexactly(length) if length else b""
+        return method, target, headers, body
+
+    async def handle_connection(self, reader, writer):
+        """1 つの接続を処理（HTTP/1.1 の keep-alive に対応）"""
+        try:
+            while True:
+                keep_alive = False
+                origin = None
+                try:
+                    request = await self._read_request(reader)
+                    if request is None:
+                        break
+                    method, target, headers, body = request
+                    origin = headers.get("origin")
+                    connection = headers.get("connection", "").lower()
+                    keep_alive = (
+                        connection != "close"
+                        if headers[":version"] == "HTTP/1.1"
+                        else connection == "keep-alive"
+                    )
+                    self.check_host(headers)
+                    if method == "OPTIONS":
+                        status, content_type, data = 204, None, b""
+                    else:
+                        status, content_type, data = await self.handle_request(
+                            method, target, headers, body
+                        )
+                except HTTPError as e:
+                    status, content_type = e.status, "application/json"
+                    error = {"error": str(e)}
+                    if e.reason is not None:
+                        error["reason"] = e.reason
+                    data = json.dumps(error, ensure_ascii=False).encode("utf-8")
+                    # 本文を読み切れていない可能性があるので接続を閉じる
+                    keep_alive = keep_alive and e.status not in (400, 413)
+                except Exception as e:
+                    print(f"要求の処理中にエラーが発生しました: {e}", file=sys.stderr)
+                    status, content_type = 500, "application/json"
+                    data = json.dumps({"error": str(e)}, ensure_ascii=False).encode(
+                        "utf-8"
+                    )
+                    keep_alive = False
+                writer.write(
+                    self._response(status, content_type, data, keep_alive, origin)
+                )
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host=DEFAULT_HOST, port=DEFAULT_PORT, on_ready=None):
+        """サーバーを起動して停止されるまで要求を処理"""
+        self.start_pool()
+        try:
+            self._server = await asyncio.start_server(
+                self.handle_connection, host, port, limit=MAX_HEADER_BYTES
+            )
+            if on_ready:
+                on_ready(self._server.sockets[0].getsockname())
+            async with self._server:
+                await self._server.serve_forever()
+        finally:
+            self._pool.shutdown(cancel_futures=True)
+
+    def close(self):
+        """serve を終了させる"""
+        if self._server is not None:
+            self._server.close()
+
+
+def main(argv=None):
+    # --config を先に読んで、その設定を既定値として使う
+    pre_parser = argparse.ArgumentParser(add_help=False)
+    pre_parser.add_argument("--config", default=None)
+    pre_args, _ = pre_parser.parse_known_args(argv)
+    settings = load_settings(pre_args.config) if pre_args.config else load_settings()
+
+    parser = argparse.ArgumentParser(description="LaTeX 数式のレンダリングサーバー")
+    parser.add_argument("--config", default=None, help="設定ファイル")
+    parser.add_argument(
+        "--host",
+        default=settings.get("server_host", DEFAULT_HOST),
+        help="待ち受けるアドレス",
+    )
+    parser.add_argument(
+        "--port",
+        type=int,
+        default=settings.get("server_port", DEFAULT_PORT),
+        help="待ち受けるポート",
+    )
+    parser.add_argument(
+        "-j", "--jobs", type=int, default=None, help="並列数（既定: CPU コア数）"
+    )
+    parser.add_argument(
+        "--max-pending",
+        type=int,
+        default=DEFAULT_MAX_PENDING,
+        help="処理中の異なる数式の上限（超えると 503）",
+    )
+    parser.add_argument(
+        "--allow-origin",
+        action="append",
+        default=settings.get("server_allow_origins", []),
+        help="CORS で許可するオリジン（複数指定可、* ですべて。既定: なし）",
+    )
+    parser.add_argument(
+        "--allow-host",
+        action="append",
+        default=[],
+        help="localhost / 127.0.0.1 のほかに受け付ける Host のホスト名（複数指定可）",
+    )
+    parser.add_argument(
+        "--cache-dir",
+        default=settings.get("cache_dir", str(DEFAULT_CACHE_DIR)),
+        help="キャッシュフォルダ",
+    )
+    parser.add_argument(
+        "--cache-max-mb",
+        type=int,
+        default=settings.get("cache_max_mb", DEFAULT_MAX_MB),
+        help="キャッシュの上限サイズ (MB)",
+    )
+    parser.add_argument(
+        "--no-cache", action="store_true", help="キャッシュを使わない"
+    )
+    parser.add_argument(
+        "--lint",
+        choices=LINT_MODES,
+        default=settings.get("lint", "on"),
+        help="TeX を実行する前の構文チェック（strict: 警告でも描画しない）",
+    )
+    args = parser.parse_args(argv)
+
+    preamble = settings.get("preamble", DEFAULT_PREAMBLE)
+    precompile = settings.get("precompiled_preamble", True)
+    # 構文チェックと正規化はサーバーのプロセスでも行う
+    configure_matplotlib(preamble, precompile, args.lint)
+    server = RenderServer(
+        options=RenderOptions.from_settings(settings),
+        preamble=preamble,
+        precompile=precompile,
+        cache_dir=None if args.no_cache else args.cache_dir,
+        cache_max_bytes=args.cache_max_mb * 1024**2,
+        lint_mode=args.lint,
+        jobs=args.jobs,
+        max_pending=args.max_pending,
+        allow_origins=args.allow_origin,
+        allowed_hosts=DEFAULT_ALLOWED_HOSTS
+        + tuple(settings.get("server_allow_hosts", []))
+        + tuple(args.allow_host),
+        limits=tex_process.ProcessLimits.from_settings(settings),
+    )
+
+    def on_ready(address):
+        print(f"http://{address[0]}:{address[1]}/render で待ち受けています", flush=True)
+
+    try:
+        asyncio.run(server.serve(args.host, args.port, on_ready))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
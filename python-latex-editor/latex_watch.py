@@ -0,0 +1,506 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+数式ファイルの監視と差分レンダリング
+フォルダまたはファイルを監視し、変更されたファイルから数式を取り出して、
+内容かオプションが前回から変わった数式だけを描画し直す。
+
+使い方:
+    python latex_watch.py equations/ paper.tex -o output --targets svg,png@2x
+    python latex_watch.py equations/ -o output --once   # 1 回だけ更新して終了
+
+入力:
+    .txt  空行区切りで 1 数式ずつ（latex_batch.py と同じ）
+    .tex  equation / align などの数式環境と \\[ ... \\]、$$ ... $$
+          \\label{...} があればそれを出力ファイル名にする
+    .jsonl / .csv  latex_batch.py と同じマニフェスト（id を出力ファイル名にし、
+          項目ごとのオプションも使う）
+
+出力フォルダには入力と同じ階層で、入力ファイル名のフォルダに書き出し
+（例: equations/a.txt -> output/a.txt/eq_0001.svg）、出力ごとのキーを
+.latex_watch.json に記録する。ファイルは一時ファイル経由で置き換える。
+"""
+
+import argparse
+import json
+import re
+import sys
+import time
+from dataclasses import replace
+from pathlib import Path
+
+import tex_process
+from latex_batch import (
+    MANIFEST_FORMATS,
+    parse_record,
+    read_equations,
+    read_manifest,
+    record_id,
+)
+from latex_lint import LINT_MODES
+from latex_render import (
+    BACKENDS,
+    DEFAULT_NAME_TEMPLATE,
+    DEFAULT_PREAMBLE,
+    MATH_ENVIRONMENTS,
+    SAVE_FORMATS,
+    RenderError,
+    RenderOptions,
+    build_math_text,
+    configure_matplotlib,
+    current_preamble,
+    export_targets,
+    load_settings,
+    parse_target,
+    prepare_format,
+    resolve_backend,
+    write_atomic,
+)
+from render_cache import DEFAULT_CACHE_DIR, DEFAULT_MAX_MB, RenderCache, cache_key
+from tex_format import FormatError
+
+SOURCE_SUFFIXES = [".txt", ".tex"] + [f".{fmt}" for fmt in MANIFEST_FORMATS]
+STATE_FILE = ".latex_watch.json"
+# 出力フォルダの名前の付け方を変えたら上げる（古い記録は使わない）
+STATE_VERSION = 2
+# 変更を調べる間隔と、保存が落ち着いたとみなすまでの時間（秒）
+DEFAULT_INTERVAL = 0.2
+DEFAULT_DEBOUNCE = 0.3
+
+_COMMENT = re.compile(r"(?<!\\)%.*")
+_LABEL = re.compile(r"\\label\{([^}]*)\}")
+_TEX_MATH = re.compile(
+    r"\\begin\{(?P<env>"
+    + "|".join(re.escape(env) for env in MATH_ENVIRONMENTS)
+    + r")\}.*?\\end\{(?P=env)\}"
+    r"|\\\[(?P<bracket>.*?)\\\]"
+    r"|\$\$(?P<dollars>.*?)\$\$",
+    re.DOTALL,
+)
+
+
+def tex_equations(text):
+    """.tex の本文から (ラベル, 数式) のリストを取り出す（ラベルがなければ None）"""
+    text = "\n".join(_COMMENT.sub("", line) for line in text.splitlines())
+    equations = []
+    for match in _TEX_MATH.finditer(text):
+        body = match.group("bracket") or match.group("dollars") or match.group(0)
+        label = _LABEL.search(body)
+        body = _LABEL.sub("", body).strip()
+        if body:
+            equations.append((label.group(1) if label else None, body))
+    return equations
+
+
+def manifest_equations(path, options):
+    """マニフェストから (id, 数式または RenderError, オプション) のリストを取り出す"""
+    equations = []
+    with open(path, "r", encoding="utf-8", newline="") as fp:
+        for line_number, fields in read_manifest(fp, Path(path).suffix[1:]):
+            item_id = record_id(fields, line_number)
+            try:
+                if isinstance(fields, Exception):
+                    raise fields
+                equation, item_options = parse_record(fields, options)
+            except RenderError as e:
+                equations.append((item_id, e, options))
+            else:
+                equations.append((item_id, equation, item_options))
+    return equations
+
+
+def source_equations(path, options):
+    """入力ファイルから (出力名, 数式, オプション) のリストを取り出す
+
+    マニフェストの不正な項目は、数式の代わりに RenderError を返す。
+    """
+    path = Path(path)
+    if path.suffix[1:] in MANIFEST_FORMATS:
+        labeled = manifest_equations(path, options)
+    else:
+        text = path.read_text(encoding="utf-8")
+        if path.suffix == ".tex":
+            labeled = tex_equations(text)
+        else:
+            labeled = [(None, eq) for eq in read_equations(text.splitlines())]
+        labeled = [(label, eq, options) for label, eq in labeled]
+    width = max(4, len(str(len(labeled))))
+    equations = []
+    used = set()
+    for i, (label, equation, item_options) in enumerate(labeled):
+        name = re.sub(r"[^\w.-]+", "_", label) if label else f"eq_{i + 1:0{width}d}"
+        if name in used:
+            name = f"{name}_{i + 1}"
+        used.add(name)
+        equations.append((name, equation, item_options))
+    return equations
+
+
+class Watcher:
+    """入力ファイルの変更を調べ、変わった数式だけを描画し直す"""
+
+    def __init__(
+        self,
+        sources,
+        output_dir,
+        options,
+        targets=None,
+        name_template=DEFAULT_NAME_TEMPLATE,
+        cache=None,
+        debounce=DEFAULT_DEBOUNCE,
+        log=print,
+    ):
+        self.sources = [Path(s) for s in sources]
+        self.output_dir = Path(output_dir)
+        self.options = options
+        # None の場合は数式ごとのオプションの保存形式で書き出す
+        self.targets = targets
+        self.name_template = name_template
+        self.cache = cache
+        self.debounce = debounce
+        self.log = log
+        self.state_path = self.output_dir / STATE_FILE
+        # 出力パス（出力フォルダからの相対、/ 区切り） -> キー
+        self.state = self._load_state()
+        # 入力ファイル -> 処理済みの (mtime_ns, サイズ)
+        self._done = {}
+        # 入力ファイル -> (最後に見た (mtime_ns, サイズ), 変化を見た時刻)
+        self._pending = {}
+
+    def _load_state(self):
+        try:
+            with open(self.state_path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        if data.get("version") != STATE_VERSION:
+            return {}
+        return data.get("outputs", {})
+
+    def _save_state(self):
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        data = json.dumps({"version": STATE_VERSION, "outputs": self.state}, indent=1)
+        write_atomic(self.state_path, data.encode("utf-8"))
+
+    def scan(self):
+        """監視対象の入力ファイル -> (出力フォルダからの相対パス, (mtime_ns, サイズ))"""
+        found = {}
+        for source in self.sources:
+            if source.is_dir():
+                files = [
+                    (p, p.relative_to(source))
+                    for p in sorted(source.rglob("*"))
+                    if p.suffix in SOURCE_SUFFIXES and p.is_file()
+                ]
+            else:
+                files = [(source, Path(source.name))]
+            for path, relative in files:
+                try:
+                    st = path.stat()
+                except OSError:
+                    continue
+                # a.txt と a.tex が同じフォルダに書き出さないよう、拡張子も残す
+                found[path] = (relative, (st.st_mtime_ns, st.st_size))
+        return found
+
+    def _targets(self, options):
+        return self.targets or [options.save_format]
+
+    def _plan(self, relative, equations):
+        """数式ごとに (数式, 名前, オプション, [(出力パス, キー)]) を作成"""
+        plan = []
+        preamble = current_preamble()
+        for name, equation, options in equations:
+            try:
+                if isinstance(equation, Exception):
+                    raise equation
+                math_text = build_math_text(equation, options.displaystyle)
+                specs = [parse_target(spec, options) for spec in self._targets(options)]
+            except RenderError as e:
+                self.log(f"[NG] {relative}/{name}: {e}")
+                continue
+            outputs = []
+            for target, suffix in specs:
+                resolved = replace(target, backend=resolve_backend(target))
+                filename = self.name_template.format(
+                    name=name, suffix=suffix, format=target.save_format, dpi=target.dpi
+                )
+                key = cache_key(math_text, resolved, preamble)
+                outputs.append(((relative / filename).as_posix(), key))
+            plan.append((equation, name, options, outputs))
+        return plan
+
+    def update(self, path, relative):
+        """1 つの入力ファイルの数式を更新し、(描画, 再利用, 変更なし, 失敗) の件数を返す"""
+        prefix = relative.as_posix() + "/"
+        old = {p: k for p, k in self.state.items() if p.startswith(prefix)}
+        try:
+            equations = source_equations(path, self.options)
+        except (OSError, UnicodeDecodeError) as e:
+            self.log(f"[NG] {path}: {e}")
+            return 0, 0, 0, 1
+        plan = self._plan(relative, equations)
+        failed = len(equations) - len(plan)
+
+        # 並べ替えや挿入で名前だけが変わった出力は、書き込む前に読んでおいて再利用する
+        by_key = {k: p for p, k in self.state.items()}
+        reuse = {}
+        to_render = []
+        unchanged = 0
+        for equation, name, options, outputs in plan:
+            missing = [
+                (p, k)
+                for p, k in outputs
+                if self.state.get(p) != k or not (self.output_dir / p).exists()
+            ]
+            if not missing:
+                unchanged += 1
+                continue
+            try:
+                for p, k in missing:
+                    reuse[p] = (self.output_dir / by_key[k]).read_bytes()
+            except (KeyError, OSError):
+                for p, _ in missing:
+                    reuse.pop(p, None)
+                to_render.append((equation, name, options))
+
+        directory = self.output_dir / relative
+        directory.mkdir(parents=True, exist_ok=True)
+        for p, data in reuse.items():
+            write_atomic(self.output_dir / p, data)
+        rendered = 0
+        errors = set()
+        for equation, name, options in to_render:
+            try:
+                export_targets(
+                    equation,
+                    options,
+                    self._targets(options),
+                    directory,
+                    name,
+                    self.name_template,
+                    cache=self.cache,
+                )
+            except RenderError as e:
+                self.log(f"[NG] {relative}/{name}: {e}")
+                errors.add(name)
+                continue
+            rendered += 1
+
+        # 数式が消えた出力を削除し、描画できなかった出力は次の変更で描画し直す
+        planned = {p for *_, outputs in plan for p, _ in outputs}
+        current = {
+            p: k
+            for _, name, _, outputs in plan
+            if name not in errors
+            for p, k in outputs
+        }
+        for p in old:
+            if p not in planned:
+                (self.output_dir / p).unlink(missing_ok=True)
+            if p not in current:
+                self.state.pop(p, None)
+        self.state.update(current)
+        self._save_state()
+        reused = len(plan) - unchanged - len(to_render)
+        return rendered, reused, unchanged, failed + len(errors)
+
+    def remove(self, relative):
+        """消えた入力ファイルの出力を削除"""
+        prefix = relative.as_posix() + "/"
+        for p in [p for p in self.state if p.startswith(prefix)]:
+            (self.output_dir / p).unlink(missing_ok=True)
+            del self.state[p]
+        self._save_state()
+
+    def poll(self, now=None):
+        """変更が落ち着いた入力ファイルを更新し、失敗の件数を返す"""
+        now = time.monotonic() if now is None else now
+        found = self.scan()
+        failed = 0
+        for path in [p for p in self._done if p not in found]:
+            relative = self._done.pop(path)[0]
+            self._pending.pop(path, None)
+            self.remove(relative)
+            self.log(f"[削除] {path}")
+
+        for path, (relative, signature) in found.items():
+            if self._done.get(path, (None, None))[1] == signature:
+                self._pending.pop(path, None)
+                continue
+            seen, since = self._pending.get(path, (None, now))
+            if seen != signature:
+                # 保存が続いている間は待つ
+                self._pending[path] = (signature, now)
+                if self.debounce > 0:
+                    continue
+            elif now - since < self.debounce:
+                continue
+            del self._pending[path]
+            start = time.perf_counter()
+            try:
+                rendered, reused, unchanged, errors = self.update(path, relative)
+            except (RenderError, OSError) as e:
+                # 1 つのファイルの失敗で監視を止めない（次の変更でやり直す）
+                self.log(f"[NG] {path}: {e}")
+                self._done[path] = (relative, signature)
+                failed += 1
+                continue
+            elapsed = (time.perf_counter() - start) * 1000
+            self._done[path] = (relative, signature)
+            failed += errors
+            self.log(
+                f"[更新] {path}: {rendered} 件描画, {reused} 件再利用, "
+                f"{unchanged} 件変更なし, {errors} 件失敗 ({elapsed:.0f} ms)"
+            )
+        return failed
+
+    def run_once(self):
+        """すべての入力ファイルを 1 回だけ更新し、失敗の件数を返す"""
+        debounce, self.debounce = self.debounce, 0
+        try:
+            return self.poll()
+        finally:
+            self.debounce = debounce
+
+    def watch(self, interval=DEFAULT_INTERVAL):
+        """停止されるまで変更を監視"""
+        while True:
+            self.poll()
+            time.sleep(interval)
+
+
+def main(argv=None):
+    # --config を先に読んで、その設定を既定値として使う
+    pre_parser = argparse.ArgumentParser(add_help=False)
+    pre_parser.add_argument("--config", default=None)
+    pre_args, _ = pre_parser.parse_known_args(argv)
+    settings = load_settings(pre_args.config) if pre_args.config else load_settings()
+
+    parser = argparse.ArgumentParser(description="数式ファイルの監視と差分レンダリング")
+    parser.add_argument("sources", nargs="+", help="監視するフォルダまたはファイル")
+    parser.add_argument("-o", "--output", default="output", help="出力フォルダ")
+    parser.add_argument("--config", default=None, help="設定ファイル")
+    parser.add_argument(
+        "--fontsize", type=int, default=settings.get("fontsize", 24), help="フォントサイズ"
+    )
+    parser.add_argument(
+        "--bgcolor", default=settings.get("bgcolor", "transparent"), help="背景色"
+    )
+    parser.add_argument(
+        "--displaystyle",
+        action=argparse.BooleanOptionalAction,
+        default=settings.get("displaystyle", False),
+        help="\\displaystyle を使用",
+    )
+    parser.add_argument(
+        "--format",
+        choices=SAVE_FORMATS,
+        default=settings.get("save_format", "svg"),
+        help="保存形式",
+    )
+    parser.add_argument("--dpi", type=int, default=300, help="PNG の解像度")
+    parser.add_argument(
+        "--backend",
+        choices=BACKENDS,
+        default=settings.get("backend", "dvi"),
+        help="描画方式（dvi: dvisvgm などで直接変換、matplotlib: savefig）",
+    )
+    parser.add_argument(
+        "--targets",
+        default=None,
+        help="書き出し先（カンマ区切り、例: svg,png@2x）。1 回のコンパイルからまとめて書き出す",
+    )
+    parser.add_argument(
+        "--name-template",
+        default=settings.get("export_name_template", DEFAULT_NAME_TEMPLATE),
+        help="出力ファイル名のテンプレート（{name}, {suffix}, {format}, {dpi}）",
+    )
+    parser.add_argument(
+        "--cache-dir",
+        default=settings.get("cache_dir", str(DEFAULT_CACHE_DIR)),
+        help="キャッシュフォルダ",
+    )
+    parser.add_argument(
+        "--cache-max-mb",
+        type=int,
+        default=settings.get("cache_max_mb", DEFAULT_MAX_MB),
+        help="キャッシュの上限サイズ (MB)",
+    )
+    parser.add_argument(
+        "--no-cache", action="store_true", help="キャッシュを使わない"
+    )
+    parser.add_argument(
+        "--lint",
+        choices=LINT_MODES,
+        default=settings.get("lint", "on"),
+        help="TeX を実行する前の構文チェック（strict: 警告でも描画しない）",
+    )
+    parser.add_argument(
+        "--interval",
+        type=float,
+        default=DEFAULT_INTERVAL,
+        help="変更を調べる間隔（秒）",
+    )
+    parser.add_argument(
+        "--debounce",
+        type=float,
+        default=DEFAULT_DEBOUNCE,
+        help="保存が落ち着いたとみなすまでの時間（秒）",
+    )
+    parser.add_argument(
+        "--once", action="store_true", help="1 回だけ更新して終了する"
+    )
+    args = parser.parse_args(argv)
+
+    options = RenderOptions(
+        fontsize=args.fontsize,
+        bgcolor=args.bgcolor,
+        displaystyle=args.displaystyle,
+        save_format=args.format,
+        dpi=args.dpi,
+        backend=args.backend,
+    )
+    targets = args.targets.split(",") if args.targets else None
+    for spec in targets or []:
+        try:
+            parse_target(spec, options)
+        except RenderError as e:
+            parser.error(f"--targets: {e}")
+    precompile = settings.get("precompiled_preamble", True)
+    tex_process.configure(tex_process.ProcessLimits.from_settings(settings))
+    configure_matplotlib(
+        settings.get("preamble", DEFAULT_PREAMBLE), precompile, args.lint
+    )
+    if precompile:
+        # 最初の変更を待つ間にフォーマットファイルを用意しておく
+        try:
+            prepare_format(options)
+        except FormatError:
+            pass  # TeX がない場合など（描画時に通常のコンパイルへフォールバック）
+    cache = None
+    if not args.no_cache:
+        cache = RenderCache(args.cache_dir, args.cache_max_mb * 1024**2)
+    watcher = Watcher(
+        args.sources,
+        args.output,
+        options,
+        targets=targets,
+        name_template=args.name_template,
+        cache=cache,
+        debounce=args.debounce,
+    )
+
+    failed = watcher.run_once()
+    if args.once:
+        return 1 if failed else 0
+    print("変更を監視しています（Ctrl+C で終了）", flush=True)
+    try:
+        watcher.watch(args.interval)
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+バックグラウンドのプレビューレンダラー
+最新のリクエストだけを別スレッドで描画し、古いリクエストは破棄する
+"""
+
+import queue
+import threading
+
+
+class PreviewWorker:
+    """最新のリクエストだけを処理するバックグラウンドレンダラー
+
+    結果は (世代番号, データ, 例外) として results キューに入る。
+    GUI 側は is_current() で古い結果を捨てる。
+    """
+
+    def __init__(self, render_func):
+        self._render = render_func
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._pending = None  # (世代番号, 引数) - 未着手のリクエストは常に 1 つだけ
+        self._busy = False  # 描画中かどうか
+        self._generation = 0
+        self._closed = False
+        self.results = queue.Queue()
+        self._thread = threading.Thread(
+            target=self._run, name="preview-worker", daemon=True
+        )
+        self._thread.start()
+
+    def submit(self, *args):
+        """レンダリングを依頼し、世代番号を返す（未着手の古い依頼は置き換える）"""
+        with self._lock:
+            self._generation += 1
+            self._pending = (self._generation, args)
+            self._wakeup.set()
+            return self._generation
+
+    def is_current(self, generation):
+        """最新の依頼の結果かどうか"""
+        with self._lock:
+            return generation == self._generation
+
+    def cancel(self):
+        """未着手の依頼を取り消し、描画中の結果を古いものとして扱う"""
+        with self._lock:
+            self._pending = None
+            self._generation += 1
+
+    def idle(self):
+        """未着手の依頼も描画中の依頼もないか"""
+        with self._lock:
+            return self._pending is None and not self._busy
+
+    def close(self):
+        """ワーカーを停止（処理中の描画は結果を捨てる）"""
+        with self._lock:
+            self._closed = True
+            self._pending = None
+            self._generation += 1
+            self._wakeup.set()
+
+    def _run(self):
+        while True:
+            self._wakeup.wait()
+            with self._lock:
+                if self._closed:
+                    return
+                job = self._pending
+                self._pending = None
+                self._busy = job is not None
+                self._wakeup.clear()
+            if job is None:
+                continue
+
+            generation, args = job
+            try:
+                # 着手前に新しい依頼が来ていれば描画しない
+                if not self.is_current(generation):
+                    continue
+                try:
+                    data = self._render(*args)
+                except Exception as e:
+                    self.results.put((generation, None, e))
+                else:
+                    self.results.put((generation, data, None))
+            finally:
+                with self._lock:
+                    self._busy = False
@@ -0,0 +1,411 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+レンダリング結果のディスクキャッシュ
+数式・オプション・プリアンブルのハッシュをキーに SVG/PNG/PDF のバイト列を保存し、
+サイズ上限を超えたら最も長く使われていないエントリから削除する（LRU）
+
+複数のエディタ・一括変換のワーカーが同じフォルダ（NFS のホームなど）を使っても
+安全なように、書き込みは一時ファイル経由で原子的に行い、キャッシュにない数式は
+エントリごとのロックファイルで排他制御する。同じ数式を同時に必要としたプロセスの
+うち 1 つだけが描画し、他のプロセスはその結果を待って使う（fetch）。
+"""
+
+import atexit
+import hashlib
+import json
+import os
+import re
+import socket
+import tempfile
+import threading
+import time
+import weakref
+from contextlib import contextmanager
+from pathlib import Path
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+DEFAULT_CACHE_DIR = Path.home() / ".cache" / "latex_editor" / "renders"
+DEFAULT_MAX_MB = 256
+
+# 他のプロセスの描画を待つ最大時間（秒、超えたら自分で描画する）
+LOCK_TIMEOUT = 120
+LOCK_POLL_SECONDS = 0.05
+# ヒット数などをファイルに書き出す間隔（秒）
+STATS_FLUSH_SECONDS = 5
+# ヒット数などを記録するフォルダ（プロセスごとに 1 ファイル）
+STATS_DIR = "stats"
+# hit: キャッシュにあった, miss: 描画した, wait: 他のプロセスの描画を待って使った
+STAT_NAMES = ["hit", "miss", "wait"]
+# prune でこれより古いプロセスごとのファイルを total.json にまとめる（秒）
+STATS_MERGE_SECONDS = 24 * 3600
+
+# 同じプロセスのスレッドどうしの排他制御（fcntl.lockf のロックはプロセス単位のため）
+_thread_locks = weakref.WeakValueDictionary()
+_thread_locks_guard = threading.Lock()
+# 終了時にヒット数などを書き出すキャッシュ
+_open_caches = weakref.WeakSet()
+
+# 同じ数式の出力が変わる修正をしたら上げる（古いエントリを使わないようにする）
+# 2: まとめたコンパイルで equation の番号をページごとに戻す
+KEY_VERSION = 2
+
+
+def normalize_equation(math_text):
+    """キャッシュキー用に数式を正規化（連続する空白は TeX 上同じ意味なので 1 つにまとめる）"""
+    return re.sub(r"\s+", " ", math_text).strip()
+
+
+def cache_key(math_text, options, preamble):
+    """数式・レンダリングオプション（描画方式を含む）・プリアンブルからキャッシュキーを生成"""
+    payload = json.dumps(
+        {
+            "version": KEY_VERSION,
+            "equation": normalize_equation(math_text),
+            "options": options.to_dict(),
+            "preamble": preamble,
+        },
+        sort_keys=True,
+        ensure_ascii=False,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _read_counts(path):
+    """統計ファイルの {"hit": ..., "miss": ..., "wait": ...}（読めなければ 0）"""
+    try:
+        counts = json.loads(Path(path).read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        counts = {}
+    return {name: int(counts.get(name, 0)) for name in STAT_NAMES}
+
+
+def _write_json(path, value):
+    fd, tmp = tempfile.mkstemp(dir=Path(path).parent, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(value, f)
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+        raise
+
+
+def _try_lock(fd):
+    if fcntl is not None:
+        # flock と違い、NFS でも lockd 経由でほかのマシンと排他制御できる
+        fcntl.lockf(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    else:
+        msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+
+
+def _unlock(fd):
+    if fcntl is not None:
+        fcntl.lockf(fd, fcntl.LOCK_UN)
+    else:
+        os.lseek(fd, 0, os.SEEK_SET)
+        msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+
+
+@contextmanager
+def file_lock(path, timeout=LOCK_TIMEOUT):
+    """ロックファイルで排他制御し、取得できたかを返す
+
+    他のプロセス・スレッドが持っている間は待ち、timeout 秒たっても取れなければ
+    False を返す（ロックに対応していないファイルシステムでもすぐに False）。
+    """
+    with _thread_locks_guard:
+        thread_lock = _thread_locks.setdefault(str(path), threading.Lock())
+    if not thread_lock.acquire(timeout=timeout):
+        yield False
+        return
+    try:
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o666)
+    except OSError:
+        thread_lock.release()
+        yield False
+        return
+    locked = False
+    deadline = time.monotonic() + timeout
+    try:
+        while True:
+            try:
+                _try_lock(fd)
+                locked = True
+                break
+            except (BlockingIOError, PermissionError):
+                # 他のプロセスが持っている
+                if time.monotonic() >= deadline:
+                    break
+                time.sleep(LOCK_POLL_SECONDS)
+            except OSError:
+                break  # ENOLCK など（ロックなしで続ける）
+        try:
+            yield locked
+        finally:
+            if locked:
+                _unlock(fd)
+    finally:
+        os.close(fd)
+        thread_lock.release()
+
+
+class RenderCache:
+    """内容アドレス方式のレンダリングキャッシュ（LRU 削除、複数プロセスで共有可）"""
+
+    def __init__(self, directory=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_MB * 1024**2):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._size = None  # 合計サイズ（初回の書き込み時に計算）
+        # このプロセスのヒット数など（STATS_DIR に書き出す）
+        self._counts = dict.fromkeys(STAT_NAMES, 0)
+        self._written = None  # 最後に書き出した値
+        self._counts_lock = threading.Lock()
+        self._flushed = time.monotonic()
+        self._stats_file = self.directory / STATS_DIR / (
+            f"{socket.gethostname()}-{os.getpid()}-{id(self):x}.json"
+        )
+        _open_caches.add(self)
+
+    def _path(self, key, fmt):
+        return self.directory / key[:2] / f"{key}.{fmt}"
+
+    def get(self, key, fmt):
+        """キャッシュからバイト列を取得（なければ None）"""
+        path = self._path(key, fmt)
+        try:
+            data = path.read_bytes()
+        except OSError:
+            return None
+        # 最終使用時刻を更新（LRU 判定は mtime を使用）
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return data
+
+    def contains(self, key, fmt):
+        """キャッシュにあるか（読み込まず、ヒット数にも数えない）"""
+        return self._path(key, fmt).exists()
+
+    def fetch(self, key, fmt, render):
+        """キャッシュから取得し、なければ render() で描画して保存する
+
+        (バイト列, "hit" / "miss" / "wait") を返す。同じエントリを描画中のプロセスが
+        あれば、その完了を待って結果を使う（"wait"）。
+        """
+        data = self.get(key, fmt)
+        if data is not None:
+            return data, self._count("hit")
+        path = self._path(key, fmt)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        lock_path = path.with_name(path.name + ".lock")
+        with file_lock(lock_path):
+            # 待っている間に他のプロセスが保存していればそれを使う
+            data = self.get(key, fmt)
+            if data is not None:
+                return data, self._count("wait")
+            data = render()
+            self.put(key, fmt, data)
+            # エントリを公開したらロックファイルは不要（あとからロックを取った
+            # プロセスも、古いファイルで待っていたプロセスもエントリを見つける）
+            try:
+                lock_path.unlink()
+            except OSError:
+                pass  # Windows では開いているファイルを削除できない（prune で削除）
+        return data, self._count("miss")
+
+    def put(self, key, fmt, data):
+        """バイト列をキャッシュに保存（一時ファイル経由で原子的に書き込み）"""
+        path = self._path(key, fmt)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        try:
+            old_size = path.stat().st_size  # 上書きする場合はその分を差し引く
+        except OSError:
+            old_size = 0
+        fd, tmp = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp, path)
+        except BaseException:
+            try:
+                os.unlink(tmp)
+            except OSError:
+                pass
+            raise
+
+        if self._size is None:
+            self._size = self.total_size()
+        else:
+            self._size += len(data) - old_size
+        if self._size > self.max_bytes:
+            self.evict()
+
+    def _count(self, name):
+        with self._counts_lock:
+            self._counts[name] += 1
+            flush = time.monotonic() - self._flushed >= STATS_FLUSH_SECONDS
+        if flush:
+            self.flush_stats()
+        return name
+
+    def flush_stats(self):
+        """このプロセスのヒット数などを STATS_DIR に書き出す"""
+        with self._counts_lock:
+            self._flushed = time.monotonic()
+            if self._written is not None and not self._stats_file.exists():
+                # prune が total.json にまとめたので、その分を差し引く
+                for name in STAT_NAMES:
+                    self._counts[name] -= self._written[name]
+            counts = dict(self._counts)
+            if not any(counts.values()) or counts == self._written:
+                return
+            try:
+                self._stats_file.parent.mkdir(exist_ok=True)
+                _write_json(self._stats_file, counts)
+            except OSError:
+                return  # 統計の書き出しに失敗しても描画には影響させない
+            self._written = counts
+
+    def entries(self):
+        """(mtime, サイズ, パス) のリスト"""
+        entries = []
+        for path in self.directory.glob("??/*"):
+            if path.suffix in (".tmp", ".lock"):
+                continue
+            try:
+                st = path.stat()
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, path))
+        return entries
+
+    def total_size(self):
+        """キャッシュの合計サイズ（バイト）"""
+        return sum(size for _, size, _ in self.entries())
+
+    def evict(self):
+        """サイズ上限を下回るまで古いエントリから削除し、(件数, バイト数) を返す"""
+        removed = removed_bytes = 0
+        # 複数のプロセスが同時に上限を超えても、削除は 1 つのプロセスだけが行う
+        with file_lock(self.directory / "evict.lock", timeout=0) as locked:
+            if not locked:
+                return removed, removed_bytes
+            entries = sorted(self.entries())
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in entries:
+                if total <= self.max_bytes:
+                    break
+                try:
+                    path.unlink()
+                except OSError:
+                    continue
+                total -= size
+                removed += 1
+                removed_bytes += size
+            self._size = total
+        return removed, removed_bytes
+
+    def prune(self, max_age=None, stale_seconds=LOCK_TIMEOUT * 2):
+        """max_age 秒以上使われていないエントリを削除し、上限サイズまで減らす
+
+        中断で残った一時ファイルと古いロックファイルも削除する。
+        (削除したエントリ数, 削除したバイト数) を返す。
+        """
+        now = time.time()
+        removed = removed_bytes = 0
+        for mtime, size, path in self.entries():
+            if max_age is not None and now - mtime > max_age:
+                try:
+                    path.unlink()
+                except OSError:
+                    continue
+                removed += 1
+                removed_bytes += size
+        evicted, evicted_bytes = self.evict()
+        for path in self.directory.glob("??/*"):
+            if path.suffix not in (".tmp", ".lock"):
+                continue
+            try:
+                if now - path.stat().st_mtime > stale_seconds:
+                    path.unlink()
+            except OSError:
+                pass
+        self._merge_stats()
+        return removed + evicted, removed_bytes + evicted_bytes
+
+    def _merge_stats(self):
+        """終了したプロセスの古い統計ファイルを total.json にまとめる"""
+        stats_dir = self.directory / STATS_DIR
+        if not stats_dir.is_dir():
+            return
+        with file_lock(stats_dir / "total.lock") as locked:
+            if not locked:
+                return
+            total_file = stats_dir / "total.json"
+            totals = _read_counts(total_file)
+            now = time.time()
+            merged = []
+            for path in stats_dir.glob("*.json"):
+                try:
+                    old = now - path.stat().st_mtime > STATS_MERGE_SECONDS
+                except OSError:
+                    continue
+                if path == total_file or not old:
+                    continue
+                for name, value in _read_counts(path).items():
+                    totals[name] += value
+                merged.append(path)
+            if not merged:
+                return
+            _write_json(total_file, totals)
+            for path in merged:
+                try:
+                    path.unlink()
+                except OSError:
+                    pass
+
+    def read_stats(self):
+        """全プロセスの合計のヒット数など（{"hit": ..., "miss": ..., "wait": ...}）"""
+        self.flush_stats()
+        totals = dict.fromkeys(STAT_NAMES, 0)
+        for path in (self.directory / STATS_DIR).glob("*.json"):
+            for name, value in _read_counts(path).items():
+                totals[name] += value
+        return totals
+
+    def reset_stats(self):
+        """記録したヒット数などを削除"""
+        with self._counts_lock:
+            self._counts = dict.fromkeys(STAT_NAMES, 0)
+            self._written = None
+        for path in (self.directory / STATS_DIR).glob("*"):
+            try:
+                path.unlink()
+            except OSError:
+                pass
+
+    def clear(self):
+        """キャッシュを全削除"""
+        for _, _, path in self.entries():
+            try:
+                path.unlink()
+            except OSError:
+                pass
+        self._size = 0
+
+
+@atexit.register
+def _flush_open_caches():
+    for cache in list(_open_caches):
+        cache.flush_stats()
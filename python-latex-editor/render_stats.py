@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+レンダリングの計測
+処理の段階（正規化・TeX のコンパイル・ラスタライズ・savefig など）ごとの所要時間と
+キャッシュのヒット／ミスを記録し、直近の p50/p95 を集計する。
+log_file を指定すると 1 行 1 JSON で追記する。
+"""
+
+import functools
+import json
+import os
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+
+# 段階ごとに保持する直近の記録数
+DEFAULT_WINDOW = 200
+
+
+def percentile(values, p):
+    """最近傍順位法によるパーセンタイル（values は昇順）"""
+    if not values:
+        return None
+    rank = max(1, -(-len(values) * p // 100))  # ceil(n * p / 100)
+    return values[int(rank) - 1]
+
+
+class RenderStats:
+    """段階ごとの所要時間とカウンタ（スレッドセーフ）"""
+
+    def __init__(self, window=DEFAULT_WINDOW, log_file=None):
+        self.window = window
+        self._lock = threading.Lock()
+        self._durations = defaultdict(lambda: deque(maxlen=self.window))
+        self._counters = defaultdict(int)
+        self._log = None
+        self.set_log_file(log_file)
+
+    def set_log_file(self, log_file):
+        """JSON-lines ログの出力先を設定（None で無効）"""
+        with self._lock:
+            if self._log is not None:
+                self._log.close()
+                self._log = None
+            if log_file:
+                try:
+                    self._log = open(log_file, "a", encoding="utf-8")
+                except OSError as e:
+                    print(f"計測ログを開けませんでした: {e}")
+
+    def _write(self, record):
+        # _lock を取った状態で呼ぶ
+        if self._log is None:
+            return
+        record.update(
+            ts=time.time(), pid=os.getpid(), thread=threading.current_thread().name
+        )
+        try:
+            self._log.write(json.dumps(record, ensure_ascii=False) + "\n")
+            self._log.flush()
+        except (OSError, ValueError) as e:
+            print(f"計測ログを書き込めませんでした: {e}")
+            self._log = None
+
+    def record(self, stage, ms, **fields):
+        """段階の所要時間 (ms) を記録"""
+        with self._lock:
+            self._durations[stage].append(ms)
+            self._write({"stage": stage, "ms": round(ms, 3), **fields})
+
+    def count(self, name, **fields):
+        """カウンタ（キャッシュのヒットなど）を 1 増やす"""
+        with self._lock:
+            self._counters[name] += 1
+            self._write({"event": name, **fields})
+
+    @contextmanager
+    def stage(self, name, **fields):
+        """with ブロックの所要時間を name の段階として記録（例外時も記録）"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, (time.perf_counter() - start) * 1000, **fields)
+
+    def timed(self, name):
+        """関数の所要時間を name の段階として記録するデコレータ"""
+
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.stage(name):
+                    return func(*args, **kwargs)
+
+            return wrapper
+
+        return decorator
+
+    def summary(self):
+        """{"stages": {段階: {n, p50, p95, last}}, "counters": {名前: 回数}}"""
+        with self._lock:
+            durations = {k: list(v) for k, v in self._durations.items() if v}
+            counters = dict(self._counters)
+        stages = {}
+        for name, values in durations.items():
+            ordered = sorted(values)
+            stages[name] = {
+                "n": len(values),
+                "p50": percentile(ordered, 50),
+                "p95": percentile(ordered, 95),
+                "last": values[-1],
+            }
+        return {"stages": stages, "counters": counters}
+
+    def reset(self):
+        """記録を消去"""
+        with self._lock:
+            self._durations.clear()
+            self._counters.clear()
+
+
+# アプリ全体で共有する計測器
+stats = RenderStats()
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+先読みレンダラー
+プレビューが空いている間に、次に表示しそうな数式・オプション（サンプル数式、
+隣のフォントサイズ、displaystyle の切り替えなど）を 1 つずつ先に描画しておく。
+結果はメモリの上限付きで保持し、古いものから捨てる。
+"""
+
+import threading
+import time
+from collections import OrderedDict, deque
+from dataclasses import astuple
+
+from render_stats import stats
+
+# 先読みした結果に使うメモリの上限
+DEFAULT_BUDGET_MB = 32
+# プレビューの描画中に、空くのを確認する間隔（秒）
+IDLE_POLL_SECONDS = 0.05
+
+
+def result_size(result):
+    """render_preview の結果 (PNG, RenderArtifact または None) のおおよそのバイト数"""
+    data, artifact = result
+    size = len(data)
+    if artifact is not None:
+        # DVI と、変換済みとして RenderArtifact が保持する PNG
+        size += len(artifact.dvi) + len(data)
+    return size
+
+
+class SpeculativeRenderer:
+    """アイドル時に候補を 1 つずつ描画し、メモリ上限付きの LRU に保持する
+
+    render_func(数式, オプション) の結果を (数式, オプション) ごとに保持する。
+    is_idle() が False の間（プレビューの描画中）は描画を始めない。
+    """
+
+    def __init__(
+        self, render_func, is_idle, budget_bytes=DEFAULT_BUDGET_MB * 1024**2
+    ):
+        self._render = render_func
+        self._is_idle = is_idle
+        self.budget_bytes = budget_bytes
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._candidates = deque()  # 未着手の (キー, 数式, オプション)
+        self._results = OrderedDict()  # キー -> (結果, バイト数)
+        self._size = 0
+        self._generation = 0  # clear で増やし、描画中の古い結果を捨てる
+        self._closed = False
+        self._thread = threading.Thread(
+            target=self._run, name="speculative-renderer", daemon=True
+        )
+        self._thread.start()
+
+    @staticmethod
+    def key(equation, options):
+        return equation, astuple(options)
+
+    def set_candidates(self, candidates):
+        """先読みする (数式, オプション) を優先順に指定（未着手の候補は置き換える）"""
+        with self._lock:
+            self._candidates = deque(
+                (self.key(eq, opts), eq, opts)
+                for eq, opts in candidates
+                if self.key(eq, opts) not in self._results
+            )
+            if self._candidates:
+                self._wakeup.set()
+
+    def get(self, equation, options):
+        """先読み済みの結果を返す（なければ None）"""
+        key = self.key(equation, options)
+        with self._lock:
+            entry = self._results.get(key)
+            if entry is None:
+                return None
+            self._results.move_to_end(key)
+        stats.count("speculative_hit")
+        return entry[0]
+
+    def clear(self):
+        """候補と先読み済みの結果をすべて捨てる（入力が変わったとき）"""
+        with self._lock:
+            self._generation += 1
+            self._candidates.clear()
+            self._results.clear()
+            self._size = 0
+
+    def close(self):
+        """ワーカーを停止"""
+        with self._lock:
+            self._closed = True
+            self._candidates.clear()
+            self._wakeup.set()
+
+    def _store(self, key, result):
+        # _lock を取った状態で呼ぶ
+        size = result_size(result)
+        if size > self.budget_bytes:
+            return
+        self._results[key] = (result, size)
+        self._size += size
+        while self._size > self.budget_bytes:
+            _, (_, evicted) = self._results.popitem(last=False)
+            self._size -= evicted
+            stats.count("speculative_evict")
+
+    def _run(self):
+        while True:
+            self._wakeup.wait()
+            # プレビューの描画を邪魔しないよう、空くまで待つ
+            while not self._closed and not self._is_idle():
+                time.sleep(IDLE_POLL_SECONDS)
+            with self._lock:
+                if self._closed:
+                    return
+                if not self._candidates:
+                    self._wakeup.clear()
+                    continue
+                key, equation, options = self._candidates.popleft()
+                generation = self._generation
+                if key in self._results:
+                    continue
+            try:
+                result = self._render(equation, options)
+            except Exception:
+                continue  # 先読みの失敗は無視（表示するときに描画し直す）
+            with self._lock:
+                if generation == self._generation:
+                    self._store(key, result)
@@ -0,0 +1,259 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+SVG の縮小とグリフの共有
+dvisvgm / matplotlib が出力した SVG から、メタデータや使われていない定義を取り除き、
+座標を指定した桁数に丸める（minify）。sprite ではさらにグリフのパスを共有ファイル
+（glyphs.svg）に移し、各 SVG からは <use href="glyphs.svg#..."> で参照する。
+
+グリフの id はパスの内容のハッシュなので、別々のファイル・プロセスで処理しても
+同じグリフは同じ id になる（ページに複数の SVG を埋め込んでも衝突しない）。
+"""
+
+import hashlib
+import re
+import xml.etree.ElementTree as ET
+from pathlib import Path
+
+SVG_MODES = ["standalone", "minify", "sprite"]
+# 座標の小数点以下の桁数
+DEFAULT_PRECISION = 3
+DEFAULT_SPRITE_FILE = "glyphs.svg"
+
+SVG_NS = "http://www.w3.org/2000/svg"
+XLINK_NS = "http://www.w3.org/1999/xlink"
+ET.register_namespace("", SVG_NS)
+ET.register_namespace("xlink", XLINK_NS)
+
+_HREFS = ["href", f"{{{XLINK_NS}}}href"]
+# 座標として丸める属性（transform は拡大率を含むので有効数字で丸める）
+_COORDINATE_ATTRIBUTES = [
+    "d",
+    "x",
+    "y",
+    "x1",
+    "y1",
+    "x2",
+    "y2",
+    "cx",
+    "cy",
+    "r",
+    "rx",
+    "ry",
+    "width",
+    "height",
+    "viewBox",
+    "points",
+    "stroke-width",
+]
+# 描画に影響しない属性
+_REDUNDANT_ATTRIBUTES = ["version", "baseProfile"]
+_NUMBER = re.compile(r"[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?")
+_URL_REFERENCE = re.compile(r"url\(#([^)]+)\)")
+
+
+def _tag(element):
+    return element.tag.rsplit("}", 1)[-1]
+
+
+def format_number(value, precision):
+    """小数点以下 precision 桁に丸め、不要な 0 を省いた文字列"""
+    text = f"{value:.{precision}f}"
+    if precision:
+        text = text.rstrip("0").rstrip(".")
+    if text in ("-0", ""):
+        return "0"
+    if text.startswith("0."):
+        return text[1:]
+    if text.startswith("-0."):
+        return "-" + text[2:]
+    return text
+
+
+def round_numbers(text, precision, significant=False):
+    """文字列中の数値を丸める（significant なら有効数字 precision 桁）"""
+
+    def replace(match):
+        value = float(match.group())
+        if significant and value:
+            digits = f"{value:.{precision}g}"
+            return format_number(float(digits), max(precision, 1) + 6)
+        return format_number(value, precision)
+
+    return _NUMBER.sub(replace, text)
+
+
+def minify_path(d, precision):
+    """パスのデータの数値を丸め、コマンドの前後と区切りの空白を詰める"""
+    d = round_numbers(d, precision)
+    parts = []
+    previous = None  # 直前の数値（コマンドの後は None）
+    for token in re.findall(f"[A-Za-z]|{_NUMBER.pattern}", d):
+        if token[0].isalpha():
+            previous = None
+        else:
+            # 負の数の前と、小数点を含む数の後の .5 のような数の前は空白が不要
+            # （1 .5 を 1.5 と詰めると 1 つの数になる）
+            if previous is not None and not (
+                token[0] == "-" or (token[0] == "." and "." in previous)
+            ):
+                parts.append(" ")
+            previous = token
+        parts.append(token)
+    return "".join(parts)
+
+
+def _references(root):
+    """<use> などから参照されている id の集合"""
+    referenced = set()
+    for element in root.iter():
+        for name, value in element.attrib.items():
+            if name in _HREFS and value.startswith("#"):
+                referenced.add(value[1:])
+            else:
+                referenced.update(_URL_REFERENCE.findall(value))
+    return referenced
+
+
+def _canonical(element):
+    """id を除いた要素の内容（グリフの同一判定とハッシュに使う）"""
+    attributes = sorted((k, v) for k, v in element.attrib.items() if k != "id")
+    children = "".join(_canonical(child) for child in element)
+    return f"<{_tag(element)} {attributes}>{children}</>"
+
+
+def glyph_id(element):
+    """グリフの内容から決まる id"""
+    digest = hashlib.sha1(_canonical(element).encode("utf-8")).hexdigest()
+    return "g" + digest[:10]
+
+
+def _round_attributes(root, precision):
+    for element in root.iter():
+        for name, value in list(element.attrib.items()):
+            if name == "d":
+                element.set(name, minify_path(value, precision))
+            elif name in _COORDINATE_ATTRIBUTES:
+                element.set(name, round_numbers(value, precision))
+            elif name == "transform":
+                element.set(name, round_numbers(value, precision + 3, significant=True))
+
+
+def _strip(root):
+    """メタデータ・空白・描画に影響しない属性を削除"""
+    for parent in list(root.iter()):
+        for child in list(parent):
+            if _tag(child) in ("metadata", "title", "desc"):
+                parent.remove(child)
+    for element in root.iter():
+        for name in _REDUNDANT_ATTRIBUTES:
+            element.attrib.pop(name, None)
+        if element.text is not None and not element.text.strip():
+            element.text = None
+        if element.tail is not None and not element.tail.strip():
+            element.tail = None
+
+
+def _rename_glyphs(root, sprite_href):
+    """参照されているグリフを内容のハッシュの id にし、sprite_href があれば取り出す
+
+    (id -> グリフの要素) を返す（sprite_href が None なら空）。
+    """
+    referenced = _references(root)
+    renamed = {}
+    glyphs = {}
+    for defs in [e for e in root.iter() if _tag(e) == "defs"]:
+        for child in list(defs):
+            old_id = child.get("id")
+            if old_id is None:
+                continue
+            if old_id not in referenced:
+                defs.remove(child)  # 使われていない定義
+                continue
+            if _tag(child) != "path":
+                continue
+            new_id = glyph_id(child)
+            renamed[old_id] = new_id
+            child.set("id", new_id)
+            if sprite_href is not None:
+                defs.remove(child)
+                glyphs[new_id] = child
+
+    kept = set(renamed.values())
+    for element in root.iter():
+        for name in _HREFS:
+            value = element.get(name)
+            if value is None or not value.startswith("#"):
+                continue
+            new_id = renamed.get(value[1:])
+            if new_id is None:
+                continue
+            if sprite_href is not None:
+                element.set(name, f"{sprite_href}#{new_id}")
+            else:
+                element.set(name, f"#{new_id}")
+        # 参照されていない要素の id は不要
+        element_id = element.get("id")
+        if element_id is not None and element_id not in referenced | kept:
+            del element.attrib["id"]
+
+    # 空になった <defs> を削除
+    for parent in list(root.iter()):
+        for child in list(parent):
+            if _tag(child) == "defs" and len(child) == 0:
+                parent.remove(child)
+    return glyphs
+
+
+def optimize(data, precision=DEFAULT_PRECISION, sprite_href=None):
+    """SVG を縮小し、(バイト列, id -> グリフの要素) を返す
+
+    sprite_href（例: glyphs.svg）を指定するとグリフを取り出して参照に置き換える。
+    取り出したグリフは write_sprite で共有ファイルに書き出す。
+    """
+    root = ET.fromstring(data)
+    _strip(root)
+    _round_attributes(root, precision)
+    glyphs = _rename_glyphs(root, sprite_href)
+    return _serialize(root), glyphs
+
+
+def _serialize(root):
+    # ElementTree は空要素を "<path ... />" と書くので、空白も詰める
+    return ET.tostring(root, encoding="utf-8", xml_declaration=False).replace(
+        b" />", b"/>"
+    )
+
+
+def read_sprite(path):
+    """共有ファイルのグリフ（id -> 要素）を読み込む（なければ空）"""
+    try:
+        root = ET.parse(path).getroot()
+    except (OSError, ET.ParseError):
+        return {}
+    return {
+        e.get("id"): e
+        for e in root.iter()
+        if _tag(e) == "path" and e.get("id") is not None
+    }
+
+
+def sprite_bytes(glyphs):
+    """グリフの共有ファイルの内容（id 順に並べるので同じグリフなら同じ内容）"""
+    root = ET.Element(f"{{{SVG_NS}}}svg")
+    defs = ET.SubElement(root, f"{{{SVG_NS}}}defs")
+    for key in sorted(glyphs):
+        element = glyphs[key]
+        element.tail = None
+        defs.append(element)
+    return _serialize(root)
+
+
+def write_sprite(path, glyphs):
+    """グリフを共有ファイルに書き出す（既にあるグリフと合わせる）"""
+    from latex_render import write_atomic
+
+    merged = read_sprite(path)
+    merged.update(glyphs)
+    write_atomic(Path(path), sprite_bytes(merged))
+    return len(merged)
@@ -0,0 +1,63 @@
+import itertools
+
+import pytest
+
+import equation_history
+from equation_history import HistoryStore
+from latex_render import RenderOptions
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    # 記録した順に last_used が増えるようにする（同じ時刻だと順番が決まらない）
+    clock = itertools.count(1000)
+    monkeypatch.setattr(equation_history.time, "time", lambda: float(next(clock)))
+    store = HistoryStore(tmp_path / "history.db", max_entries=2)
+    yield store
+    store.close()
+
+
+def _record(store, *equations):
+    return [store.record(eq, RenderOptions()) for eq in equations]
+
+
+def _equations(store, ids):
+    rows = store.rows(ids)
+    return [rows[i]["equation"] for i in ids]
+
+
+def test_prefix_search_uses_equation_start(store):
+    _record(store, r"\frac{a}{b}", r"\int_0^1 f", r"\frac{1}{2}", r"x \frac{c}{d}")
+    assert _equations(store, store.search(r"\frac", "prefix")) == [
+        r"\frac{1}{2}",
+        r"\frac{a}{b}",
+    ]
+    assert store.search(r"\FRAC", "prefix") == []  # 大文字・小文字を区別する
+    assert len(store.search("", "prefix")) == 4
+
+
+@pytest.mark.parametrize("tokenizer", ["fts", None])
+def test_text_search_matches_all_terms(store, tokenizer):
+    if tokenizer == "fts" and store.tokenizer is None:
+        pytest.skip("FTS5 がない")
+    if tokenizer is None:
+        store.tokenizer = None  # FTS5 のない環境と同じく LIKE で探す
+    _record(store, r"\sum_{n=1}^\infty a_n", r"\int_0^1 f", r"x \frac{c}{d} + \sum c")
+    assert _equations(store, store.search(r"\sum", "text")) == [
+        r"x \frac{c}{d} + \sum c",
+        r"\sum_{n=1}^\infty a_n",
+    ]
+    assert _equations(store, store.search(r"FRAC \SUM", "text")) == [
+        r"x \frac{c}{d} + \sum c"
+    ]
+    # trigram で探せない短い語も見つける
+    assert _equations(store, store.search("a_", "text")) == [r"\sum_{n=1}^\infty a_n"]
+
+
+def test_prune_keeps_pinned_entries(store):
+    oldest = _record(store, "a", "b", "c", "d")[0]
+    store.set_pinned(oldest)
+    assert store.prune() == 1
+    assert sorted(_equations(store, store.search())) == ["a", "c", "d"]
+    assert store.search(pinned_only=True) == [oldest]
+    assert store.search()[0] == oldest  # お気に入りが先頭
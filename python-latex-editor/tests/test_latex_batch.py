@@ -0,0 +1,69 @@
+import pytest
+
+import latex_batch
+import tex_engine
+from latex_render import RenderError, RenderOptions
+from render_cache import RenderCache
+
+
+def test_render_group_uses_cache(monkeypatch, tmp_path):
+    compiled = []
+
+    def fake_render_group_targets(equations, targets, preamble, precompile=True):
+        compiled.append(list(equations))
+        return [
+            RenderError("bad") if e == "bad" else [e.encode() for _ in targets]
+            for e in equations
+        ]
+
+    monkeypatch.setattr(tex_engine, "render_group_targets", fake_render_group_targets)
+    cache = RenderCache(tmp_path / "cache")
+    monkeypatch.setattr(latex_batch, "_cache", cache)
+    export = (tmp_path / "out", ["png"], "{name}{suffix}.{format}")
+    (tmp_path / "out").mkdir()
+    items = [(0, "a", "a"), (1, "bad", "bad"), (2, "c", "c")]
+
+    results = latex_batch._render_group(items, RenderOptions(), export)
+    assert [ok for _, ok, _ in sorted(results)] == [True, False, True]
+    assert compiled == [["a", "bad", "c"]]  # 1 回のコンパイル
+    assert (tmp_path / "out" / "c.png").read_bytes() == b"c"
+    assert cache._counts["miss"] == 2
+
+    # 2 回目はキャッシュにない数式だけをコンパイルする
+    results = latex_batch._render_group(items, RenderOptions(), export)
+    assert [ok for _, ok, _ in sorted(results)] == [True, False, True]
+    assert compiled[1:] == [["bad"]]
+    assert cache._counts["hit"] == 2
+    assert not list((tmp_path / "out").glob(".*"))  # 一時ファイルが残らない
+
+
+def test_main_rejects_bad_targets(tmp_path, capsys):
+    (tmp_path / "eq.txt").write_text("x\n", encoding="utf-8")
+    argv = [str(tmp_path / "eq.txt"), "-o", str(tmp_path / "out")]
+    with pytest.raises(SystemExit) as e:
+        latex_batch.main(argv + ["--group-size", "4", "--targets", "svg,jpg"])
+    assert e.value.code == 2
+    assert "jpg" in capsys.readouterr().err
+
+
+def test_main_rejects_group_size_with_manifest(tmp_path, capsys):
+    (tmp_path / "eq.jsonl").write_text('{"id": "a", "equation": "x"}\n')
+    with pytest.raises(SystemExit):
+        latex_batch.main([str(tmp_path / "eq.jsonl"), "--group-size", "4"])
+    assert "--group-size" in capsys.readouterr().err
+
+
+def test_completed_results_skips_non_objects(tmp_path):
+    results = tmp_path / "results.jsonl"
+    results.write_text('{"id": "a"}\n[1]\n{"id": "b"}\n{"id": "c"', encoding="utf-8")
+    assert latex_batch.completed_results(results) == (2, "b")
+    assert results.read_text(encoding="utf-8").endswith('{"id": "b"}\n')
+
+
+def test_output_name_avoids_collisions():
+    used = set()
+    names = [
+        latex_batch.output_name(item_id, line, used)
+        for line, item_id in enumerate(["a b", "a_b", "a/b", "c"], 1)
+    ]
+    assert names == ["a_b", "a_b_2", "a_b_3", "c"]
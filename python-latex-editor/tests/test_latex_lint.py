@@ -0,0 +1,51 @@
+import pytest
+
+from latex_lint import lint
+
+PREAMBLE = r"\usepackage{amsmath}"
+
+
+@pytest.mark.parametrize(
+    "equation",
+    [
+        r"\left\lgroup x \right\rgroup",
+        r"\left\lmoustache x \right\rmoustache",
+        r"\left\arrowvert x \right\Arrowvert",
+        r"\left\bracevert x \right.",
+    ],
+)
+def test_extensible_delimiters(equation):
+    assert lint(equation, PREAMBLE) == []
+
+
+def test_ampersand_severity():
+    def severities(equation, preamble=PREAMBLE):
+        return [i.severity for i in lint(equation, preamble) if "&" in i.message]
+
+    assert severities(r"\begin{pmatrix} a & b \end{pmatrix}") == []
+    assert severities(r"a & b") == ["error"]
+    assert severities(r"\begin{gather} a & b \end{gather}") == ["error"]
+    # & を使えるか分からない環境では描画を止めない
+    assert severities(r"\begin{CD} A @>>> B & C \end{CD}") == ["warning"]
+    preamble = PREAMBLE + r"\newenvironment{mytable}{\begin{array}{cc}}{\end{array}}"
+    assert severities(r"\begin{mytable} a & b \end{mytable}", preamble) == ["warning"]
+
+
+@pytest.mark.parametrize(
+    "equation, preamble",
+    [
+        (r"\left\llbracket x \right\rrbracket", r"\usepackage{stmaryrd}"),
+        (r"\left\lparen x \right\rparen", r"\usepackage{mathtools}"),
+        # 内容のわからないパッケージの区切り記号
+        (r"\left\lBrack x \right\rBrack", r"\usepackage{unknownpkg}"),
+        (r"\left\open x \right)", PREAMBLE + r"\newcommand{\open}{(}"),
+    ],
+)
+def test_package_delimiters_do_not_block(equation, preamble):
+    assert [i for i in lint(equation, preamble) if i.severity == "error"] == []
+
+
+def test_unknown_delimiter_is_warning():
+    issues = lint(r"\left\alpha x \right)", PREAMBLE)
+    assert [i.severity for i in issues] == ["warning"]
+    assert [i.severity for i in lint(r"\left x \right)", PREAMBLE)] == ["error"]
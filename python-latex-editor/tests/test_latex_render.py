@@ -0,0 +1,36 @@
+import pytest
+
+import latex_render
+import tex_engine
+from latex_render import RenderOptions, artifact_matches, compile_artifact
+
+
+@pytest.fixture
+def compiles(monkeypatch):
+    """TeX を実行せずに、コンパイルしたフォントサイズを記録する"""
+    sizes = []
+
+    def fake_compile(equation, options, preamble, precompile=True):
+        sizes.append(options.fontsize)
+        math_text = latex_render.build_math_text(equation, options.displaystyle)
+        return tex_engine.RenderArtifact(math_text, options.fontsize, preamble, b"")
+
+    monkeypatch.setattr(tex_engine, "compile_artifact", fake_compile)
+    monkeypatch.setattr(latex_render, "_artifacts", type(latex_render._artifacts)())
+    return sizes
+
+
+def test_scaled_artifact_is_preview_only(compiles):
+    equation = r"\begin{pmatrix} a & b \end{pmatrix}"
+    assert tex_engine.optical_sizes(40) == tex_engine.optical_sizes(48)
+    preview = compile_artifact(equation, RenderOptions(fontsize=40), preview=True)
+    # プレビューは拡大縮小で済ませる
+    scaled = compile_artifact(equation, RenderOptions(fontsize=48), preview=True)
+    assert scaled is preview
+    assert compiles == [40]
+    # 保存にはそのフォントサイズでコンパイルし直した結果を使う
+    assert not artifact_matches(preview, equation, RenderOptions(fontsize=48))
+    saved = compile_artifact(equation, RenderOptions(fontsize=48))
+    assert saved.fontsize == 48
+    assert compiles == [40, 48]
+    assert compile_artifact(equation, RenderOptions(fontsize=48), preview=True) is saved
@@ -0,0 +1,122 @@
+import asyncio
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import latex_server
+from latex_render import RenderOptions
+from latex_server import MAX_BODY_BYTES, MAX_EQUATION_CHARS, HTTPError, RenderServer
+
+
+def _headers(response):
+    head = response.split(b"\r\n\r\n", 1)[0].decode("latin-1")
+    return dict(
+        line.split(": ", 1) for line in head.split("\r\n")[1:] if ": " in line
+    )
+
+
+@pytest.mark.parametrize(
+    "host", ["localhost", "localhost:8765", "127.0.0.1:8765", "[::1]:8765"]
+)
+def test_local_hosts_are_accepted(host):
+    RenderServer().check_host({"host": host})
+
+
+@pytest.mark.parametrize("host", ["", "evil.example", "evil.example:8765"])
+def test_other_hosts_are_rejected(host):
+    # DNS リバインディングで 127.0.0.1 を指すようにした名前など
+    with pytest.raises(HTTPError) as info:
+        RenderServer().check_host({"host": host} if host else {})
+    assert info.value.status == 403
+
+
+def test_cors_only_for_allowed_origins():
+    response = RenderServer()._response(200, None, b"", False, "https://evil.example")
+    assert "Access-Control-Allow-Origin" not in _headers(response)
+
+    server = RenderServer(allow_origins=["http://localhost:8000"])
+    headers = _headers(server._response(200, None, b"", False, "http://localhost:8000"))
+    assert headers["Access-Control-Allow-Origin"] == "http://localhost:8000"
+    headers = _headers(server._response(200, None, b"", False, "https://evil.example"))
+    assert "Access-Control-Allow-Origin" not in headers
+
+
+def test_identical_requests_are_coalesced(monkeypatch):
+    calls = []
+    release = threading.Event()
+
+    def fake_render(equation, options):
+        calls.append(equation)
+        release.wait(5)
+        return equation.encode()
+
+    monkeypatch.setattr(latex_server, "_render", fake_render)
+    server = RenderServer()
+    server._pool = ThreadPoolExecutor(max_workers=2)
+
+    async def scenario():
+        first = asyncio.ensure_future(server.render("x^2", RenderOptions()))
+        second = asyncio.ensure_future(server.render("x^2 ", RenderOptions()))
+        other = asyncio.ensure_future(server.render("y", RenderOptions()))
+        await asyncio.sleep(0.1)
+        assert server.health()["inflight"] == 2
+        release.set()
+        return await asyncio.gather(first, second, other)
+
+    try:
+        assert asyncio.run(scenario()) == [b"x^2", b"x^2", b"y"]
+    finally:
+        server._pool.shutdown()
+    # 空白だけが違う数式は同じキャッシュキーなので 1 回だけ描画する
+    assert sorted(calls) == ["x^2", "y"]
+    assert server._inflight == {}
+
+
+async def _exchange(server, request):
+    """サーバーを起動して 1 つの要求を送り、(status, JSON, 接続が閉じたか) を返す"""
+    listener = await asyncio.start_server(server.handle_connection, "127.0.0.1", 0)
+    port = listener.sockets[0].getsockname()[1]
+    try:
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        writer.write(request)
+        await writer.drain()
+        head = await reader.readuntil(b"\r\n\r\n")
+        length = int(_headers(head)["Content-Length"])
+        body = await reader.readexactly(length)
+        closed = await asyncio.wait_for(reader.read(1), 5) == b""
+        writer.close()
+    finally:
+        listener.close()
+        await listener.wait_closed()
+    status = int(head.split(b" ", 2)[1])
+    return status, json.loads(body), closed
+
+
+def _post(body, length=None):
+    # keep-alive の要求（エラーのときにサーバーが接続を閉じるかを確認する）
+    length = len(body) if length is None else length
+    return (
+        f"POST /render HTTP/1.1\r\nHost: localhost\r\n"
+        f"Content-Length: {length}\r\n\r\n"
+    ).encode() + body
+
+
+@pytest.mark.parametrize(
+    "request_bytes, status",
+    [
+        (_post(b"{}", length=MAX_BODY_BYTES + 1), 413),
+        (_post(json.dumps({"equation": "x" * (MAX_EQUATION_CHARS + 1)}).encode()), 413),
+        (_post(b"{not json"), 400),
+        (_post(b"[1, 2]"), 400),
+        (_post(b'{"equation": ""}'), 400),
+        (_post(b'{"equation": "x", "fontsize": "big"}'), 400),
+        (b"GARBAGE\r\nHost: localhost\r\n\r\n", 400),
+    ],
+)
+def test_bad_requests_are_rejected(request_bytes, status):
+    result = asyncio.run(_exchange(RenderServer(), request_bytes))
+    assert result[0] == status
+    assert "error" in result[1]
+    assert result[2]  # 本文を読み切れていない可能性があるので接続を閉じる
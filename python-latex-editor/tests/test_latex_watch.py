@@ -0,0 +1,108 @@
+import pytest
+
+import latex_watch
+from latex_render import RenderOptions
+from latex_watch import Watcher
+
+
+@pytest.fixture
+def rendered(monkeypatch):
+    """TeX の代わりに数式をそのまま書き出し、描画した数式を記録する"""
+    calls = []
+
+    def fake_export_targets(equation, options, targets, directory, name, *a, **kw):
+        calls.append(equation)
+        path = directory / f"{name}.{options.save_format}"
+        path.write_text(equation, encoding="utf-8")
+        return [str(path)]
+
+    monkeypatch.setattr(latex_watch, "export_targets", fake_export_targets)
+    return calls
+
+
+def _watcher(tmp_path):
+    return Watcher([tmp_path / "src"], tmp_path / "out", RenderOptions())
+
+
+def _outputs(tmp_path):
+    folder = tmp_path / "out" / "a.txt"
+    return {p.name: p.read_text(encoding="utf-8") for p in folder.glob("*.svg")}
+
+
+def test_update_skips_unchanged_equations(tmp_path, rendered):
+    (tmp_path / "src").mkdir()
+    source = tmp_path / "src" / "a.txt"
+    source.write_text("x\n\ny\n", encoding="utf-8")
+    watcher = _watcher(tmp_path)
+    watcher.run_once()
+    assert rendered == ["x", "y"]
+
+    source.write_text("x\n\nz\n", encoding="utf-8")
+    assert watcher.update(source, source.relative_to(tmp_path / "src")) == (1, 0, 1, 0)
+    assert rendered == ["x", "y", "z"]
+
+    # 再起動しても記録したキーから変更なしと判定する
+    assert _watcher(tmp_path).run_once() == 0
+    assert rendered == ["x", "y", "z"]
+
+
+def test_update_reuses_renamed_outputs(tmp_path, rendered):
+    (tmp_path / "src").mkdir()
+    source = tmp_path / "src" / "a.txt"
+    source.write_text("x\n\ny\n", encoding="utf-8")
+    watcher = _watcher(tmp_path)
+    watcher.run_once()
+
+    # 先頭に挿入すると既存の数式の名前がずれるが、描画し直さず出力を使い回す
+    source.write_text("w\n\nx\n\ny\n", encoding="utf-8")
+    assert watcher.update(source, source.relative_to(tmp_path / "src")) == (1, 2, 0, 0)
+    assert rendered == ["x", "y", "w"]
+    assert _outputs(tmp_path) == {
+        "eq_0001.svg": "w",
+        "eq_0002.svg": "x",
+        "eq_0003.svg": "y",
+    }
+
+
+def test_removed_equations_and_files_delete_outputs(tmp_path, rendered):
+    (tmp_path / "src").mkdir()
+    source = tmp_path / "src" / "a.txt"
+    source.write_text("x\n\ny\n", encoding="utf-8")
+    watcher = _watcher(tmp_path)
+    watcher.run_once()
+
+    source.write_text("x\n", encoding="utf-8")
+    watcher.update(source, source.relative_to(tmp_path / "src"))
+    assert _outputs(tmp_path) == {"eq_0001.svg": "x"}
+    assert sorted(watcher.state) == ["a.txt/eq_0001.svg"]
+
+    source.unlink()
+    watcher.run_once()
+    assert _outputs(tmp_path) == {}
+    assert watcher.state == {}
+
+
+def test_same_stem_sources_do_not_collide(tmp_path, rendered):
+    (tmp_path / "src").mkdir()
+    (tmp_path / "src" / "a.txt").write_text("x\n", encoding="utf-8")
+    (tmp_path / "src" / "a.tex").write_text("\\[ y \\]\n", encoding="utf-8")
+    _watcher(tmp_path).run_once()
+    assert (tmp_path / "out" / "a.txt" / "eq_0001.svg").read_text() == "x"
+    assert (tmp_path / "out" / "a.tex" / "eq_0001.svg").read_text() == "y"
+
+
+def test_poll_keeps_going_after_a_file_fails(tmp_path, rendered, monkeypatch):
+    (tmp_path / "src").mkdir()
+    (tmp_path / "src" / "a.txt").write_text("x\n", encoding="utf-8")
+    (tmp_path / "src" / "b.txt").write_text("y\n", encoding="utf-8")
+    watcher = _watcher(tmp_path)
+    update = watcher.update
+
+    def failing_update(path, relative):
+        if path.name == "a.txt":
+            raise OSError("disk full")
+        return update(path, relative)
+
+    monkeypatch.setattr(watcher, "update", failing_update)
+    assert watcher.run_once() == 1
+    assert rendered == ["y"]
@@ -0,0 +1,16 @@
+from render_cache import RenderCache
+
+
+def test_fetch_removes_lock_file(tmp_path):
+    cache = RenderCache(tmp_path)
+    assert cache.fetch("ab" * 32, "svg", lambda: b"data") == (b"data", "miss")
+    assert cache.fetch("ab" * 32, "svg", lambda: b"other") == (b"data", "hit")
+    assert list(tmp_path.glob("??/*.lock")) == []
+
+
+def test_put_counts_overwritten_entry_once(tmp_path):
+    cache = RenderCache(tmp_path)
+    cache.put("ab" * 32, "svg", b"12345")
+    cache.put("cd" * 32, "svg", b"12345")
+    cache.put("cd" * 32, "svg", b"123")
+    assert cache._size == cache.total_size() == 8
@@ -0,0 +1,51 @@
+import re
+
+import pytest
+
+import svg_optimize
+from svg_optimize import minify_path, optimize
+
+NUMBER = re.compile(svg_optimize._NUMBER.pattern)
+
+
+def path_numbers(d):
+    return [float(n) for n in NUMBER.findall(d)]
+
+
+def commands(d):
+    return re.findall("[A-DF-Za-df-z]", d)
+
+
+@pytest.mark.parametrize(
+    "d",
+    [
+        "M 1 0.5 L 2 0.25 Z",
+        "M 1 0.5 L 3 0.25 L 2 2 Z",
+        "M 1.5 0.5 L -2 -0.25 0.001 0.5",
+        "M10,20 C 10.25,-0.5 3 .75 4e-1 5",
+        "m 0 0 h 12 v -3.5 l .5 .5 z",
+    ],
+)
+def test_minify_path_keeps_coordinates(d):
+    minified = minify_path(d, 3)
+    assert path_numbers(minified) == pytest.approx(
+        [round(n, 3) for n in path_numbers(d)]
+    )
+    assert commands(minified) == commands(d)
+
+
+def test_minify_path_drops_only_redundant_spaces():
+    assert minify_path("M 1 0.5 L 2 0.25 Z", 3) == "M1 .5L2 .25Z"
+    assert minify_path("M 1.5 0.5 L -2 -0.25", 3) == "M1.5.5L-2-.25"
+
+
+def test_optimize_glyph_path_round_trip():
+    svg = (
+        b'<svg xmlns="http://www.w3.org/2000/svg"'
+        b' xmlns:xlink="http://www.w3.org/1999/xlink">'
+        b'<defs><path id="g0-1" d="M 1 0.5 L 3 0.25 L 2 2 Z"/></defs>'
+        b'<use xlink:href="#g0-1" x="0" y="0"/></svg>'
+    )
+    data, _ = optimize(svg, 3)
+    (d,) = re.findall(rb' d="([^"]*)"', data)
+    assert path_numbers(d.decode()) == [1, 0.5, 3, 0.25, 2, 2]
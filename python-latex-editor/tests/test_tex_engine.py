@@ -0,0 +1,35 @@
+import shutil
+
+import pytest
+
+import tex_engine
+from latex_render import RenderOptions, build_math_text
+
+NUMBERED = r"\begin{align} a &= b \end{align}"
+
+
+def _pages(document):
+    body = document.split(r"\begin{document}", 1)[1]
+    return body.split(r"\clearpage")[:-1]
+
+
+def test_group_pages_reset_equation_counter():
+    math_texts = [
+        build_math_text(NUMBERED),
+        build_math_text(r"\begin{gather} c \end{gather}"),
+    ]
+    pages = _pages(tex_engine.build_document(math_texts, 24))
+    assert len(pages) == 2
+    # 番号の数式カウンタがページごとに戻る（まとめても (1) から始まる）
+    for page, math_text in zip(pages, math_texts):
+        assert page.index(r"\setcounter{equation}{0}") < page.index(math_text)
+
+
+@pytest.mark.skipif(
+    not (shutil.which("latex") and shutil.which("dvipng")), reason="TeX がない"
+)
+def test_grouped_numbered_output_matches_single():
+    options = RenderOptions(save_format="png", backend="dvi")
+    grouped = tex_engine.render_group_targets([NUMBERED] * 3, [options])
+    (single,) = tex_engine.render_group_targets([NUMBERED], [options])
+    assert [outputs[0] for outputs in grouped] == [single[0]] * 3
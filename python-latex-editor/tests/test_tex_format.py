@@ -0,0 +1,27 @@
+import subprocess
+
+import pytest
+
+import tex_format
+import tex_process
+
+
+def test_failed_format_is_not_rebuilt(monkeypatch, tmp_path):
+    calls = []
+
+    def failing_run(command, cwd=None, env=None, limits=None):
+        calls.append(command)
+        return subprocess.CompletedProcess(command, 1, b"! LaTeX Error")
+
+    monkeypatch.setattr(tex_process, "run", failing_run)
+    monkeypatch.setattr(tex_format, "tex_installation_id", lambda: "test")
+    monkeypatch.setattr(tex_format, "_failed", {})
+    preamble = r"\documentclass{article}\usepackage{missing}"
+    for _ in range(3):
+        with pytest.raises(tex_format.FormatError):
+            tex_format.ensure_format(preamble, tmp_path)
+    assert len(calls) == 1
+    # 別のプリアンブルは試す
+    with pytest.raises(tex_format.FormatError):
+        tex_format.ensure_format(r"\documentclass{article}", tmp_path)
+    assert len(calls) == 2
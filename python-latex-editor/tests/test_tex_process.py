@@ -0,0 +1,148 @@
+import os
+import pickle
+import subprocess
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import pytest
+
+import tex_process
+from tex_process import ProcessLimitError, ProcessLimits
+from tex_worker import TeXWorker
+
+posix = pytest.mark.skipif(os.name == "nt", reason="POSIX のシェルを使う")
+
+
+def _raise_limit_error():
+    error = ProcessLimitError(
+        "latex が 30 秒以内に終わらなかったため中断しました",
+        "latex",
+        "timeout",
+        30,
+        "output",
+    )
+    error.index = 3  # 後から付けた属性も送る
+    raise error
+
+
+def test_process_limit_error_pickles():
+    with pytest.raises(ProcessLimitError) as info:
+        _raise_limit_error()
+    error = pickle.loads(pickle.dumps(info.value))
+    assert str(error) == str(info.value)
+    assert (error.program, error.reason, error.limit, error.output, error.index) == (
+        "latex",
+        "timeout",
+        30,
+        "output",
+        3,
+    )
+
+
+def test_process_limit_error_through_pool():
+    with ProcessPoolExecutor(max_workers=1) as pool:
+        future = pool.submit(_raise_limit_error)
+        with pytest.raises(ProcessLimitError) as info:
+            future.result()
+        # プールは壊れず、次の依頼も処理できる
+        assert pool.submit(abs, -1).result() == 1
+    assert info.value.reason == "timeout"
+    assert info.value.limit == 30
+
+
+def _alive(pid):
+    try:
+        stat = Path(f"/proc/{pid}/stat").read_text()
+    except FileNotFoundError:
+        return False
+    return stat.rsplit(")", 1)[1].split()[0] != "Z"
+
+
+def _wait_dead(pid):
+    # 回収まで少しかかることがあるので、固定の待ち時間ではなく終了を待つ
+    for _ in range(100):
+        if not _alive(pid):
+            return True
+        time.sleep(0.05)
+    return False
+
+
+def _wait_for_pid(path):
+    for _ in range(200):
+        if path.exists() and path.read_text().strip():
+            return int(path.read_text())
+        time.sleep(0.05)
+    raise AssertionError(f"{path} が書き込まれませんでした")
+
+
+@pytest.mark.skipif(tex_process.resource is None, reason="resource.prlimit がない")
+def test_run_sets_resource_limits():
+    limits = ProcessLimits(timeout=10, memory_mb=100, cpu_seconds=5)
+    result = tex_process.run(["sh", "-c", "ulimit -v; ulimit -t"], limits=limits)
+    assert result.stdout.split() == [b"102400", b"5"]
+
+
+@pytest.mark.skipif(tex_process.resource is None, reason="resource.prlimit がない")
+def test_resource_limits_keep_lower_soft_limit(monkeypatch):
+    resource = tex_process.resource
+    monkeypatch.setattr(resource, "getrlimit", lambda kind: (2, resource.RLIM_INFINITY))
+    limits = dict(tex_process._resource_limits(ProcessLimits(cpu_seconds=5)))
+    assert limits[resource.RLIMIT_CPU] == (2, 6)
+
+
+@posix
+@pytest.mark.skipif(tex_process.resource is None, reason="resource.prlimit がない")
+def test_sigkill_is_not_blamed_on_cpu_limit():
+    # OOM killer や手動の kill など、CPU 時間を使い切っていない SIGKILL
+    result = tex_process.run(
+        ["sh", "-c", "kill -9 $$"], limits=ProcessLimits(cpu_seconds=5)
+    )
+    assert result.returncode == -9
+
+
+@posix
+def test_timeout_kills_process_group(tmp_path):
+    pid_file = tmp_path / "pid"
+    command = ["sh", "-c", f"sleep 30 & echo $! > {pid_file}; wait"]
+    with pytest.raises(ProcessLimitError) as info:
+        tex_process.run(command, limits=ProcessLimits(timeout=0.5))
+    assert info.value.reason == "timeout"
+    pid = _wait_for_pid(pid_file)
+    assert _wait_dead(pid)
+
+
+@posix
+def test_worker_stop_kills_children(tmp_path):
+    pid_file = tmp_path / "pid"
+    # TeX を実行中のワーカーの代わりに、tex_process.run で待ち続けるプロセス
+    code = (
+        "import signal, tex_process, tex_worker\n"
+        "signal.signal(signal.SIGTERM, tex_worker._terminate)\n"
+        f"tex_process.run(['sh', '-c', 'echo $$ > {pid_file}; sleep 30'])\n"
+    )
+    worker = TeXWorker()
+    worker._process = subprocess.Popen(
+        [sys.executable, "-c", code], cwd=Path(tex_process.__file__).parent
+    )
+    pid = _wait_for_pid(pid_file)
+    worker._stop()
+    assert _wait_dead(pid)
+
+
+@posix
+def test_tex_runs_with_paranoid_openin():
+    result = tex_process.run(["sh", "-c", "echo $openin_any"])
+    assert result.stdout.strip() == b"p"
+
+
+@posix
+@pytest.mark.skipif(tex_process.resource is None, reason="resource.prlimit がない")
+def test_cpu_limit_is_reported():
+    with pytest.raises(ProcessLimitError) as info:
+        tex_process.run(
+            ["sh", "-c", "while :; do :; done"],
+            limits=ProcessLimits(timeout=10, cpu_seconds=1),
+        )
+    assert info.value.reason == "cpu"
@@ -0,0 +1,22 @@
+import os
+import socket
+
+from work_queue import WorkQueue, worker_id
+
+
+def test_restarted_worker_reclaims_its_predecessors_leases(tmp_path):
+    directory = tmp_path / "queue"
+    assert WorkQueue.create(directory, {}, [{"equation": "x"}], lease_seconds=60)
+    # 落ちる前のワーカー（コンテナの再起動でホスト名と PID が同じ）
+    previous = f"{socket.gethostname()}-{os.getpid()}-0badf00d"
+    assert worker_id() != previous
+    lease = WorkQueue(directory, worker=previous).claim()
+    old = lease.path.stat().st_mtime - 3600
+    os.utime(lease.path, (old, old))
+
+    queue = WorkQueue(directory)
+    assert queue.reclaim_expired(force=True) == 1
+    lease = queue.claim()
+    assert lease is not None and lease.chunk == "000001"
+    queue.complete(lease, [{"ok": True}])
+    assert queue.finished()
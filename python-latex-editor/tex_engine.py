@@ -0,0 +1,452 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+TeX を直接実行するレンダリングパイプライン（matplotlib を経由しない）
+複数の数式を 1 つの文書にまとめて 1 回だけコンパイルし、
+1 ページ 1 数式の DVI を余白なしの SVG/PNG/PDF に分割する。
+
+必要なツール:
+    latex, dvipng (PNG), dvisvgm (SVG), dvipdfmx + Ghostscript + pdftex (PDF)
+"""
+
+import functools
+import re
+import shutil
+import threading
+from pathlib import Path
+
+import tex_format
+import tex_process
+from latex_render import DEFAULT_PREAMBLE, RenderError, build_math_text
+from render_stats import stats
+
+# コンパイルエラーの原因になった数式を特定するための目印（\typeout で出力）
+EQ_MARKER = "@@EQ "
+
+# Ghostscript の実行ファイル名（Windows では gswin64c など）
+GHOSTSCRIPT_NAMES = ["gs", "gswin64c", "gswin32c", "rungs"]
+
+# RenderArtifact が保持する変換結果の数
+ARTIFACT_MAX_OUTPUTS = 32
+
+# fix-cm が Computer Modern のフォントを選ぶ設計サイズ (pt)
+# 例: 12pt 以上 17pt 未満は cmr12、17pt 以上は cmr17 を拡大縮小して使う
+CM_DESIGN_SIZES = [5, 6, 7, 8, 9, 10, 12, 17]
+# 本文・添字・添字の添字の大きさの比（LaTeX の \defaultscriptratio など）
+MATH_SIZE_RATIOS = [1.0, 0.7, 0.5]
+
+
+class ToolNotFoundError(RenderError):
+    """外部ツール（latex, dvisvgm など）が見つからない場合の例外"""
+
+
+class TeXCompileError(RenderError):
+    """TeX のコンパイルエラー（index はエラーになった数式の番号、不明なら None）"""
+
+    def __init__(self, message, log="", index=None):
+        super().__init__(message)
+        self.log = log
+        self.index = index
+
+
+def find_ghostscript():
+    """Ghostscript の実行ファイルを探す（見つからなければ None）"""
+    for name in GHOSTSCRIPT_NAMES:
+        if shutil.which(name):
+            return name
+    return None
+
+
+@functools.lru_cache(maxsize=None)
+def tools_available(save_format):
+    """指定形式の出力に必要なツールがそろっているか"""
+    tools = {"png": ["dvipng"], "svg": ["dvisvgm"], "pdf": ["dvipdfmx", "pdftex"]}
+    if not shutil.which("latex"):
+        return False
+    if save_format == "pdf" and find_ghostscript() is None:
+        return False
+    return all(shutil.which(tool) for tool in tools[save_format])
+
+
+def run_tool(command, cwd, env=None):
+    """外部ツールを実行し、標準出力と標準エラーをまとめた文字列を返す
+
+    時間・メモリの上限（tex_process.configure）を超えた場合は ProcessLimitError。
+    """
+    try:
+        result = tex_process.run(command, cwd=cwd, env=env)
+    except FileNotFoundError as e:
+        raise ToolNotFoundError(f"{command[0]} が見つかりません") from e
+    output = result.stdout.decode("utf-8", "backslashreplace")
+    if result.returncode != 0:
+        raise RenderError(f"{command[0]} が失敗しました:\n{output}")
+    return output
+
+
+def optical_sizes(fontsize):
+    """フォントサイズで選ばれる本文・添字・添字の添字の設計サイズ
+
+    これが同じフォントサイズどうしはグリフが同じなので、一方の DVI を拡大縮小すれば
+    もう一方に近い出力になる。ただし jot・arraycolsep・nulldelimiterspace などの
+    長さはフォントサイズに比例しないので、行列や可変サイズの括弧の間隔は少し変わる
+    （プレビューにだけ使う）。
+    """
+    sizes = []
+    for ratio in MATH_SIZE_RATIOS:
+        smaller = [s for s in CM_DESIGN_SIZES if s <= fontsize * ratio]
+        sizes.append(smaller[-1] if smaller else CM_DESIGN_SIZES[0])
+    return tuple(sizes)
+
+
+def build_document(math_texts, fontsize, preamble=DEFAULT_PREAMBLE):
+    """1 ページ 1 数式の LaTeX 文書を生成（matplotlib の usetex と同じ組版）"""
+    baselineskip = 1.25 * fontsize
+    lines = [
+        r"\RequirePackage{fix-cm}",
+        r"\documentclass{article}",
+        r"\newcommand{\mathdefault}[1]{#1}",
+        r"\usepackage{type1cm}",
+        r"\usepackage[utf8]{inputenc}",
+        r"\DeclareUnicodeCharacter{2212}{\ensuremath{-}}",
+        r"\usepackage[papersize=72in, margin=1in]{geometry}",
+        preamble,
+        r"\pagestyle{empty}",
+        r"\begin{document}",
+    ]
+    for i, math_text in enumerate(math_texts):
+        lines += [
+            rf"\typeout{{{EQ_MARKER}{i}}}",
+            # 番号付きの環境（equation・align など）をページごとに (1) から始める
+            r"\setcounter{equation}{0}%",
+            rf"\fontsize{{{fontsize}}}{{{baselineskip}}}\selectfont%",
+            r"\hbox{}%",
+            rf"{{\rmfamily {math_text}}}%",
+            r"\clearpage",
+        ]
+    lines.append(r"\end{document}")
+    return "\n".join(lines)
+
+
+def _failed_index(log):
+    """TeX のログからエラーが起きた数式の番号を取得"""
+    error_pos = log.find("\n!")
+    head = log if error_pos < 0 else log[:error_pos]
+    markers = re.findall(re.escape(EQ_MARKER) + r"(\d+)", head)
+    return int(markers[-1]) if markers else None
+
+
+@stats.timed("tex_compile")
+def compile_document(source, workdir, precompile=True):
+    """LaTeX 文書をコンパイルし、DVI のパスを返す（可能ならプリコンパイル済みフォーマットを使用）"""
+    command = ["latex", "-interaction=nonstopmode", "-halt-on-error", "-no-shell-escape"]
+    env = None
+    if precompile:
+        try:
+            preamble_source, body = tex_format.split_source(source)
+            name = tex_format.ensure_format(preamble_source)
+        except tex_format.FormatError:
+            pass  # フォーマットを作れない場合は通常のコンパイル
+        else:
+            command.insert(1, f"-fmt={name}")
+            env = tex_format.format_env()
+            source = body
+
+    Path(workdir, "file.tex").write_text(source, encoding="utf-8")
+    try:
+        run_tool(command + ["file.tex"], workdir, env)
+    except ToolNotFoundError:
+        raise
+    except tex_process.ProcessLimitError as e:
+        # 止まらなかった数式の番号（まとめたコンパイルから外すのに使う）
+        e.index = _failed_index(e.output)
+        raise
+    except RenderError as e:
+        log = str(e)
+        raise TeXCompileError(
+            "latex was not able to process the following string:\n" + log,
+            log=log,
+            index=_failed_index(log),
+        ) from None
+    return Path(workdir, "file.dvi")
+
+
+def _collect_pages(workdir, pattern):
+    """ページ番号順に出力ファイルを読み込み"""
+    files = list(Path(workdir).glob(pattern))
+    files.sort(key=lambda p: int(re.findall(r"\d+", p.stem)[-1]))
+    return [f.read_bytes() for f in files]
+
+
+def _rgb(bgcolor):
+    from matplotlib.colors import to_rgb
+
+    return to_rgb(bgcolor)
+
+
+def svg_with_background(data, bgcolor):
+    """SVG の viewBox 全体に背景の矩形を追加"""
+    from matplotlib.colors import to_hex
+
+    text = data.decode("utf-8")
+    match = re.search(r"<svg\b[^>]*viewBox=['\"]([^'\"]+)['\"][^>]*>", text)
+    if not match:
+        return data
+    x, y, w, h = match.group(1).split()
+    rect = (
+        f"<rect x='{x}' y='{y}' width='{w}' height='{h}' "
+        f"fill='{to_hex(bgcolor)}'/>"
+    )
+    return (text[: match.end()] + rect + text[match.end() :]).encode("utf-8")
+
+
+@stats.timed("rasterize")
+def dvi_to_png(dvi, workdir, dpi, bgcolor, scale=1.0):
+    """DVI の各ページを余白なしの PNG に変換（scale 倍に拡大縮小）"""
+    if bgcolor == "transparent":
+        bg = "Transparent"
+    else:
+        bg = "rgb {:.4f} {:.4f} {:.4f}".format(*_rgb(bgcolor))
+    run_tool(
+        ["dvipng", "-q", "-T", "tight", "-D", str(dpi), "-bg", bg]
+        + ["-x", str(round(1000 * scale))]
+        + ["-o", "page%d.png", str(Path(dvi).resolve())],
+        workdir,
+    )
+    return _collect_pages(workdir, "page*.png")
+
+
+@stats.timed("convert_svg")
+def dvi_to_svg(dvi, workdir, bgcolor, scale=1.0):
+    """DVI の各ページを余白なしの SVG に変換（グリフはパスとして定義し <use> で再利用）
+
+    scale は width / height にだけ掛ける（viewBox の座標はそのまま）。
+    """
+    run_tool(
+        ["dvisvgm", "--page=1-", "--no-fonts", "--exact-bbox", "--verbosity=1"]
+        + ([f"--zoom={scale:.6g}"] if scale != 1 else [])
+        + ["--output=page%p.svg", str(Path(dvi).resolve())],
+        workdir,
+    )
+    pages = _collect_pages(workdir, "page*.svg")
+    if bgcolor != "transparent":
+        pages = [svg_with_background(page, bgcolor) for page in pages]
+    return pages
+
+
+def _pdf_bboxes(pdf, workdir):
+    """Ghostscript でページごとのインクの範囲 (x0, y0, x1, y1) を取得"""
+    gs = find_ghostscript()
+    if gs is None:
+        raise ToolNotFoundError("Ghostscript が見つかりません")
+    output = run_tool(
+        [gs, "-q", "-dBATCH", "-dNOPAUSE", "-dSAFER", "-sDEVICE=bbox", Path(pdf).name],
+        workdir,
+    )
+    return [
+        tuple(float(v) for v in m.groups())
+        for m in re.finditer(
+            r"%%HiResBoundingBox:\s*(\S+)\s+(\S+)\s+(\S+)\s+(\S+)", output
+        )
+    ]
+
+
+# pdfcrop と同じ方法で 1 ページを切り出す pdftex 文書
+_CROP_TEMPLATE = r"""\pdfoutput=1
+\pdfcompresslevel=9
+\csname pdfmapfile\endcsname{{}}
+\setbox0=\hbox{{{background}\pdfximage page {page} mediabox{{{pdf}}}\pdfrefximage\pdflastximage}}
+\pdfhorigin=-{x0}bp
+\pdfvorigin={y0}bp
+\pdfpagewidth={width}bp
+\pdfpageheight={height}bp
+\ht0=\pdfpageheight
+\shipout\box0
+\csname @@end\endcsname
+\end
+"""
+
+
+@stats.timed("convert_pdf")
+def dvi_to_pdf(dvi, workdir, bgcolor, scale=1.0):
+    """DVI の各ページを余白なしの PDF に変換（dvipdfmx → Ghostscript で範囲取得 → pdftex で切り出し）"""
+    run_tool(
+        ["dvipdfmx", "-q", "-m", f"{scale:.6g}", "-o", "all.pdf"]
+        + [str(Path(dvi).resolve())],
+        workdir,
+    )
+    pages = []
+    for page, (x0, y0, x1, y1) in enumerate(_pdf_bboxes("all.pdf", workdir), 1):
+        width, height = max(x1 - x0, 1), max(y1 - y0, 1)
+        background = ""
+        if bgcolor != "transparent":
+            r, g, b = _rgb(bgcolor)
+            background = (
+                rf"\pdfliteral page{{q {r:.4f} {g:.4f} {b:.4f} rg "
+                rf"0 0 {width:.4f} {height:.4f} re f Q}}"
+            )
+        job = f"crop{page}"
+        Path(workdir, f"{job}.tex").write_text(
+            _CROP_TEMPLATE.format(
+                background=background,
+                page=page,
+                pdf="all.pdf",
+                x0=f"{x0:.4f}",
+                y0=f"{y0:.4f}",
+                width=f"{width:.4f}",
+                height=f"{height:.4f}",
+            ),
+            encoding="utf-8",
+        )
+        run_tool(
+            ["pdftex", "-interaction=nonstopmode", "-no-shell-escape", f"{job}.tex"],
+            workdir,
+        )
+        pages.append(Path(workdir, f"{job}.pdf").read_bytes())
+    return pages
+
+
+def convert_pages(dvi, workdir, options, scale=1.0):
+    """DVI の各ページを保存形式のバイト列に変換（scale 倍に拡大縮小）"""
+    if options.save_format == "png":
+        return dvi_to_png(dvi, workdir, options.dpi, options.bgcolor, scale)
+    if options.save_format == "svg":
+        return dvi_to_svg(dvi, workdir, options.bgcolor, scale)
+    if options.save_format == "pdf":
+        return dvi_to_pdf(dvi, workdir, options.bgcolor, scale)
+    raise RenderError(f"未対応の保存形式です: {options.save_format}")
+
+
+class RenderArtifact:
+    """1 つの数式のコンパイル結果（正規化した数式・DVI・形式ごとの変換結果）
+
+    同じ数式を別の形式・背景色・解像度で書き出すときは、TeX を実行せずに
+    保存してある DVI からの変換だけで済ませる。プレビューでは、フォントサイズが
+    違っても optical_sizes が同じなら DVI を拡大縮小して変換する。
+    """
+
+    def __init__(self, math_text, fontsize, preamble, dvi):
+        self.math_text = math_text
+        self.fontsize = fontsize
+        self.preamble = preamble
+        self.dvi = dvi  # DVI のバイト列
+        self._outputs = {}  # (形式, 解像度, 背景色, フォントサイズ) -> バイト列
+        self._lock = threading.Lock()
+
+    def matches(self, math_text, options, preamble, scaled=False):
+        """同じ数式・フォントサイズ・プリアンブルのコンパイル結果か
+
+        scaled が真なら、拡大縮小で済むフォントサイズ（optical_sizes が同じ）でもよい。
+        拡大縮小した出力はコンパイルし直した出力と完全には一致しないので、
+        保存やキャッシュには使わない。
+        """
+        if scaled:
+            same_size = optical_sizes(self.fontsize) == optical_sizes(options.fontsize)
+        else:
+            same_size = self.fontsize == options.fontsize
+        return self.math_text == math_text and same_size and self.preamble == preamble
+
+    def export(self, options):
+        """保存形式のバイト列を返す（変換済みならそのまま返す）"""
+        dpi = options.dpi if options.save_format == "png" else None
+        key = (options.save_format, dpi, options.bgcolor, options.fontsize)
+        with self._lock:
+            if key not in self._outputs:
+                with tex_process.temporary_directory() as workdir:
+                    dvi = Path(workdir, "file.dvi")
+                    dvi.write_bytes(self.dvi)
+                    scale = options.fontsize / self.fontsize
+                    pages = convert_pages(dvi, workdir, options, scale)
+                if len(pages) != 1:
+                    raise RenderError(f"ページ数が 1 ではありません（{len(pages)}）")
+                if len(self._outputs) >= ARTIFACT_MAX_OUTPUTS:
+                    # フォントサイズを次々に変えても増え続けないよう古いものから捨てる
+                    del self._outputs[next(iter(self._outputs))]
+                self._outputs[key] = pages[0]
+            return self._outputs[key]
+
+
+def compile_artifact(equation, options, preamble=DEFAULT_PREAMBLE, precompile=True):
+    """数式をコンパイルし、形式に依存しない RenderArtifact を返す"""
+    math_text = build_math_text(equation, options.displaystyle)
+    source = build_document([math_text], options.fontsize, preamble)
+    with tex_process.temporary_directory() as workdir:
+        dvi = compile_document(source, workdir, precompile).read_bytes()
+    return RenderArtifact(math_text, options.fontsize, preamble, dvi)
+
+
+def _render_pages(math_texts, targets, preamble, precompile):
+    """数式をまとめて 1 回コンパイルし、数式ごとに [書き出し先ごとのバイト列] を返す
+
+    targets は書き出し先ごとの RenderOptions（フォントサイズは共通）。
+    """
+    source = build_document(math_texts, targets[0].fontsize, preamble)
+    converted = []
+    with tex_process.temporary_directory() as workdir:
+        dvi = compile_document(source, workdir, precompile)
+        for n, target in enumerate(targets):
+            # 変換ツールの出力ファイルが混ざらないよう書き出し先ごとにフォルダを分ける
+            target_dir = Path(workdir, f"target{n}")
+            target_dir.mkdir()
+            pages = convert_pages(dvi, target_dir, target)
+            if len(pages) != len(math_texts):
+                raise TeXCompileError(
+                    f"ページ数が数式の数と一致しません（{len(pages)} / {len(math_texts)}）"
+                )
+            converted.append(pages)
+    return [list(pages) for pages in zip(*converted)]
+
+
+def render_group(equations, options, preamble=DEFAULT_PREAMBLE, precompile=True):
+    """複数の数式を 1 回のコンパイルで描画し、数式ごとにバイト列または RenderError を返す"""
+    results = render_group_targets(equations, [options], preamble, precompile)
+    return [r if isinstance(r, Exception) else r[0] for r in results]
+
+
+def render_group_targets(equations, targets, preamble=DEFAULT_PREAMBLE, precompile=True):
+    """複数の数式を 1 回のコンパイルで描画し、複数の形式・解像度に変換
+
+    数式ごとに [書き出し先ごとのバイト列] または RenderError を返す。エラーになった数式は
+    まとめたコンパイルから外して単独でコンパイルし直すので、他の数式は巻き込まれない。
+    """
+    results = [None] * len(equations)
+    math_texts = {}
+    for i, equation in enumerate(equations):
+        try:
+            # 環境の判定（align/gather/multline、改行があれば aligned）はプレビューと共通
+            math_texts[i] = build_math_text(equation, targets[0].displaystyle)
+        except RenderError as e:
+            results[i] = e
+
+    pending = sorted(math_texts)
+    isolated = []
+    while pending:
+        try:
+            pages = _render_pages(
+                [math_texts[i] for i in pending], targets, preamble, precompile
+            )
+        except ToolNotFoundError:
+            raise
+        except RenderError as e:
+            if len(pending) == 1:
+                results[pending[0]] = e
+                break
+            index = getattr(e, "index", None)
+            if index is None:
+                # 原因を特定できない場合は全部単独でやり直す
+                isolated.extend(pending)
+                break
+            # 原因の数式を外して残りをもう一度まとめてコンパイル
+            isolated.append(pending.pop(index))
+            continue
+        for i, page in zip(pending, pages):
+            results[i] = page
+        break
+
+    for i in isolated:
+        try:
+            results[i] = _render_pages([math_texts[i]], targets, preamble, precompile)[0]
+        except ToolNotFoundError:
+            raise
+        except RenderError as e:
+            results[i] = e
+    return results
@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+プリアンブルのプリコンパイル（TeX フォーマットファイル .fmt）
+matplotlib が生成する TeX ソースの \\begin{document} より前を .fmt に固めておき、
+コンパイルのたびに amsmath などのパッケージを読み込み直さないようにする。
+.fmt はプリアンブルと TeX のインストールが変わったときだけ作り直す。
+"""
+
+import functools
+import hashlib
+import os
+import shutil
+import warnings
+from pathlib import Path
+
+from render_cache import file_lock
+from render_stats import stats
+
+# tex_process は latex_render（→ このモジュール）を読み込むので、使う関数の中で import する
+
+DEFAULT_FORMAT_DIR = Path.home() / ".cache" / "latex_editor" / "formats"
+
+BEGIN_DOCUMENT = r"\begin{document}"
+
+# フォーマットを作れなかった (フォルダ, プリアンブルのハッシュ) -> エラーメッセージ
+# （同じプロセスでは latex -ini を何度も試さない）
+_failed = {}
+
+
+class FormatError(Exception):
+    """フォーマットファイルの作成に失敗した場合の例外"""
+
+
+def split_source(source):
+    """TeX ソースをプリアンブル部分と本文（\\begin{document} 以降）に分割"""
+    index = source.find(BEGIN_DOCUMENT)
+    if index < 0:
+        raise FormatError("\\begin{document} が見つかりません")
+    return source[:index], source[index:]
+
+
+@functools.lru_cache(maxsize=None)
+def tex_installation_id():
+    """TeX のインストールを識別する文字列（latex のバージョンとベースの latex.fmt）"""
+    import tex_process
+
+    parts = []
+    try:
+        result = tex_process.run(["latex", "--version"])
+        if result.returncode != 0:
+            raise FormatError(f"latex を実行できません（終了コード {result.returncode}）")
+        version = result.stdout.decode("utf-8", "backslashreplace")
+        parts.append(version.splitlines()[0] if version else "")
+        base_fmt = tex_process.run(["kpsewhich", "-engine=pdftex", "latex.fmt"])
+        base_fmt = base_fmt.stdout.decode("utf-8", "backslashreplace").strip()
+    except (OSError, tex_process.ProcessLimitError) as e:
+        raise FormatError(f"latex を実行できません: {e}") from e
+    if base_fmt:
+        # tlmgr などでパッケージを更新するとベースのフォーマットも作り直される
+        st = os.stat(base_fmt)
+        parts.append(f"{base_fmt}:{st.st_size}:{st.st_mtime_ns}")
+    return "\n".join(parts)
+
+
+def format_name(preamble_source):
+    """プリアンブルと TeX のインストールから決まるフォーマット名"""
+    key = preamble_source + "\n" + tex_installation_id()
+    return "latexeditor-" + hashlib.sha256(key.encode("utf-8")).hexdigest()[:16]
+
+
+def ensure_format(preamble_source, format_dir=DEFAULT_FORMAT_DIR):
+    """フォーマットファイルがなければ作成し、フォーマット名を返す
+
+    作成に失敗したプリアンブルは覚えておき、以降は TeX を実行せずに FormatError を送出する。
+    """
+    format_dir = Path(format_dir)
+    failed_key = (str(format_dir), hashlib.sha256(preamble_source.encode()).hexdigest())
+    if failed_key in _failed:
+        raise FormatError(_failed[failed_key])
+    try:
+        return _ensure_format(preamble_source, format_dir)
+    except FormatError as e:
+        _failed[failed_key] = str(e)
+        raise
+
+
+def _ensure_format(preamble_source, format_dir):
+    name = format_name(preamble_source)
+    if (format_dir / f"{name}.fmt").exists():
+        return name
+
+    format_dir.mkdir(parents=True, exist_ok=True)
+    # 同時に起動したワーカーのうち 1 つだけが作成し、他はその完了を待つ
+    with file_lock(format_dir / f"{name}.lock"):
+        if not (format_dir / f"{name}.fmt").exists():
+            _build_format(preamble_source, name, format_dir)
+    return name
+
+
+def _build_format(preamble_source, name, format_dir):
+    import tex_process
+
+    # 一時フォルダで作成してから移動（ロックが使えない環境で同時に作成しても安全）
+    with tex_process.temporary_directory(dir=format_dir) as tmpdir:
+        Path(tmpdir, f"{name}.tex").write_text(
+            preamble_source + "\n\\dump\n", encoding="utf-8"
+        )
+        try:
+            result = tex_process.run(
+                [
+                    "latex",
+                    "-ini",
+                    "-interaction=nonstopmode",
+                    "-halt-on-error",
+                    "-no-shell-escape",
+                    f"-jobname={name}",
+                    "&latex",
+                    f"{name}.tex",
+                ],
+                cwd=tmpdir,
+            )
+        except (OSError, tex_process.ProcessLimitError) as e:
+            raise FormatError(f"フォーマットファイルを作成できませんでした: {e}") from e
+        fmt_file = Path(tmpdir, f"{name}.fmt")
+        if result.returncode != 0 or not fmt_file.exists():
+            output = result.stdout.decode("utf-8", "backslashreplace")
+            raise FormatError(f"フォーマットファイルを作成できませんでした:\n{output}")
+        fmt_file.replace(format_dir / f"{name}.fmt")
+
+
+def format_env(format_dir=DEFAULT_FORMAT_DIR):
+    """フォーマットフォルダを検索パスに加えた環境変数"""
+    env = dict(os.environ)
+    # 末尾の区切り文字は kpathsea の既定の検索パスに展開される
+    env["TEXFORMATS"] = str(format_dir) + os.pathsep + env.get("TEXFORMATS", "")
+    return env
+
+
+@stats.timed("tex_compile")
+def compile_dvi(source, workdir, format_dir=DEFAULT_FORMAT_DIR):
+    """プリコンパイル済みのフォーマットで TeX ソースをコンパイルし、DVI のパスを返す"""
+    import tex_process
+
+    preamble_source, body = split_source(source)
+    name = ensure_format(preamble_source, format_dir)
+    Path(workdir, "file.tex").write_text(body, encoding="utf-8")
+    result = tex_process.run(
+        [
+            "latex",
+            f"-fmt={name}",
+            "-interaction=nonstopmode",
+            "-halt-on-error",
+            "-no-shell-escape",
+            "file.tex",
+        ],
+        cwd=workdir,
+        env=format_env(format_dir),
+    )
+    if result.returncode != 0:
+        raise RuntimeError(
+            "latex was not able to process the following string:\n"
+            + result.stdout.decode("utf-8", "backslashreplace")
+        )
+    return Path(workdir, "file.dvi")
+
+
+def install(format_dir=DEFAULT_FORMAT_DIR):
+    """matplotlib の TexManager.make_dvi をフォーマットファイルを使う版に置き換える
+
+    フォーマットを作れない環境（latex がない、パッケージが足りないなど）では
+    元の make_dvi にフォールバックする。
+    """
+    from matplotlib.texmanager import TexManager
+
+    import tex_process
+
+    original = getattr(TexManager.make_dvi, "_original", TexManager.make_dvi)
+    if not hasattr(TexManager, "_get_tex_source") or not hasattr(
+        TexManager, "_get_base_path"
+    ):
+        return False  # 想定外の matplotlib のバージョン
+
+    disabled = []  # フォーマットの作成に失敗したら以降は試さない
+
+    def make_dvi(cls, tex, fontsize):
+        dvipath = cls._get_base_path(tex, fontsize).with_suffix(".dvi")
+        if dvipath.exists() or disabled:
+            return original.__func__(cls, tex, fontsize)
+        source = cls._get_tex_source(tex, fontsize)
+        with tex_process.temporary_directory(dir=dvipath.parent) as tmpdir:
+            try:
+                dvi = compile_dvi(source, tmpdir, format_dir)
+            except FormatError as e:
+                # 一括変換の結果の出力（標準出力）に混ざらないよう警告にする
+                warnings.warn(
+                    f"プリアンブルのプリコンパイルを無効にします: {e}", RuntimeWarning
+                )
+                disabled.append(e)
+                return original.__func__(cls, tex, fontsize)
+            dvi.replace(dvipath)
+        return str(dvipath)
+
+    make_dvi._original = original
+    TexManager.make_dvi = classmethod(make_dvi)
+    return True
+
+
+def uninstall():
+    """install() で置き換えた make_dvi を元に戻す"""
+    from matplotlib.texmanager import TexManager
+
+    original = getattr(TexManager.make_dvi, "_original", None)
+    if original is not None:
+        TexManager.make_dvi = classmethod(original.__func__)
+
+
+def clear_formats(format_dir=DEFAULT_FORMAT_DIR):
+    """作成済みのフォーマットファイルを削除"""
+    shutil.rmtree(format_dir, ignore_errors=True)
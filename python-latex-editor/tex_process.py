@@ -0,0 +1,279 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+外部ツール（latex, dvipng, dvisvgm, Ghostscript など）の実行
+無限ループするマクロや巨大な行列で TeX が止まらなくなっても、エディタや一括変換が
+巻き込まれないように、時間・メモリ・CPU 時間の上限を付けて実行する。
+
+上限を超えたプロセスは子プロセスごと強制終了し、ProcessLimitError（RenderError）を
+送出する。メモリと CPU 時間の上限は起動直後に resource.prlimit で設定するので
+Linux のみ対応で、それ以外では時間の上限だけが有効。
+"""
+
+import os
+import re
+import shutil
+import signal
+import subprocess
+import tempfile
+from contextlib import contextmanager
+from dataclasses import dataclass
+
+from latex_render import RenderError
+from render_stats import stats
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+if not hasattr(resource, "prlimit"):  # macOS など
+    resource = None
+
+# TeX（kpathsea）が読めるファイルを作業フォルダの下と TeX の配布物に限る
+# （既定の a では \input{~/.ssh/id_rsa} などで任意のファイルを読めてしまう）
+OPENIN_ANY = "p"
+
+# 1 回の実行の上限（0 は無制限）
+DEFAULT_TIMEOUT = 30
+DEFAULT_MEMORY_MB = 2048
+DEFAULT_CPU_SECONDS = 60
+
+# メモリ不足で失敗したときの出力（TeX, Ghostscript, dvisvgm など）
+_OUT_OF_MEMORY = re.compile(
+    r"out of memory|memory allocation|can't allocate|cannot allocate|VMerror"
+    r"|MemoryError|bad_alloc",
+    re.IGNORECASE,
+)
+
+
+@dataclass(frozen=True)
+class ProcessLimits:
+    """外部ツールの実行の上限（0 は無制限）"""
+
+    timeout: float = DEFAULT_TIMEOUT  # 経過時間（秒）
+    memory_mb: int = DEFAULT_MEMORY_MB  # アドレス空間（MB）
+    cpu_seconds: int = DEFAULT_CPU_SECONDS  # CPU 時間（秒）
+
+    @classmethod
+    def from_settings(cls, settings):
+        """設定ファイルの tex_timeout / tex_memory_mb / tex_cpu_seconds から作成"""
+        return cls(
+            timeout=settings.get("tex_timeout", DEFAULT_TIMEOUT),
+            memory_mb=settings.get("tex_memory_mb", DEFAULT_MEMORY_MB),
+            cpu_seconds=settings.get("tex_cpu_seconds", DEFAULT_CPU_SECONDS),
+        )
+
+
+class ProcessLimitError(RenderError):
+    """外部ツールが上限を超えて強制終了された場合の例外
+
+    reason は "timeout"（経過時間）/ "cpu"（CPU 時間）/ "memory"（メモリ）。
+    """
+
+    def __init__(self, message, program, reason, limit, output=""):
+        super().__init__(message)
+        self.program = program
+        self.reason = reason
+        self.limit = limit
+        self.output = output
+
+    def __reduce__(self):
+        # プロセスプール（latex_server など）から親プロセスに送れるようにする
+        args = (self.args[0], self.program, self.reason, self.limit, self.output)
+        return type(self), args, self.__dict__
+
+
+# configure で設定（プロセスごと）
+_limits = ProcessLimits()
+
+
+def configure(limits):
+    """以降の run で使う上限を設定"""
+    global _limits
+    _limits = limits
+
+
+def current_limits():
+    return _limits
+
+
+def _resource_limits(limits):
+    """子プロセスに設定する (リソース, (ソフト, ハード)) のリスト"""
+    if resource is None:
+        return []
+    requested = []
+    if limits.memory_mb:
+        size = limits.memory_mb * 1024**2
+        requested.append((resource.RLIMIT_AS, size, size))
+    if limits.cpu_seconds:
+        # ソフトの上限で SIGXCPU、それでも終わらなければハードの上限で SIGKILL
+        requested.append(
+            (resource.RLIMIT_CPU, limits.cpu_seconds, limits.cpu_seconds + 1)
+        )
+    result = []
+    for kind, soft, hard in requested:
+        # 既に設定されている上限（ulimit など）より緩めない
+        current_soft, current_hard = resource.getrlimit(kind)
+        if current_hard != resource.RLIM_INFINITY:
+            hard = min(hard, current_hard)
+        if current_soft != resource.RLIM_INFINITY:
+            soft = min(soft, current_soft)
+        result.append((kind, (min(soft, hard), hard)))
+    return result
+
+
+def _children_cpu_seconds():
+    """終了を回収した子プロセスの CPU 時間の合計（秒）"""
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+def _popen_options():
+    if os.name == "nt":
+        return {"creationflags": subprocess.CREATE_NEW_PROCESS_GROUP}
+    # 新しいプロセスグループで起動し、子プロセス（Ghostscript など）ごと終了できるようにする
+    return {"start_new_session": True}
+
+
+def _set_limits(process, limits):
+    """起動したプロセスにメモリと CPU 時間の上限を設定
+
+    preexec_fn はスレッド（エディタのプレビューや履歴）があると安全に使えないので、
+    起動した直後に外から設定する。プロセスが起動する子プロセスにも引き継がれる。
+    """
+    for kind, values in _resource_limits(limits):
+        try:
+            resource.prlimit(process.pid, kind, values)
+        except ProcessLookupError:
+            return  # すでに終了している
+
+
+def kill_tree(process):
+    """プロセスとその子プロセスをすべて強制終了
+
+    終了を回収した（returncode が決まった）プロセスの ID は他のプロセスに使われている
+    かもしれないので、プロセスグループは回収する前にだけ終了する。
+    """
+    if process.returncode is not None:
+        return
+    if os.name == "nt":
+        subprocess.run(
+            ["taskkill", "/F", "/T", "/PID", str(process.pid)],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+    else:
+        try:
+            os.killpg(process.pid, signal.SIGKILL)
+        except (ProcessLookupError, PermissionError):
+            pass  # すでにすべて終了している
+    if process.poll() is None:
+        process.kill()
+
+
+def _cpu_exceeded(returncode, cpu_seconds, limit):
+    """CPU 時間の上限で終了させられたか
+
+    ソフトの上限では SIGXCPU が届く。SIGKILL は OOM killer や手動の kill でも
+    届くので、使った CPU 時間が上限に達していた場合だけ CPU 時間のせいにする
+    （RUSAGE_CHILDREN は他のスレッドが回収した子プロセスの分も含みうる）。
+    """
+    if returncode == -signal.SIGXCPU:
+        return True
+    return returncode == -signal.SIGKILL and cpu_seconds >= limit
+
+
+def _limit_error(program, reason, limit, output):
+    messages = {
+        "timeout": f"{program} が {limit} 秒以内に終わらなかったため中断しました",
+        "cpu": f"{program} が CPU 時間の上限（{limit} 秒）を超えたため中断しました",
+        "memory": f"{program} がメモリの上限（{limit} MB）を超えました",
+    }
+    stats.count("process_killed", reason=reason)
+    return ProcessLimitError(messages[reason], program, reason, limit, output)
+
+
+def run(command, cwd=None, env=None, limits=None):
+    """上限を付けて外部ツールを実行し、CompletedProcess を返す
+
+    stdout は標準出力と標準エラーをまとめたバイト列。終了コードが 0 以外でも例外は
+    送出しない（上限を超えた場合だけ ProcessLimitError）。
+    コマンドが見つからない場合は FileNotFoundError。TeX が作業フォルダの外の
+    ファイルを読まないよう、環境変数 openin_any を p にして実行する。
+    """
+    limits = limits or _limits
+    program = os.path.basename(command[0])
+    env = dict(os.environ if env is None else env, openin_any=OPENIN_ANY)
+    cpu_start = _children_cpu_seconds() if resource is not None else 0
+    with stats.stage("process", program=program):
+        process = subprocess.Popen(
+            command,
+            cwd=cwd,
+            env=env,
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            **_popen_options(),
+        )
+        try:
+            _set_limits(process, limits)
+            output, _ = process.communicate(timeout=limits.timeout or None)
+        except subprocess.TimeoutExpired:
+            kill_tree(process)
+            output, _ = process.communicate()
+            text = output.decode("utf-8", "backslashreplace")
+            raise _limit_error(program, "timeout", limits.timeout, text) from None
+        except BaseException:
+            kill_tree(process)
+            process.wait()
+            raise
+        # 終了を回収したあとはプロセスグループを終了しない。子プロセスが残っていれば
+        # 出力を閉じないので communicate が時間の上限で終了させ、CPU 時間とメモリの
+        # 上限は子プロセスにも引き継がれている
+
+    returncode = process.returncode
+    text = output.decode("utf-8", "backslashreplace")
+    if resource is not None and limits.cpu_seconds and _cpu_exceeded(
+        returncode, _children_cpu_seconds() - cpu_start, limits.cpu_seconds
+    ):
+        raise _limit_error(program, "cpu", limits.cpu_seconds, text)
+    if limits.memory_mb and returncode != 0 and _OUT_OF_MEMORY.search(text):
+        raise _limit_error(program, "memory", limits.memory_mb, text)
+    return subprocess.CompletedProcess(command, returncode, output)
+
+
+@contextmanager
+def temporary_directory(prefix="latex_editor_", dir=None):
+    """作業用の一時フォルダ（中断・例外のときも削除し、削除の失敗は無視する）"""
+    path = tempfile.mkdtemp(prefix=prefix, dir=dir)
+    try:
+        yield path
+    finally:
+        shutil.rmtree(path, ignore_errors=True)
+
+
+def install_matplotlib():
+    """matplotlib の usetex が実行する latex / dvipng にも上限を付ける"""
+    from matplotlib.texmanager import TexManager
+
+    if getattr(TexManager._run_checked_subprocess, "_limited", False):
+        return  # 置き換え済み
+
+    def run_checked_subprocess(cls, command, tex, *, cwd=None):
+        try:
+            result = run(command, cwd=cwd if cwd is not None else cls._cache_dir)
+        except OSError as e:
+            raise RuntimeError(
+                f"Failed to process string with tex because {command[0]} "
+                "could not be found"
+            ) from e
+        if result.returncode != 0:
+            raise RuntimeError(
+                f"{command[0]} was not able to process the following string:\n"
+                f"{tex!r}\n\n"
+                + result.stdout.decode("utf-8", "backslashreplace")
+            )
+        return result.stdout
+
+    run_checked_subprocess._limited = True
+    TexManager._run_checked_subprocess = classmethod(run_checked_subprocess)
@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+別プロセスの TeX ワーカー（latex_editor_config.json の use_tex_worker で有効にする）
+matplotlib と TeX 周りの初期化（フォントマップ・kpsewhich の検索結果など）を一度だけ行い、
+パイプ経由で数式を受け取って SVG/PNG/PDF/DVI を返す。
+ワーカーが異常終了した場合、TeXWorker が自動で再起動する。
+
+latex は数式ごとに起動する（TeX を常駐させるわけではない）。プリアンブルを毎回
+読み込まずに済むのはプリコンパイル済みフォーマット（tex_format.py）によるもので、
+エディタの中で描画しても同じように効く。プレビューはこのワーカーを使わない。
+
+プロトコル（1 行 1 JSON）:
+    要求: {"id": 1, "equation": "...", "options": {...}, "preamble": "...",
+           "precompile": true, "lint": "on", "limits": {"timeout": 30, ...}}
+    応答: {"id": 1, "ok": true, "data": "<base64>"} / {"id": 1, "ok": false, "error": "..."}
+          （上限を超えた場合は "reason": "timeout" などと "program" も付ける）
+"""
+
+import base64
+import json
+import os
+import queue
+import signal
+import subprocess
+import sys
+import threading
+from dataclasses import asdict
+from pathlib import Path
+
+import tex_process
+from latex_render import (
+    DEFAULT_PREAMBLE,
+    RenderError,
+    RenderOptions,
+    build_math_text,
+    configure_matplotlib,
+    render_to_bytes,
+)
+from render_stats import stats
+
+# 1 つの数式の描画にかける最大時間（秒）
+DEFAULT_TIMEOUT = 60
+# 終了を知らせたワーカーが子プロセスを片付けて終わるまで待つ時間（秒）
+STOP_TIMEOUT = 5
+
+
+def render_dvi(equation, options):
+    """数式を TeX でコンパイルし、DVI のバイト列を返す"""
+    from matplotlib.texmanager import TexManager
+
+    math_text = build_math_text(equation, options.displaystyle)
+    try:
+        dvi_file = TexManager().make_dvi(math_text, options.fontsize)
+    except RenderError:
+        raise
+    except Exception as e:
+        raise RenderError(str(e)) from e
+    return Path(dvi_file).read_bytes()
+
+
+def serve(stdin, stdout):
+    """要求を 1 行ずつ処理する（ワーカープロセス側）"""
+    preamble = None
+    for line in stdin:
+        if not line.strip():
+            continue
+        request = json.loads(line)
+        try:
+            # プリアンブルが変わったときだけ設定し直す
+            requested = (
+                request.get("preamble", DEFAULT_PREAMBLE),
+                request.get("precompile", True),
+                request.get("lint", "on"),
+            )
+            if requested != preamble:
+                preamble = requested
+                configure_matplotlib(*preamble)
+            if "limits" in request:
+                tex_process.configure(tex_process.ProcessLimits(**request["limits"]))
+            options = RenderOptions.from_settings(request["options"])
+            if options.save_format == "dvi":
+                data = render_dvi(request["equation"], options)
+            else:
+                data = render_to_bytes(request["equation"], options)
+            response = {
+                "id": request["id"],
+                "ok": True,
+                "data": base64.b64encode(data).decode("ascii"),
+            }
+        except tex_process.ProcessLimitError as e:
+            response = {
+                "id": request["id"],
+                "ok": False,
+                "error": str(e),
+                "reason": e.reason,
+                "program": e.program,
+                "limit": e.limit,
+            }
+        except Exception as e:
+            response = {"id": request["id"], "ok": False, "error": str(e)}
+        stdout.write(json.dumps(response) + "\n")
+        stdout.flush()
+
+
+class TeXWorker:
+    """TeX ワーカーのクライアント（スレッドセーフ）"""
+
+    def __init__(
+        self,
+        preamble=DEFAULT_PREAMBLE,
+        precompile=True,
+        timeout=DEFAULT_TIMEOUT,
+        lint="on",
+        limits=None,
+    ):
+        self.preamble = preamble
+        self.precompile = precompile
+        self.timeout = timeout
+        self.lint = lint
+        # ワーカーが実行する latex / dvipng の上限（None なら tex_process の既定値）
+        self.limits = limits
+        self._lock = threading.Lock()
+        self._process = None
+        self._responses = None
+        self._next_id = 0
+
+    def _start(self):
+        """ワーカープロセスを起動"""
+        self._process = subprocess.Popen(
+            [sys.executable, "-u", str(Path(__file__).resolve())],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            text=True,
+            encoding="utf-8",
+            cwd=str(Path(__file__).parent),
+        )
+        self._responses = queue.Queue()
+        threading.Thread(
+            target=self._read_responses,
+            args=(self._process.stdout, self._responses),
+            name="tex-worker-reader",
+            daemon=True,
+        ).start()
+
+    @staticmethod
+    def _read_responses(stdout, responses):
+        """ワーカーの応答をキューに入れる（EOF で None）"""
+        for line in stdout:
+            responses.put(json.loads(line))
+        responses.put(None)
+
+    def _stop(self):
+        """ワーカープロセスを実行中の latex などごと終了"""
+        if self._process is None:
+            return
+        if os.name == "nt":
+            tex_process.kill_tree(self._process)
+        else:
+            # latex などは別のセッションで動いているので、ワーカーを強制終了しても
+            # 残ってしまう。SIGTERM で知らせて、ワーカー自身に片付けさせる
+            self._process.terminate()
+            try:
+                self._process.wait(timeout=STOP_TIMEOUT)
+            except subprocess.TimeoutExpired:
+                self._process.kill()
+        self._process.wait()
+        self._process = None
+
+    def _request(self, equation, options):
+        if self._process is None or self._process.poll() is not None:
+            self._start()
+        self._next_id += 1
+        request = {
+            "id": self._next_id,
+            "equation": equation,
+            "options": options.to_dict(),
+            "preamble": self.preamble,
+            "precompile": self.precompile,
+            "lint": self.lint,
+        }
+        if self.limits is not None:
+            request["limits"] = asdict(self.limits)
+        self._process.stdin.write(json.dumps(request) + "\n")
+        self._process.stdin.flush()
+
+        while True:
+            try:
+                response = self._responses.get(timeout=self.timeout)
+            except queue.Empty:
+                # 応答がない場合は TeX ごと強制終了して次回再起動
+                self._stop()
+                raise RenderError(f"レンダリングが {self.timeout} 秒以内に終わりませんでした")
+            if response is None:
+                raise BrokenPipeError("TeX ワーカーが終了しました")
+            if response["id"] == request["id"]:
+                return response
+
+    def render(self, equation, options):
+        """数式を描画し、バイト列を返す（ワーカーが落ちていたら再起動して 1 回だけ再試行）"""
+        with self._lock, stats.stage("tex_worker", format=options.save_format):
+            try:
+                response = self._request(equation, options)
+            except (BrokenPipeError, OSError):
+                self._stop()
+                try:
+                    response = self._request(equation, options)
+                except (BrokenPipeError, OSError) as e:
+                    self._stop()
+                    raise RenderError(f"TeX ワーカーが異常終了しました: {e}") from e
+        if not response["ok"]:
+            if "reason" in response:
+                raise tex_process.ProcessLimitError(
+                    response["error"],
+                    response["program"],
+                    response["reason"],
+                    response["limit"],
+                )
+            raise RenderError(response["error"])
+        return base64.b64decode(response["data"])
+
+    def close(self):
+        """ワーカープロセスを終了"""
+        with self._lock:
+            if self._process is not None:
+                try:
+                    self._process.stdin.close()
+                    self._process.wait(timeout=5)
+                except (OSError, subprocess.TimeoutExpired):
+                    self._stop()
+                self._process = None
+
+
+def _terminate(signum, frame):
+    # 実行中の tex_process.run が latex などを子プロセスごと終了してから終わる
+    raise SystemExit(1)
+
+
+def main():
+    signal.signal(signal.SIGTERM, _terminate)
+    # 標準出力は応答専用にし、それ以外の出力は標準エラーへ
+    stdout = sys.stdout
+    sys.stdout = sys.stderr
+    serve(sys.stdin, stdout)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,320 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+複数のマシンで分担する一括変換のジョブキュー
+共有フォルダ（NFS のホームなど）に置いたファイルだけで動き、サーバーやデータベースは
+使わない。数式はチャンク（既定 16 件）にまとめ、ワーカーはチャンク単位で取得する。
+
+キューのフォルダ:
+    queue.json                     描画の設定（オプション・書き出し先・プリアンブルなど）
+    chunks/000001.json             チャンクの数式（作成後は変更しない）
+    pending/000001                 未着手のチャンクの印
+    leased/000001@host-pid-nonce   取得中のチャンクの印（更新日時がハートビート）
+    results/000001.jsonl           完了したチャンクの結果
+    workers/host-pid-nonce.json    ワーカーの状態（nonce は起動ごとの乱数）
+
+チャンクは pending から leased への rename で取得するので、同時に取得しようとしても
+1 つのワーカーだけが成功する。ワーカーは取得中のチャンクの印の更新日時を定期的に
+更新し、lease_seconds 以上更新されていない（ワーカーが落ちた）チャンクは他の
+ワーカーが pending に戻す。時刻はファイルシステムの更新日時どうしで比べるので、
+マシンの時計がずれていても動く。結果は一時ファイル経由で書き込むので、期限切れの
+あとに元のワーカーが終わって 2 回処理されても、結果が壊れることはない。
+"""
+
+import json
+import os
+import random
+import secrets
+import shutil
+import socket
+import tempfile
+import time
+from dataclasses import dataclass
+from itertools import islice
+from pathlib import Path
+
+from latex_render import RenderError, write_atomic
+
+DEFAULT_CHUNK_SIZE = 16
+DEFAULT_LEASE_SECONDS = 120
+# 未着手のチャンクがないとき、他のワーカーの完了（または期限切れ）を確認する間隔（秒）
+IDLE_POLL_SECONDS = 2
+# 同時に取得するワーカーがぶつからないよう、先頭のこの数のチャンクから選ぶ
+CLAIM_SPREAD = 16
+QUEUE_FILE = "queue.json"
+_FOLDERS = ["chunks", "pending", "leased", "results", "workers"]
+# 起動ごとの乱数（コンテナで再起動するとホスト名も PID も前回と同じになることがある）
+_RUN_NONCE = secrets.token_hex(4)
+
+
+class QueueError(RenderError):
+    """キューがない・壊れている場合の例外"""
+
+
+def worker_id():
+    """このプロセスのワーカー名（ホスト名-PID-起動ごとの乱数）
+
+    乱数を付けるので、同じ名前で再起動したワーカーも前回の取得中のチャンクを
+    自分のものと見なさず、期限切れになれば取り戻す。
+    """
+    return f"{socket.gethostname()}-{os.getpid()}-{_RUN_NONCE}"
+
+
+@dataclass
+class Lease:
+    """取得中のチャンク"""
+
+    chunk: str
+    path: Path
+
+
+def _batched(items, size):
+    iterator = iter(items)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
+
+def _write_json(path, data):
+    path.write_text(json.dumps(data, ensure_ascii=False), encoding="utf-8")
+
+
+class WorkQueue:
+    """共有フォルダのジョブキュー（WorkQueue.create で作成し、各ワーカーで開く）"""
+
+    def __init__(self, directory, worker=None):
+        self.directory = Path(directory)
+        try:
+            self.spec = json.loads(
+                (self.directory / QUEUE_FILE).read_text(encoding="utf-8")
+            )
+        except FileNotFoundError:
+            raise QueueError(f"キューがありません: {self.directory}") from None
+        except ValueError as e:
+            raise QueueError(f"{QUEUE_FILE} が正しくありません: {e}") from None
+        self.worker = worker or worker_id()
+        self.lease_seconds = self.spec["lease_seconds"]
+        # 取得中のチャンクの更新日時を更新する間隔（期限の 1/4）
+        self.renew_interval = self.lease_seconds / 4
+        self._last_reclaim = None
+        self._state = {
+            "host": socket.gethostname(),
+            "pid": os.getpid(),
+            "started": time.time(),
+            "chunks": 0,
+            "items": 0,
+            "reclaimed": 0,
+        }
+
+    @classmethod
+    def create(
+        cls,
+        directory,
+        spec,
+        items,
+        chunk_size=DEFAULT_CHUNK_SIZE,
+        lease_seconds=DEFAULT_LEASE_SECONDS,
+    ):
+        """items（辞書）を chunk_size 件ずつのチャンクにしてキューを作成
+
+        spec は描画の設定（ワーカーはこれに従って描画する）。隣の一時フォルダに
+        作ってから rename するので、複数のマシンが同時に作成しても 1 つだけが残る。
+        既にあった（他のマシンが先に作成した）場合は False を返す。
+        """
+        directory = Path(directory)
+        if (directory / QUEUE_FILE).exists():
+            return False
+        directory.parent.mkdir(parents=True, exist_ok=True)
+        tmp = Path(tempfile.mkdtemp(dir=directory.parent, prefix=f".{directory.name}."))
+        try:
+            for name in _FOLDERS:
+                (tmp / name).mkdir()
+            chunks = total = 0
+            for chunk in _batched(items, chunk_size):
+                chunks += 1
+                name = f"{chunks:06d}"
+                _write_json(tmp / "chunks" / f"{name}.json", chunk)
+                (tmp / "pending" / name).touch()
+                total += len(chunk)
+            spec = dict(
+                spec,
+                chunks=chunks,
+                items=total,
+                lease_seconds=lease_seconds,
+                created=time.time(),
+            )
+            _write_json(tmp / QUEUE_FILE, spec)
+            try:
+                os.rename(tmp, directory)
+            except OSError:
+                if (directory / QUEUE_FILE).exists():
+                    return False  # 他のマシンが先に作成した
+                raise
+            return True
+        finally:
+            shutil.rmtree(tmp, ignore_errors=True)
+
+    def _folder(self, name):
+        return self.directory / name
+
+    def filesystem_time(self):
+        """ファイルシステムの現在時刻（作成したファイルの更新日時）"""
+        fd, path = tempfile.mkstemp(dir=self.directory, prefix=".now.")
+        try:
+            return os.fstat(fd).st_mtime
+        finally:
+            os.close(fd)
+            os.unlink(path)
+
+    def heartbeat(self, **state):
+        """ワーカーの状態を書き出し、ファイルシステムの現在時刻（更新日時）を返す"""
+        self._state.update(state, updated=time.time())
+        path = self._folder("workers") / f"{self.worker}.json"
+        write_atomic(path, json.dumps(self._state).encode("utf-8"))
+        return path.stat().st_mtime
+
+    def claim(self):
+        """未着手のチャンクを 1 つ取得して Lease を返す（なければ None）"""
+        self.reclaim_expired()
+        names = sorted(os.listdir(self._folder("pending")))
+        while names:
+            name = random.choice(names[:CLAIM_SPREAD])
+            names.remove(name)
+            path = self._folder("leased") / f"{name}@{self.worker}"
+            try:
+                os.rename(self._folder("pending") / name, path)
+                # rename では更新日時が変わらないので、取得した時刻にする
+                os.utime(path)
+            except FileNotFoundError:
+                continue  # 他のワーカーが先に取得した
+            return Lease(name, path)
+        return None
+
+    def load(self, lease):
+        """チャンクの数式（辞書のリスト）"""
+        path = self._folder("chunks") / f"{lease.chunk}.json"
+        return json.loads(path.read_text(encoding="utf-8"))
+
+    def renew(self, leases):
+        """取得中のチャンクの期限を延ばす（renew_interval ごとに呼ぶ）"""
+        for lease in leases:
+            try:
+                os.utime(lease.path)
+            except FileNotFoundError:
+                pass  # 期限切れで戻された（結果は complete で書けば同じ）
+        self.heartbeat()
+
+    def complete(self, lease, records):
+        """チャンクの結果（辞書のリスト）を書き込み、取得中の印を消す"""
+        data = "".join(json.dumps(r, ensure_ascii=False) + "\n" for r in records)
+        write_atomic(self._folder("results") / f"{lease.chunk}.jsonl", data.encode())
+        try:
+            os.unlink(lease.path)
+        except FileNotFoundError:
+            pass
+        self._state["chunks"] += 1
+        self._state["items"] += len(records)
+
+    def reclaim_expired(self, force=False):
+        """期限切れのチャンクを未着手に戻し、戻した数を返す（renew_interval に 1 回）"""
+        now = time.monotonic()
+        if not force and self._last_reclaim is not None:
+            if now - self._last_reclaim < self.renew_interval:
+                return 0
+        self._last_reclaim = now
+        filesystem_now = self.heartbeat()
+        reclaimed = 0
+        for entry in os.scandir(self._folder("leased")):
+            name, _, worker = entry.name.partition("@")
+            if worker == self.worker:
+                continue
+            try:
+                if filesystem_now - entry.stat().st_mtime < self.lease_seconds:
+                    continue
+                if (self._folder("results") / f"{name}.jsonl").exists():
+                    os.unlink(entry.path)  # 結果を書いたあと、印を消す前に落ちた
+                    continue
+                os.rename(entry.path, self._folder("pending") / name)
+            except FileNotFoundError:
+                continue  # 完了したか、他のワーカーが先に戻した
+            reclaimed += 1
+        if reclaimed:
+            self._state["reclaimed"] += reclaimed
+        return reclaimed
+
+    def _results_files(self):
+        return sorted(
+            p
+            for p in self._folder("results").glob("*.jsonl")
+            if not p.name.startswith(".")
+        )
+
+    def finished(self):
+        """すべてのチャンクの結果が書き込まれたか"""
+        return len(self._results_files()) >= self.spec["chunks"]
+
+    def status(self):
+        """チャンクの状態ごとの数とワーカーの状態の辞書"""
+        leased = {}
+        now = self.filesystem_time()
+        for entry in os.scandir(self._folder("leased")):
+            name, _, worker = entry.name.partition("@")
+            try:
+                age = now - entry.stat().st_mtime
+            except FileNotFoundError:
+                continue
+            leased[name] = {"worker": worker, "expired": age >= self.lease_seconds}
+        workers = {}
+        for path in self._folder("workers").glob("*.json"):
+            if path.name.startswith("."):
+                continue
+            try:
+                workers[path.stem] = json.loads(path.read_text(encoding="utf-8"))
+                workers[path.stem]["age"] = now - path.stat().st_mtime
+            except (OSError, ValueError):
+                continue  # 書き換え中
+        return {
+            "directory": str(self.directory),
+            "chunks": self.spec["chunks"],
+            "items": self.spec["items"],
+            "pending": len(os.listdir(self._folder("pending"))),
+            "leased": leased,
+            "done": len(self._results_files()),
+            "workers": workers,
+        }
+
+    def results(self):
+        """完了したチャンクの結果を入力と同じ順に 1 件ずつ返す"""
+        for path in self._results_files():
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    yield json.loads(line)
+
+    def write_report(self, path):
+        """結果を入力と同じ順に 1 つの JSONL にまとめ、集計の辞書を返す
+
+        複数のワーカーが同時に書いても壊れないよう、一時ファイル経由で置き換える。
+        """
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        summary = {"succeeded": 0, "failed": 0, "workers": {}, "reasons": {}}
+        fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as out:
+                for record in self.results():
+                    out.write(json.dumps(record, ensure_ascii=False) + "\n")
+                    summary["succeeded" if record["ok"] else "failed"] += 1
+                    worker = record.get("worker")
+                    summary["workers"][worker] = summary["workers"].get(worker, 0) + 1
+                    if "reason" in record:
+                        reason = record["reason"]
+                        summary["reasons"][reason] = (
+                            summary["reasons"].get(reason, 0) + 1
+                        )
+            os.replace(tmp, path)
+        except BaseException:
+            try:
+                os.unlink(tmp)
+            except OSError:
+                pass
+            raise
+        return summary